@@ -0,0 +1,62 @@
+"""Cold-start benchmark: import time of `main` and time to the first served request.
+
+Every sample runs in a fresh interpreter so module caches don't hide regressions.
+Exits non-zero when a median exceeds its budget, so it can gate CI:
+
+    python bench_startup.py --runs 5 --max-import 1.5 --max-first-request 0.5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+SAMPLE = r"""
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(main.app)
+t2 = time.perf_counter()
+resp = client.get("/health")
+t3 = time.perf_counter()
+assert resp.status_code == 200, resp.text
+heavy = [m for m in ("langchain", "yaml", "google.generativeai", "supabase") if m in __import__("sys").modules]
+print(json.dumps({"import": t1 - t0, "first_request": t3 - t2, "heavy_modules": heavy}))
+"""
+
+
+def run_sample():
+    out = subprocess.run([sys.executable, "-c", SAMPLE], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import", type=float, default=None, help="budget in seconds for the median import time")
+    parser.add_argument("--max-first-request", type=float, default=None, help="budget in seconds for the median first request")
+    args = parser.parse_args()
+
+    samples = [run_sample() for _ in range(args.runs)]
+    import_median = statistics.median(s["import"] for s in samples)
+    first_median = statistics.median(s["first_request"] for s in samples)
+    print(f"import main:    median {import_median * 1000:.1f} ms over {args.runs} runs")
+    print(f"first request:  median {first_median * 1000:.1f} ms over {args.runs} runs")
+    heavy = samples[-1]["heavy_modules"]
+    if heavy:
+        print(f"heavy modules imported at startup: {', '.join(heavy)}")
+
+    failed = False
+    if args.max_import is not None and import_median > args.max_import:
+        print(f"FAIL: import time {import_median:.3f}s exceeds budget {args.max_import:.3f}s")
+        failed = True
+    if args.max_first_request is not None and first_median > args.max_first_request:
+        print(f"FAIL: first request {first_median:.3f}s exceeds budget {args.max_first_request:.3f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
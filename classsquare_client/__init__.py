@@ -0,0 +1,25 @@
+"""Python client for the ClassSquare API.
+
+    from classsquare_client import ClassSquareClient
+
+    with ClassSquareClient("http://localhost:8000") as api:
+        replies = api.ask_many(comment_ids)
+"""
+from classsquare_client.client import AsyncClassSquareClient, ClassSquareClient, ClassSquareError
+from classsquare_client.types import (
+    AskReply, FeedCloned, FeedCreated, FeedPage, FeedPopulated, FeedSpec, GenerationJob, Persona,
+)
+
+__all__ = [
+    "AsyncClassSquareClient",
+    "ClassSquareClient",
+    "ClassSquareError",
+    "AskReply",
+    "FeedCloned",
+    "FeedCreated",
+    "FeedPage",
+    "FeedPopulated",
+    "FeedSpec",
+    "GenerationJob",
+    "Persona",
+]
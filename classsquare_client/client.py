@@ -0,0 +1,266 @@
+"""Sync and asyncio clients for the ClassSquare API.
+
+Both keep one pooled keep-alive connection set per client, so reuse a client
+rather than creating one per call. Failed calls are retried with exponential
+backoff when the failure is worth retrying: connection errors, timeouts, 429
+(honouring Retry-After) and 502/503/504. Feed generation calls send an
+Idempotency-Key that stays the same across retries, so a retry never creates a
+second feed. While the server's LLM is unavailable, those calls return a
+`GenerationJob` instead; poll it with `generation_job(job_id)`.
+"""
+import asyncio
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from classsquare_client.types import (
+    AskReply, FeedCloned, FeedCreated, FeedPage, FeedPopulated, FeedSpec, GenerationJob, Persona,
+)
+
+DEFAULT_BASE_URL = "http://localhost:8000"
+RETRY_STATUSES = {429, 502, 503, 504}
+# generating a feed makes dozens of LLM calls
+DEFAULT_TIMEOUT = httpx.Timeout(300.0, connect=10.0)
+
+
+class ClassSquareError(Exception):
+    def __init__(self, status_code: int, detail):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+def _retry_delay(attempt: int, response: httpx.Response | None, backoff: float, max_backoff: float) -> float:
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return min(float(response.headers["Retry-After"]), max_backoff)
+    return min(backoff * 2 ** attempt, max_backoff) * random.uniform(0.5, 1.0)
+
+
+def _result(response: httpx.Response):
+    if response.is_success:
+        return response.json()
+    try:
+        detail = response.json().get("detail", response.text)
+    except ValueError:
+        detail = response.text
+    raise ClassSquareError(response.status_code, detail)
+
+
+def _dry_run(dry_run: bool) -> str:
+    # a dry run returns the generation plan (calls, tokens, estimated seconds) instead of generating
+    return "?dry_run=true" if dry_run else ""
+
+
+def _limits(max_connections: int) -> httpx.Limits:
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+def _feed_body(class_id, subject_id, global_prompt, topic, selected_personas, manual_personas) -> dict:
+    return {
+        "class_id": class_id,
+        "subject_id": subject_id,
+        "global_prompt": global_prompt,
+        "topic": topic,
+        "selected_personas": list(selected_personas),
+        "manual_personas": list(manual_personas),
+    }
+
+
+def _populate_body(feed_id, topic, num_initial_posts, num_comments_per_post, lazy, first_page) -> dict:
+    # a lazy feed gets its first `first_page` posts now and the rest as get_feed pages approach them
+    return {
+        "feed_id": feed_id,
+        "topic": topic,
+        "num_initial_posts": num_initial_posts,
+        "num_comments_per_post": num_comments_per_post,
+        "lazy": lazy,
+        "first_page": first_page,
+    }
+
+
+class ClassSquareClient:
+    """Blocking client; safe to share between threads."""
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, *, max_connections: int = 20, retries: int = 4,
+                 backoff: float = 0.5, max_backoff: float = 30.0, timeout: httpx.Timeout | float = DEFAULT_TIMEOUT):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_connections = max_connections
+        self._http = httpx.Client(base_url=base_url, timeout=timeout, limits=_limits(max_connections))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._http.close()
+
+    def _request(self, method: str, path: str, json: dict | None = None, headers: dict | None = None):
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                response = self._http.request(method, path, json=json, headers=headers)
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return _result(response)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            time.sleep(_retry_delay(attempt, response, self.backoff, self.max_backoff))
+
+    def health(self) -> dict:
+        return self._request("GET", "/health")
+
+    def history(self, user_id: str) -> list[dict]:
+        return self._request("GET", f"/history/{user_id}")["interactions"]
+
+    def get_feed(self, feed_id: str, offset: int = 0, limit: int = 20) -> FeedPage:
+        return self._request("GET", f"/feeds/{feed_id}?offset={offset}&limit={limit}")
+
+    def ask(self, comment_id: str) -> AskReply:
+        return self._request("POST", "/ask", {"comment_id": comment_id})
+
+    def generate_personas(self, subject_id: str, topic: str, count: int = 15) -> list[Persona]:
+        return self._request("POST", "/generate-personas", {"subject_id": subject_id, "topic": topic, "count": count})["personas"]
+
+    def generate_prompt(self, subject_id: str, class_id: str, topic: str, personas: list[str]) -> str:
+        body = {"subject_id": subject_id, "class_id": class_id, "topic": topic, "personas": personas}
+        return self._request("POST", "/generate-prompt", body)["prompt"]
+
+    def generate_feed(self, class_id: str, subject_id: str, global_prompt: str, topic: str,
+                      selected_personas: list[Persona], manual_personas: list[Persona] = (),
+                      idempotency_key: str | None = None, dry_run: bool = False) -> FeedCreated | GenerationJob:
+        body = _feed_body(class_id, subject_id, global_prompt, topic, selected_personas, manual_personas)
+        return self._request("POST", "/generate-feed" + _dry_run(dry_run), body, {"Idempotency-Key": idempotency_key or str(uuid.uuid4())})
+
+    def populate_feed(self, feed_id: str, topic: str, num_initial_posts: int = 8, num_comments_per_post: int = 8,
+                      idempotency_key: str | None = None, dry_run: bool = False, lazy: bool = False,
+                      first_page: int = 3) -> FeedPopulated | GenerationJob:
+        body = _populate_body(feed_id, topic, num_initial_posts, num_comments_per_post, lazy, first_page)
+        return self._request("POST", "/populate-feed" + _dry_run(dry_run), body, {"Idempotency-Key": idempotency_key or str(uuid.uuid4())})
+
+    def generation_job(self, job_id: str) -> GenerationJob:
+        return self._request("GET", f"/generation-jobs/{job_id}")
+
+    def clone_feed(self, feed_id: str, title: str | None = None,
+                   global_prompt: str | None = None) -> FeedCloned:
+        body = {"feed_id": feed_id, "title": title, "global_prompt": global_prompt}
+        return self._request("POST", "/clone-feed", body)
+
+    def create_subject(self, name: str, description: str, syllabus: str) -> str:
+        return self._request("POST", "/subjects", {"name": name, "description": description, "syllabus": syllabus})["id"]
+
+    def map(self, fn, items, concurrency: int | None = None) -> list:
+        """Calls `fn(item)` for every item, `concurrency` at a time; results (or the exception raised) in input order."""
+        def run(item):
+            try:
+                return fn(item)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=concurrency or self.max_connections) as pool:
+            return list(pool.map(run, items))
+
+    def ask_many(self, comment_ids: list[str], concurrency: int = 8) -> list:
+        return self.map(self.ask, comment_ids, concurrency)
+
+    def generate_feeds(self, specs: list[FeedSpec], concurrency: int = 4) -> list:
+        return self.map(lambda spec: self.generate_feed(**spec), specs, concurrency)
+
+
+class AsyncClassSquareClient:
+    """asyncio client with the same methods as `ClassSquareClient`, as coroutines."""
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, *, max_connections: int = 20, retries: int = 4,
+                 backoff: float = 0.5, max_backoff: float = 30.0, timeout: httpx.Timeout | float = DEFAULT_TIMEOUT):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_connections = max_connections
+        self._http = httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=_limits(max_connections))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    async def _request(self, method: str, path: str, json: dict | None = None, headers: dict | None = None):
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                response = await self._http.request(method, path, json=json, headers=headers)
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return _result(response)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(_retry_delay(attempt, response, self.backoff, self.max_backoff))
+
+    async def health(self) -> dict:
+        return await self._request("GET", "/health")
+
+    async def history(self, user_id: str) -> list[dict]:
+        return (await self._request("GET", f"/history/{user_id}"))["interactions"]
+
+    async def get_feed(self, feed_id: str, offset: int = 0, limit: int = 20) -> FeedPage:
+        return await self._request("GET", f"/feeds/{feed_id}?offset={offset}&limit={limit}")
+
+    async def ask(self, comment_id: str) -> AskReply:
+        return await self._request("POST", "/ask", {"comment_id": comment_id})
+
+    async def generate_personas(self, subject_id: str, topic: str, count: int = 15) -> list[Persona]:
+        body = {"subject_id": subject_id, "topic": topic, "count": count}
+        return (await self._request("POST", "/generate-personas", body))["personas"]
+
+    async def generate_prompt(self, subject_id: str, class_id: str, topic: str, personas: list[str]) -> str:
+        body = {"subject_id": subject_id, "class_id": class_id, "topic": topic, "personas": personas}
+        return (await self._request("POST", "/generate-prompt", body))["prompt"]
+
+    async def generate_feed(self, class_id: str, subject_id: str, global_prompt: str, topic: str,
+                            selected_personas: list[Persona], manual_personas: list[Persona] = (),
+                            idempotency_key: str | None = None, dry_run: bool = False) -> FeedCreated | GenerationJob:
+        body = _feed_body(class_id, subject_id, global_prompt, topic, selected_personas, manual_personas)
+        return await self._request("POST", "/generate-feed" + _dry_run(dry_run), body, {"Idempotency-Key": idempotency_key or str(uuid.uuid4())})
+
+    async def populate_feed(self, feed_id: str, topic: str, num_initial_posts: int = 8, num_comments_per_post: int = 8,
+                            idempotency_key: str | None = None, dry_run: bool = False, lazy: bool = False,
+                            first_page: int = 3) -> FeedPopulated | GenerationJob:
+        body = _populate_body(feed_id, topic, num_initial_posts, num_comments_per_post, lazy, first_page)
+        return await self._request("POST", "/populate-feed" + _dry_run(dry_run), body, {"Idempotency-Key": idempotency_key or str(uuid.uuid4())})
+
+    async def generation_job(self, job_id: str) -> GenerationJob:
+        return await self._request("GET", f"/generation-jobs/{job_id}")
+
+    async def clone_feed(self, feed_id: str, title: str | None = None,
+                         global_prompt: str | None = None) -> FeedCloned:
+        body = {"feed_id": feed_id, "title": title, "global_prompt": global_prompt}
+        return await self._request("POST", "/clone-feed", body)
+
+    async def create_subject(self, name: str, description: str, syllabus: str) -> str:
+        body = {"name": name, "description": description, "syllabus": syllabus}
+        return (await self._request("POST", "/subjects", body))["id"]
+
+    async def map(self, fn, items, concurrency: int | None = None) -> list:
+        """Awaits `fn(item)` for every item, `concurrency` at a time; results (or the exception raised) in input order."""
+        semaphore = asyncio.Semaphore(concurrency or self.max_connections)
+
+        async def run(item):
+            async with semaphore:
+                return await fn(item)
+
+        return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+    async def ask_many(self, comment_ids: list[str], concurrency: int = 8) -> list:
+        return await self.map(self.ask, comment_ids, concurrency)
+
+    async def generate_feeds(self, specs: list[FeedSpec], concurrency: int = 4) -> list:
+        return await self.map(lambda spec: self.generate_feed(**spec), specs, concurrency)
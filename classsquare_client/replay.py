@@ -0,0 +1,177 @@
+"""Replays captured traffic against a build and compares latency between runs.
+
+    python -m classsquare_client.replay run captures/*.jsonl --api http://localhost:8000 --speed 2 --out build-a.jsonl
+    python -m classsquare_client.replay compare build-a.jsonl build-b.jsonl
+
+`run` sends the requests of capture files (see core/capture.py) with their
+original spacing divided by --speed (0 sends them as fast as --concurrency
+allows). Sanitized strings are sent as filler text of the captured length,
+requests that were sent with an Idempotency-Key get a fresh one, and file
+uploads are skipped. Each result is written to --out with its latency and how
+late it was sent ("lag_ms"). A large lag means the replaying machine, not the
+build, was the bottleneck.
+
+`compare` prints per-endpoint p50/p90/p99 latency and error counts of two
+result or capture files, with the ratio of the second to the first.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+from classsquare_client.client import DEFAULT_BASE_URL
+
+FILLER = "lorem ipsum dolor sit amet "
+
+
+def read_records(paths: list) -> list:
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return sorted(records, key=lambda r: r.get("t", 0))
+
+
+def fill(shape):
+    """A body matching `shape`, with each {"$str": n} replaced by n characters of filler."""
+    if isinstance(shape, dict):
+        if set(shape) == {"$str"}:
+            return (FILLER * (shape["$str"] // len(FILLER) + 1))[:shape["$str"]]
+        return {k: fill(v) for k, v in shape.items()}
+    if isinstance(shape, list):
+        return [fill(v) for v in shape]
+    return shape
+
+
+async def send(http: httpx.AsyncClient, record: dict) -> dict:
+    headers = {"Idempotency-Key": str(uuid.uuid4())} if record.get("idempotency_key") else None
+    url = record["path"] + (f"?{record['query']}" if record.get("query") else "")
+    start = time.perf_counter()
+    try:
+        response = await http.request(record["method"], url, json=fill(record["body"]) if "body" in record else None, headers=headers)
+        status = response.status_code
+    except httpx.HTTPError as e:
+        status = f"error: {type(e).__name__}"
+    return {"status": status, "latency_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+
+async def run(args):
+    records = [r for r in read_records(args.captures) if not args.endpoint or r["endpoint"] in args.endpoint]
+    skipped = [r for r in records if "body_bytes" in r]
+    records = [r for r in records if "body_bytes" not in r]
+    if not records:
+        print("Nothing to replay")
+        return 1
+    semaphore = asyncio.Semaphore(args.concurrency)
+    first = records[0]["t"]
+
+    async with httpx.AsyncClient(base_url=args.api, timeout=args.timeout, limits=httpx.Limits(max_connections=args.concurrency)) as http:
+        began = time.perf_counter()
+
+        async def replay(record):
+            due = (record["t"] - first) / args.speed if args.speed else 0.0
+            await asyncio.sleep(max(0.0, due - (time.perf_counter() - began)))
+            async with semaphore:
+                lag = time.perf_counter() - began - due
+                result = await send(http, record)
+            return {
+                "endpoint": record["endpoint"],
+                "method": record["method"],
+                "path": record["path"],
+                "captured_latency_ms": record.get("latency_ms"),
+                "lag_ms": round(max(0.0, lag) * 1000, 1),
+                **result,
+            }
+
+        results = await asyncio.gather(*(replay(r) for r in records))
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    print(f"Replayed {len(results)} requests in {time.perf_counter() - began:.1f}s ({len(skipped)} uploads skipped), results in {args.out}")
+    print_summary({args.out: results})
+    return 0
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(records: list) -> dict:
+    by_endpoint = defaultdict(lambda: {"latencies": [], "errors": 0})
+    for r in records:
+        entry = by_endpoint[f"{r['method']} {r['endpoint']}"]
+        entry["latencies"].append(r["latency_ms"])
+        if not isinstance(r["status"], int) or r["status"] >= 500:
+            entry["errors"] += 1
+    return {
+        endpoint: {
+            "count": len(e["latencies"]),
+            "errors": e["errors"],
+            "p50": percentile(e["latencies"], 0.5),
+            "p90": percentile(e["latencies"], 0.9),
+            "p99": percentile(e["latencies"], 0.99),
+        }
+        for endpoint, e in by_endpoint.items()
+    }
+
+
+def print_summary(runs: dict):
+    for name, records in runs.items():
+        print(f"\n{name}")
+        print(f"  {'endpoint':<40} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+        for endpoint, s in sorted(summarize(records).items()):
+            print(f"  {endpoint:<40} {s['count']:>6} {s['errors']:>6} {s['p50']:>9} {s['p90']:>9} {s['p99']:>9}")
+
+
+def _ratio(a, b) -> str:
+    return f"{b / a:.2f}x" if a and b is not None else "-"
+
+
+def compare(args):
+    before = summarize(read_records([args.before]))
+    after = summarize(read_records([args.after]))
+    print(f"{'endpoint':<40} {'count':>11} {'errors':>9} {'p50 ms':>21} {'p90 ms':>21} {'p99 ms':>21}")
+    for endpoint in sorted(set(before) | set(after)):
+        a = before.get(endpoint, {})
+        b = after.get(endpoint, {})
+        columns = [
+            f"{a.get('count', 0)}/{b.get('count', 0)}".rjust(11),
+            f"{a.get('errors', 0)}/{b.get('errors', 0)}".rjust(9),
+        ]
+        for q in ("p50", "p90", "p99"):
+            columns.append(f"{a.get(q)}/{b.get(q)} {_ratio(a.get(q), b.get(q))}".rjust(21))
+        print(f"{endpoint:<40} " + " ".join(columns))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    replay = commands.add_parser("run", help="replay capture files against a build")
+    replay.add_argument("captures", nargs="+", help="capture files written by CLASSSQUARE_CAPTURE_DIR")
+    replay.add_argument("--api", default=DEFAULT_BASE_URL)
+    replay.add_argument("--speed", type=float, default=1.0, help="time scale; 2 replays twice as fast, 0 without waiting")
+    replay.add_argument("--concurrency", type=int, default=256, help="requests in flight at most")
+    replay.add_argument("--endpoint", action="append", help="only replay this route template, e.g. /ask (repeatable)")
+    replay.add_argument("--timeout", type=float, default=300.0)
+    replay.add_argument("--out", required=True, help="file to write the results to")
+
+    diff = commands.add_parser("compare", help="compare latency of two result or capture files")
+    diff.add_argument("before")
+    diff.add_argument("after")
+
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(run(args)) if args.command == "run" else compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Seeds one feed per syllabus topic for a class, several topics at a time.
+
+    python -m classsquare_client.seed --class-id <id> --subject-id <id> --syllabus syllabus.json --concurrency 6
+
+Each topic goes through /generate-personas, /generate-prompt and /generate-feed;
+a feed accepted as a job (while the LLM is unavailable) is waited for.
+Topics that fail are reported at the end and can be re-run with --topic.
+"""
+import argparse
+import asyncio
+import json
+
+from classsquare_client.client import DEFAULT_BASE_URL, AsyncClassSquareClient
+
+JOB_POLL_SECONDS = 5
+
+
+def syllabus_topics(path: str) -> list:
+    """`topic_title`s of a syllabus file in the format file_to_syllabus.py writes."""
+    with open(path, encoding="utf-8") as f:
+        syllabus = json.load(f)
+    syllabus = syllabus.get("syllabus", syllabus)
+    topics = [
+        chapter["topic_title"].strip()
+        for section in syllabus.get("subject_curriculum", [])
+        for chapter in section.get("chapters_or_topics", [])
+        if chapter.get("topic_title")
+    ]
+    return list(dict.fromkeys(topics))
+
+
+async def seed_topic(api: AsyncClassSquareClient, class_id: str, subject_id: str, topic: str, personas: int):
+    generated = await api.generate_personas(subject_id, topic, personas)
+    prompt = await api.generate_prompt(subject_id, class_id, topic, [p["name"] for p in generated])
+    result = await api.generate_feed(class_id, subject_id, prompt, topic, generated)
+    # while the LLM is unavailable the feed is generated as a job once it is back
+    while result.get("status") in ("queued", "running"):
+        await asyncio.sleep(JOB_POLL_SECONDS)
+        result = await api.generation_job(result["job_id"])
+    if result.get("status") == "failed":
+        raise RuntimeError(f"job {result['job_id']} failed: {result.get('error')}")
+    return result.get("result", result)
+
+
+async def seed(args):
+    topics = list(args.topic or []) + (syllabus_topics(args.syllabus) if args.syllabus else [])
+    async with AsyncClassSquareClient(args.api, max_connections=args.concurrency) as api:
+        results = await api.map(
+            lambda topic: seed_topic(api, args.class_id, args.subject_id, topic, args.personas),
+            topics,
+            args.concurrency,
+        )
+    failed = []
+    for topic, result in zip(topics, results):
+        if isinstance(result, Exception):
+            failed.append(topic)
+            print(f"FAILED {topic}: {result}")
+        else:
+            print(f"{topic}: feed {result['feed_id']} ({result['posts_created']} posts)")
+    print(f"Seeded {len(topics) - len(failed)} of {len(topics)} topics")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--api", default=DEFAULT_BASE_URL)
+    parser.add_argument("--class-id", required=True)
+    parser.add_argument("--subject-id", required=True)
+    parser.add_argument("--syllabus", help="syllabus JSON file; one feed per topic_title")
+    parser.add_argument("--topic", action="append", help="a topic to seed (repeatable)")
+    parser.add_argument("--personas", type=int, default=8, help="personas to generate per topic")
+    parser.add_argument("--concurrency", type=int, default=4, help="topics generated at once")
+    args = parser.parse_args()
+    if not args.syllabus and not args.topic:
+        parser.error("give --syllabus or --topic")
+    raise SystemExit(asyncio.run(seed(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Response shapes of the ClassSquare API."""
+from typing import TypedDict
+
+
+class Persona(TypedDict, total=False):
+    id: str
+    name: str
+    prompt: str
+
+
+class AskReply(TypedDict, total=False):
+    reply: str | None  # None when moderation hid the comment
+    hidden: bool
+
+
+class FeedCreated(TypedDict):
+    feed_id: str
+    posts_created: int
+    personas_used: list[str]
+    topic_used: str
+    message: str
+
+
+class FeedCloned(TypedDict):
+    feed_id: str
+    source_feed_id: str
+    posts_created: int
+    comments_created: int
+    message: str
+
+
+class FeedPopulated(TypedDict):
+    message: str
+    posts_created: int
+    comments_created: int
+    posts_deferred: int
+    topic_used: str
+
+
+class FeedPage(TypedDict):
+    feed: dict
+    posts: list[dict]  # each with "comments", each comment with nested "replies"
+    offset: int
+    limit: int
+    next_offset: int | None
+    pending_posts: int  # posts of a lazy feed not generated yet
+
+
+class GenerationJob(TypedDict, total=False):
+    """What /generate-feed and /populate-feed answer (with 202) while the LLM is unavailable."""
+    job_id: str
+    scope: str
+    status: str  # queued, running, done or failed
+    result: dict  # the FeedCreated / FeedPopulated once done
+    error: str
+
+
+class FeedSpec(TypedDict, total=False):
+    """Arguments of one `generate_feed` call, for `generate_feeds`."""
+    class_id: str
+    subject_id: str
+    global_prompt: str
+    topic: str
+    selected_personas: list[Persona]
+    manual_personas: list[Persona]
+    idempotency_key: str
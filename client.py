@@ -1,9 +1,8 @@
-import requests
+from classsquare_client import ClassSquareClient
 
 def test_ask(comment_id: str):
-    response = requests.post("http://localhost:8000/ask", json={"comment_id": comment_id})
-    print("Status:", response.status_code)
-    print("Response:", response.json())
+    with ClassSquareClient("http://localhost:8000") as api:
+        print("Response:", api.ask(comment_id))
 
 # Replace with your actual comment ID
-test_ask("2792366d-4d15-4063-aa3e-3b219c7b4f3c")
\ No newline at end of file
+test_ask("2792366d-4d15-4063-aa3e-3b219c7b4f3c")
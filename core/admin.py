@@ -0,0 +1,23 @@
+"""Access check for operator-only endpoints and headers.
+
+Admin access is a shared secret in CLASSSQUARE_ADMIN_TOKEN, sent as the
+`X-Admin-Token` header. Without a configured token every admin check fails.
+"""
+import hmac
+
+from fastapi import Header, HTTPException
+
+from core.settings import get_settings
+
+ADMIN_HEADER = "X-Admin-Token"
+
+
+def is_admin(token: str | None) -> bool:
+    expected = get_settings().admin_token
+    return bool(expected and token and hmac.compare_digest(token, expected))
+
+
+def require_admin(x_admin_token: str | None = Header(None)):
+    if not is_admin(x_admin_token):
+        # don't advertise that admin endpoints exist
+        raise HTTPException(status_code=404, detail="Not Found")
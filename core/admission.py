@@ -0,0 +1,172 @@
+"""Admission control for LLM-backed endpoints.
+
+Every LLM-backed request runs inside `admit(class_key, user_key)`. At most
+`max_active` such requests run at once per worker, at most `class_active` of
+them for one class and `user_active` for one user. Anything beyond that waits
+in its class's queue. When a slot frees up, the classes with waiting requests
+take turns (round robin), so a class sending 35 requests at once only
+delays itself and not the class that sends one.
+
+A request is shed with 429 and a Retry-After estimate in two cases: when its
+class's queue (or the worker's total queue) is full, or when it has waited
+longer than `queue_timeout`. A client that gives up sooner is taken out of the
+queue when its request is cancelled.
+"""
+import asyncio
+import math
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from core.settings import get_settings
+
+
+class _Waiter:
+    __slots__ = ("class_key", "user_key", "future")
+
+    def __init__(self, class_key, user_key, future):
+        self.class_key = class_key
+        self.user_key = user_key
+        self.future = future
+
+
+class AdmissionController:
+    def __init__(self, max_active: int, class_active: int, user_active: int,
+                 class_queue: int, total_queue: int, queue_timeout: float):
+        self.max_active = max_active
+        self.class_active = class_active
+        self.user_active = user_active
+        self.class_queue = class_queue
+        self.total_queue = total_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.shed = 0
+        self._by_class = Counter()
+        self._by_user = Counter()
+        self._queues = {}
+        self._turns = deque()
+        # moving average of how long an admitted request holds its slot, for Retry-After
+        self._service_time = 5.0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        return {"active": self.active, "queued": self.queued, "shed": self.shed}
+
+    def _eligible(self, class_key, user_key) -> bool:
+        return (
+            self.active < self.max_active
+            and self._by_class[class_key] < self.class_active
+            and (user_key is None or self._by_user[user_key] < self.user_active)
+        )
+
+    def _acquire(self, class_key, user_key):
+        self.active += 1
+        self._by_class[class_key] += 1
+        if user_key is not None:
+            self._by_user[user_key] += 1
+
+    def _release(self, class_key, user_key, held: float):
+        self.active -= 1
+        self._by_class[class_key] -= 1
+        if not self._by_class[class_key]:
+            del self._by_class[class_key]
+        if user_key is not None:
+            self._by_user[user_key] -= 1
+            if not self._by_user[user_key]:
+                del self._by_user[user_key]
+        self._service_time = 0.8 * self._service_time + 0.2 * held
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hands free slots to waiting requests, one class at a time in turn."""
+        while True:
+            # forget waiters that timed out or were cancelled, and classes left with none
+            for class_key in list(self._queues):
+                queue = self._queues[class_key] = deque(w for w in self._queues[class_key] if not w.future.done())
+                if not queue:
+                    del self._queues[class_key]
+                    self._turns.remove(class_key)
+            if self.active >= self.max_active:
+                return
+            for _ in range(len(self._turns)):
+                class_key = self._turns[0]
+                self._turns.rotate(-1)
+                queue = self._queues[class_key]
+                waiter = next((w for w in queue if self._eligible(class_key, w.user_key)), None)
+                if waiter is not None:
+                    queue.remove(waiter)
+                    self._acquire(class_key, waiter.user_key)
+                    waiter.future.set_result(None)
+                    break
+            else:
+                return
+
+    def retry_after(self, class_key) -> int:
+        ahead = len(self._queues.get(class_key, ())) + 1
+        return max(1, min(60, math.ceil(self._service_time * ahead / self.class_active)))
+
+    def expected_wait(self, class_key) -> int:
+        """Seconds a request of this class would likely wait for a slot right now."""
+        return 0 if self._eligible(class_key, None) else self.retry_after(class_key)
+
+    def _reject(self, class_key, reason: str):
+        self.shed += 1
+        raise HTTPException(
+            status_code=429,
+            detail=reason,
+            headers={"Retry-After": str(self.retry_after(class_key))},
+        )
+
+    @asynccontextmanager
+    async def admit(self, class_key: str, user_key: str | None = None):
+        queue = self._queues.get(class_key)
+        # free slots are always handed to waiters first, so whoever still waits is blocked by
+        # their own caps and a newcomer with room can go ahead without jumping the queue
+        if self._eligible(class_key, user_key):
+            self._acquire(class_key, user_key)
+        else:
+            if len(queue or ()) >= self.class_queue or self.queued >= self.total_queue:
+                self._reject(class_key, "Too many requests queued, try again shortly")
+            future = asyncio.get_running_loop().create_future()
+            if queue is None:
+                queue = self._queues[class_key] = deque()
+                self._turns.append(class_key)
+            queue.append(_Waiter(class_key, user_key, future))
+            try:
+                await asyncio.wait_for(future, self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._dispatch()  # drops the expired waiter
+                self._reject(class_key, "Request waited too long in the queue, try again shortly")
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # the slot was granted just as the client went away
+                    self._release(class_key, user_key, 0.0)
+                raise
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(class_key, user_key, time.monotonic() - start)
+
+
+_controller = None
+
+
+def get_admission() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        settings = get_settings()
+        _controller = AdmissionController(
+            max_active=settings.admission_max_active,
+            class_active=settings.admission_class_active,
+            user_active=settings.admission_user_active,
+            class_queue=settings.admission_class_queue,
+            total_queue=settings.admission_total_queue,
+            queue_timeout=settings.admission_queue_timeout,
+        )
+    return _controller
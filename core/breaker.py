@@ -0,0 +1,130 @@
+"""Circuit breaker around calls to the LLM provider.
+
+Routing (core.routing) moves a task off one slow or failing model. The breaker
+handles the provider as a whole being down: once too many recent calls in this
+worker failed or took longer than `breaker_slow_seconds`, the circuit opens and
+every LLM call raises `CircuitOpenError` at once, instead of tying up a worker
+thread until it times out.
+
+After `breaker_open_seconds` the circuit is half-open. A single probe call is
+let through. If it succeeds the circuit closes, otherwise it opens again.
+Request handlers check `available()` up front to take their degraded path (see
+core.deferred) without making the call.
+"""
+import threading
+import time
+from collections import deque
+
+from core.settings import get_settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+WINDOW_CALLS = 50
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("The language model is unavailable right now")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, error_rate: float, slow_seconds: float, min_calls: int, window: float, open_seconds: float):
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.opened = 0
+        self.rejected = 0
+        self._probe_started = None
+        self._calls = deque(maxlen=WINDOW_CALLS)
+        self._lock = threading.Lock()
+
+    def _retry_after(self, now: float) -> float:
+        return max(1.0, self.opened_at + self.open_seconds - now)
+
+    def _advance(self, now: float):
+        if self.state == OPEN and now >= self.opened_at + self.open_seconds:
+            self.state = HALF_OPEN
+            self._probe_started = None
+
+    def available(self) -> bool:
+        """Whether a call made now would be let through."""
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now)
+            if self.state == HALF_OPEN:
+                # a probe that never reported back doesn't keep the circuit shut forever
+                return self._probe_started is None or now - self._probe_started > self.open_seconds
+            return self.state == CLOSED
+
+    def before_call(self):
+        """Raises CircuitOpenError unless the call may go ahead; in the half-open state it becomes the probe."""
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now)
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and (self._probe_started is None or now - self._probe_started > self.open_seconds):
+                self._probe_started = now
+                return
+            self.rejected += 1
+            raise CircuitOpenError(self._retry_after(now))
+
+    def record(self, latency: float, ok: bool):
+        failed = not ok or latency > self.slow_seconds
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN and self._probe_started is not None:
+                if failed:
+                    self._open(now)
+                else:
+                    self.state = CLOSED
+                    self._calls.clear()
+                return
+            if self.state != CLOSED:
+                # late answers of calls started before the circuit opened
+                return
+            self._calls.append((now, failed))
+            recent = [f for t, f in self._calls if t >= now - self.window]
+            if len(recent) >= self.min_calls and sum(recent) / len(recent) > self.error_rate:
+                self._open(now)
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.opened += 1
+        self._calls.clear()
+        print(f"LLM circuit opened for {self.open_seconds:.0f}s")
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return self._retry_after(time.monotonic())
+
+    def stats(self) -> dict:
+        self.available()
+        return {"state": self.state, "opened": self.opened, "rejected": self.rejected}
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+
+def get_breaker() -> CircuitBreaker:
+    global _breaker
+    if _breaker is None:
+        with _breaker_lock:
+            if _breaker is None:
+                settings = get_settings()
+                _breaker = CircuitBreaker(
+                    settings.breaker_error_rate,
+                    settings.breaker_slow_seconds,
+                    settings.breaker_min_calls,
+                    settings.breaker_window,
+                    settings.breaker_open_seconds,
+                )
+    return _breaker
@@ -0,0 +1,238 @@
+"""Host-wide cache shared by every uvicorn worker on the machine.
+
+Entries live in a SQLite database in WAL mode, so any number of worker processes
+can read concurrently while one writes. `get_or_compute` takes a short lease on
+the key before computing, which means that when several workers miss on the same
+key at once only one of them does the work and the rest wait for its result.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from core.settings import get_settings
+
+_MISSING = object()
+
+
+class SharedCache:
+    def __init__(self, path: str, default_ttl: float = 300, lease_ttl: float = 60):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.lease_ttl = lease_ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, default=None):
+        row = self._conn().execute(
+            "SELECT value FROM entries WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: float | None = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        self._conn().execute(
+            "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time() + ttl),
+        )
+        if random.random() < 0.01:
+            self.evict_expired()
+
+    def incr(self, key: str, delta: int = 1, ttl: float | None = None) -> int:
+        """Atomically adds `delta` to an integer entry (missing or expired counts as 0) and returns the new value."""
+        ttl = self.default_ttl if ttl is None else ttl
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires_at FROM entries WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            value = (json.loads(row[0]) if row else 0) + delta
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), row[1] if row else now + ttl),
+            )
+            return value
+        finally:
+            conn.execute("COMMIT")
+
+    def advance(self, key: str, to: int, ttl: float | None = None) -> int:
+        """Atomically raises an integer entry to at least `to` and returns its previous value.
+
+        Callers racing to advance the same key each get a disjoint range
+        [previous, to) of the values it passed through.
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires_at FROM entries WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            previous = json.loads(row[0]) if row else 0
+            if to > previous:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(to), row[1] if row else now + ttl),
+                )
+            return previous
+        finally:
+            conn.execute("COMMIT")
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix: str):
+        self._conn().execute("DELETE FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def evict_expired(self):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def _try_lease(self, key: str, token: str):
+        """Returns (True, None) if we now own the lease, (False, value) on a hit, else (False, _MISSING)."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM entries WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if row is not None:
+                return False, json.loads(row[0])
+            lease = conn.execute("SELECT owner FROM leases WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if lease is not None and lease[0] != token:
+                return False, _MISSING
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, token, now + self.lease_ttl),
+            )
+            return True, None
+        finally:
+            conn.execute("COMMIT")
+
+    def _renew(self, key: str, token: str):
+        self._conn().execute(
+            "UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ?", (time.time() + self.lease_ttl, key, token)
+        )
+
+    async def _keep_lease(self, key: str, token: str):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            await asyncio.to_thread(self._renew, key, token)
+
+    def _keep_lease_sync(self, key: str, token: str, done: threading.Event):
+        while not done.wait(self.lease_ttl / 3):
+            self._renew(key, token)
+
+    def _release(self, key: str, token: str):
+        self._conn().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, token))
+
+    def get_or_compute(self, key: str, compute, ttl: float | None = None, poll_interval: float = 0.05):
+        """Returns the cached value for `key`, calling `compute()` at most once across all workers on a miss.
+
+        A thread renews the lease while `compute()` runs, so work that outlives
+        `lease_ttl` is still never started twice.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        token = uuid.uuid4().hex
+        while True:
+            owner, value = self._try_lease(key, token)
+            if owner:
+                done = threading.Event()
+                threading.Thread(target=self._keep_lease_sync, args=(key, token, done), name="cache-lease", daemon=True).start()
+                try:
+                    value = compute()
+                    self.set(key, value, ttl)
+                    return value
+                finally:
+                    done.set()
+                    self._release(key, token)
+            if value is not _MISSING:
+                return value
+            time.sleep(poll_interval)
+
+    async def aget_or_compute(self, key: str, compute, ttl: float | None = None, poll_interval: float = 0.05):
+        """Async variant of `get_or_compute`; `compute` may be a plain callable or a coroutine function.
+
+        The lease is renewed while a coroutine computes, so work that outlives
+        `lease_ttl` is still never started twice. SQLite is only touched from
+        worker threads, so a busy database never stalls the event loop.
+        """
+        value = await asyncio.to_thread(self.get, key, _MISSING)
+        if value is not _MISSING:
+            return value
+        token = uuid.uuid4().hex
+        while True:
+            owner, value = await asyncio.to_thread(self._try_lease, key, token)
+            if owner:
+                keeper = asyncio.create_task(self._keep_lease(key, token))
+                try:
+                    value = compute()
+                    if asyncio.iscoroutine(value):
+                        value = await value
+                    await asyncio.to_thread(self.set, key, value, ttl)
+                    return value
+                finally:
+                    keeper.cancel()
+                    await asyncio.to_thread(self._release, key, token)
+            if value is not _MISSING:
+                return value
+            await asyncio.sleep(poll_interval)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> SharedCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SharedCache(get_settings().cache_path)
+    return _cache
+
+
+def prompt_key(task: str, prompt: str) -> str:
+    return f"llm:{task}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}"
+
+
+def cached_completion(task: str, prompt: str, ttl: float = 600) -> str:
+    """Generates text for `prompt` with the model routed for `task`, reusing an identical recent answer from any worker."""
+    from core.routing import get_task_model
+    return get_cache().get_or_compute(
+        prompt_key(task, prompt),
+        lambda: get_task_model(task).generate_content(prompt).text,
+        ttl=ttl,
+    )
@@ -0,0 +1,177 @@
+"""Opt-in capture of API traffic for replay.
+
+When CLASSSQUARE_CAPTURE_DIR is set, every API request (except /admin and
+/health) is appended as one JSON line to a file in that directory. A record
+holds the route template and concrete path, query string, the shape of the JSON
+body, start time, status, latency, and how many LLM calls and Supabase queries
+the request made. Each worker writes its own files. It starts a new one after
+`capture_file_mb` MB, and only the newest `capture_files` files are kept.
+
+Bodies are sanitized before they are written. Ids, numbers and booleans are
+kept so the request can be replayed. Any other string is replaced by
+{"$str": <length>}. Multipart bodies (file uploads) are recorded by size only.
+Headers are dropped except for whether an Idempotency-Key was sent.
+
+Downstream calls are counted through a context variable. Blocking work started
+with asyncio.to_thread or a threadpool endpoint is counted too. LLM calls that
+/ask batches across requests count towards the request that ran the batch.
+`python -m classsquare_client.replay` re-drives the files against a build.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from core.settings import get_settings
+
+SKIP_PREFIXES = ("/admin", "/health")
+# JSON bodies larger than this are recorded by size only
+MAX_BODY_BYTES = 256 * 1024
+# lists in bodies are cut to this many items
+MAX_LIST_ITEMS = 100
+
+_counters = contextvars.ContextVar("capture_counters", default=None)
+
+
+def count(kind: str, n: int = 1):
+    """Counts a downstream call against the request being captured, if any."""
+    counters = _counters.get()
+    if counters is not None:
+        counters[kind] = counters.get(kind, 0) + n
+
+
+def _is_id(key: str) -> bool:
+    return key == "id" or key.endswith("_id") or key.endswith("_ids")
+
+
+def body_shape(value, key: str = ""):
+    """`value` with free text replaced by {"$str": length}; ids, numbers and booleans are kept."""
+    if isinstance(value, dict):
+        return {k: body_shape(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [body_shape(v, key) for v in value[:MAX_LIST_ITEMS]]
+    if isinstance(value, str) and not _is_id(key):
+        return {"$str": len(value)}
+    return value
+
+
+class CaptureWriter:
+    """Appends records to this worker's current capture file and rotates it."""
+
+    def __init__(self, directory: str, max_bytes: int, keep: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"capture-{datetime.utcnow():%Y%m%dT%H%M%S%f}-{os.getpid()}.jsonl"
+        self._file = open(os.path.join(self.directory, name), "a", encoding="utf-8")
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith("capture-") and n.endswith(".jsonl"))
+        for old in names[:-self.keep]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.max_bytes:
+                if self._file is not None:
+                    self._file.close()
+                self._open()
+            self._file.write(line)
+            self._file.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> CaptureWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                settings = get_settings()
+                _writer = CaptureWriter(settings.capture_dir, settings.capture_file_mb * 1024 * 1024, settings.capture_files)
+    return _writer
+
+
+def _record_body(content_type: str, body: bytes, size: int) -> dict:
+    if not size:
+        return {}
+    if content_type.startswith("application/json") and size <= MAX_BODY_BYTES:
+        try:
+            return {"body": body_shape(json.loads(body))}
+        except ValueError:
+            pass
+    return {"body_bytes": size}
+
+
+class CaptureMiddleware:
+    """ASGI middleware that writes one capture record per HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(SKIP_PREFIXES):
+            return await self.app(scope, receive, send)
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        content_type = headers.get("content-type", "")
+        chunks = []
+        size = 0
+        status = None
+
+        async def receive_wrapper():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                size += len(body)
+                if size <= MAX_BODY_BYTES:
+                    chunks.append(body)
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        counters = {"llm_calls": 0, "db_queries": 0}
+        token = _counters.set(counters)
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            latency = time.perf_counter() - start
+            _counters.reset(token)
+            record = {
+                "ts": datetime.utcfromtimestamp(started).isoformat(),
+                "t": round(started, 4),
+                "method": scope["method"],
+                # the route template once the router has matched one, e.g. /feeds/{feed_id}
+                "endpoint": getattr(scope.get("route"), "path", scope["path"]),
+                "path": scope["path"],
+                "query": scope["query_string"].decode("latin-1"),
+                "content_type": content_type.split(";")[0],
+                "idempotency_key": "idempotency-key" in headers,
+                "status": status or 500,
+                "latency_ms": round(latency * 1000, 1),
+                "pid": os.getpid(),
+                **counters,
+                **_record_body(content_type, b"".join(chunks), size),
+            }
+            try:
+                get_writer().write(record)
+            except OSError as e:
+                print(f"Traffic capture failed: {e}")
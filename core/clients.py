@@ -0,0 +1,60 @@
+"""Lazily created, process-wide Supabase and Gemini clients.
+
+Nothing here is imported or constructed until a request actually needs it, so
+importing the app stays cheap on cold workers.
+"""
+import threading
+
+from core.capture import count
+from core.settings import get_settings
+
+_lock = threading.Lock()
+_supabase = None
+_models = {}
+_genai_configured = False
+
+
+class _CountingClient:
+    """Supabase client that counts each query it starts for traffic capture (core.capture)."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name: str):
+        count("db_queries")
+        return self._client.table(name)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def get_supabase():
+    global _supabase
+    if _supabase is None:
+        with _lock:
+            if _supabase is None:
+                from supabase import create_client
+                settings = get_settings()
+                _supabase = _CountingClient(create_client(settings.supabase_url, settings.supabase_key))
+    return _supabase
+
+
+def _configure_genai():
+    global _genai_configured
+    import google.generativeai as genai
+    if not _genai_configured:
+        genai.configure(api_key=get_settings().gemini_api_key)
+        _genai_configured = True
+    return genai
+
+
+def get_model(name: str):
+    model = _models.get(name)
+    if model is None:
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                genai = _configure_genai()
+                model = genai.GenerativeModel(name)
+                _models[name] = model
+    return model
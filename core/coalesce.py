@@ -0,0 +1,77 @@
+"""Debounced batching of requests that share a key.
+
+The first item submitted under a key opens a batch; everything else submitted
+under that key within `window` seconds joins it. The batch is then handed to
+`handler(key, items)` in a worker thread, which returns one result per item (an
+Exception instance fails just that item).
+
+With `admit`, each batch runs inside `admit(key, items)`, an async context
+manager, so a batch is admitted (and counted) once however many items joined
+it. An error raised while admitting fails the whole batch.
+"""
+import asyncio
+import contextlib
+
+
+class Coalescer:
+    def __init__(self, handler, window: float, max_batch: int, admit=None):
+        self.handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self.admit = admit
+        self._pending = {}
+        # the loop only keeps weak references to tasks; a flush must not be collected while it waits
+        self._tasks = set()
+
+    async def _run(self, key, items) -> list:
+        admission = self.admit(key, items) if self.admit else contextlib.nullcontext()
+        async with admission:
+            return await asyncio.to_thread(self.handler, key, items)
+
+    async def submit(self, key, item):
+        if self.window <= 0:
+            result = (await self._run(key, [item]))[0]
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = []
+            self._spawn(loop, self._flush_later(key, batch))
+        batch.append((item, future))
+        if len(batch) >= self.max_batch:
+            # taken out right away, so the next item starts a new batch
+            del self._pending[key]
+            self._spawn(loop, self._flush(key, batch))
+        return await future
+
+    def _spawn(self, loop, coro):
+        task = loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_later(self, key, batch):
+        await asyncio.sleep(self.window)
+        if self._pending.get(key) is not batch:
+            return  # already flushed because it filled up
+        del self._pending[key]
+        await self._flush(key, batch)
+
+    async def _flush(self, key, batch):
+        try:
+            results = await self._run(key, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
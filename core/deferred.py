@@ -0,0 +1,162 @@
+"""Work put off until the LLM circuit (core.breaker) closes again.
+
+While the circuit is open, request handlers answer in a degraded way and call
+`defer(kind, payload)` for the real work: moderation that couldn't be run, /ask
+replies, generation jobs and posts of lazy feeds. Entries go to a table in the host-wide SQLite
+database. Every worker runs one drain thread, and it only takes entries while
+its own circuit lets calls through. An entry is handed to the handler
+registered for its kind with `register(kind, handler)`.
+
+Claiming an entry hides it from other workers for CLAIM_SECONDS. An entry whose
+worker died is picked up again after that. A failed entry is retried with
+backoff and given up after MAX_ATTEMPTS.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from core.breaker import CircuitOpenError, get_breaker
+from core.settings import get_settings
+
+CLAIM_SECONDS = 15 * 60
+MAX_ATTEMPTS = 5
+POLL_INTERVAL = 2.0
+
+_handlers = {}
+
+
+def register(kind: str, handler, on_give_up=None):
+    """`handler(payload)` does the work of an entry; `on_give_up(payload, error)` runs when it failed MAX_ATTEMPTS times.
+
+    A handler may record how far it got in `payload`; the entry is retried with what it recorded.
+    """
+    _handlers[kind] = (handler, on_give_up)
+
+
+class DeferredQueue:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS deferred ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, key TEXT UNIQUE, payload TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, run_after REAL NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._drainer = None
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def push(self, kind: str, payload: dict, key: str | None = None) -> bool:
+        """Queues an entry; with `key`, only if no entry with that key is queued. Returns whether it was added."""
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT OR IGNORE INTO deferred (kind, key, payload, run_after, created_at) VALUES (?, ?, ?, ?, ?)",
+            (kind, key, json.dumps(payload, ensure_ascii=False, default=str), now, now),
+        )
+        return cursor.rowcount > 0
+
+    def claim(self):
+        """The oldest runnable entry as (id, kind, payload, attempts), now hidden from other workers, or None."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, kind, payload, attempts FROM deferred WHERE run_after <= ? ORDER BY id LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE deferred SET run_after = ?, attempts = attempts + 1 WHERE id = ?", (now + CLAIM_SECONDS, row[0])
+            )
+            return row[0], row[1], json.loads(row[2]), row[3] + 1
+        finally:
+            conn.execute("COMMIT")
+
+    def done(self, entry_id: int):
+        self._conn().execute("DELETE FROM deferred WHERE id = ?", (entry_id,))
+
+    def retry(self, entry_id: int, delay: float, count_attempt: bool = True, payload: dict | None = None):
+        conn = self._conn()
+        conn.execute(
+            "UPDATE deferred SET run_after = ?, attempts = attempts - ? WHERE id = ?",
+            (time.time() + delay, 0 if count_attempt else 1, entry_id),
+        )
+        if payload is not None:
+            conn.execute(
+                "UPDATE deferred SET payload = ? WHERE id = ?",
+                (json.dumps(payload, ensure_ascii=False, default=str), entry_id),
+            )
+
+    def stats(self) -> dict:
+        rows = self._conn().execute("SELECT kind, COUNT(*) FROM deferred GROUP BY kind").fetchall()
+        return dict(rows)
+
+    def start(self):
+        if self._drainer is None:
+            self._drainer = threading.Thread(target=self._drain, name="deferred-drain", daemon=True)
+            self._drainer.start()
+
+    def _drain(self):
+        while True:
+            if not get_breaker().available():
+                time.sleep(POLL_INTERVAL)
+                continue
+            try:
+                entry = self.claim()
+            except sqlite3.Error as e:
+                print(f"Deferred queue unavailable: {e}")
+                entry = None
+            if entry is None:
+                time.sleep(POLL_INTERVAL)
+                continue
+            self._run(*entry)
+
+    def _run(self, entry_id: int, kind: str, payload: dict, attempts: int):
+        handler, on_give_up = _handlers.get(kind, (None, None))
+        if handler is None:
+            # a worker of an older build queued it; leave it to one that knows the kind
+            self.retry(entry_id, POLL_INTERVAL, count_attempt=False)
+            return
+        try:
+            handler(payload)
+        except CircuitOpenError as e:
+            # the circuit opened again while this entry waited; that's not the entry's fault
+            self.retry(entry_id, e.retry_after, count_attempt=False, payload=payload)
+            return
+        except Exception as e:
+            if attempts < MAX_ATTEMPTS:
+                print(f"Deferred {kind} failed (attempt {attempts}), retrying: {e}")
+                self.retry(entry_id, 2 ** attempts * POLL_INTERVAL, payload=payload)
+                return
+            print(f"Deferred {kind} failed {attempts} times, giving up: {e}")
+            if on_give_up is not None:
+                on_give_up(payload, e)
+        self.done(entry_id)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_deferred() -> DeferredQueue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = DeferredQueue(get_settings().cache_path)
+                _queue.start()
+    return _queue
+
+
+def defer(kind: str, payload: dict, key: str | None = None) -> bool:
+    return get_deferred().push(kind, payload, key)
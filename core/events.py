@@ -0,0 +1,182 @@
+"""Per-feed event stream pushed to connected clients.
+
+Whoever inserts posts or comments calls `publish(feed_id, type, rows)`, from any
+thread of any worker. Events are appended to a short-lived log in the host-wide
+SQLite database, and every worker runs one tailer task that reads new entries and
+fans them out to its own subscribers. That way a reply written by one worker
+reaches a client connected to another, and a reconnecting client can resume
+after the last event id it saw instead of re-reading the feed.
+
+Each subscriber has a bounded queue. The hub never waits on a subscriber: one
+that falls `queue_size` events behind is sent a "resync" event and dropped, and
+is expected to reload the feed and reconnect.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+from core.lookups import invalidate_feed_pages
+from core.settings import get_settings
+
+# how long events stay available for clients resuming after a reconnect
+EVENT_RETENTION = 5 * 60
+RESYNC = {"type": "resync"}
+
+
+class EventLog:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, feed_id TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS events_feed ON events (feed_id, id)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append(self, feed_id: str, payload: dict):
+        self._conn().execute(
+            "INSERT INTO events (feed_id, payload, created_at) VALUES (?, ?, ?)",
+            (feed_id, json.dumps(payload, ensure_ascii=False, default=str), time.time()),
+        )
+
+    def last_id(self) -> int:
+        return self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def first_id(self) -> int:
+        return self._conn().execute("SELECT COALESCE(MIN(id), 0) FROM events").fetchone()[0]
+
+    def since(self, after: int, feed_id: str | None = None, limit: int = 1000) -> list:
+        """Entries after id `after` as (id, feed_id, payload) tuples, oldest first."""
+        if feed_id is None:
+            rows = self._conn().execute(
+                "SELECT id, feed_id, payload FROM events WHERE id > ? ORDER BY id LIMIT ?", (after, limit)
+            ).fetchall()
+        else:
+            rows = self._conn().execute(
+                "SELECT id, feed_id, payload FROM events WHERE feed_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (feed_id, after, limit),
+            ).fetchall()
+        return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+    def prune(self):
+        self._conn().execute("DELETE FROM events WHERE created_at < ?", (time.time() - EVENT_RETENTION,))
+
+
+class Subscription:
+    def __init__(self, feed_id: str, queue_size: int):
+        self.feed_id = feed_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.last_id = 0
+        self.dropped = False
+
+    def offer(self, event_id: int, payload: dict):
+        if self.dropped or event_id <= self.last_id:
+            return
+        try:
+            self.queue.put_nowait({"id": event_id, **payload})
+            self.last_id = event_id
+        except asyncio.QueueFull:
+            # too slow to keep up: discard its backlog and tell it to reload instead of buffering without bound
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def next(self) -> dict:
+        return await self.queue.get()
+
+
+class FeedHub:
+    def __init__(self, log: EventLog, queue_size: int, poll_interval: float):
+        self.log = log
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self._subscribers = {}
+        self._tailer = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subs) for subs in self._subscribers.values())
+
+    def subscribe(self, feed_id: str, after: int | None = None) -> Subscription:
+        """Registers a subscriber for `feed_id`; with `after`, events logged since that id are replayed first."""
+        if self._tailer is None or self._tailer.done():
+            self._tailer = asyncio.create_task(self._tail(self.log.last_id()))
+        subscription = Subscription(feed_id, self.queue_size)
+        self._subscribers.setdefault(feed_id, set()).add(subscription)
+        if after is not None:
+            # nothing awaits between registering and replaying, so live events can't slip in between
+            if after < self.log.first_id() - 1:
+                subscription.offer(self.log.last_id(), RESYNC)
+            else:
+                for event_id, _, payload in self.log.since(after, feed_id):
+                    subscription.offer(event_id, payload)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subs = self._subscribers.get(subscription.feed_id)
+        if subs is not None:
+            subs.discard(subscription)
+            if not subs:
+                del self._subscribers[subscription.feed_id]
+
+    async def _tail(self, position: int):
+        last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if not self._subscribers:
+                position = self.log.last_id()
+                continue
+            for event_id, feed_id, payload in self.log.since(position):
+                position = event_id
+                for subscription in list(self._subscribers.get(feed_id, ())):
+                    subscription.offer(event_id, payload)
+            if time.monotonic() - last_prune > 60:
+                self.log.prune()
+                last_prune = time.monotonic()
+
+
+_log = None
+_hub = None
+_lock = threading.Lock()
+
+
+def get_event_log() -> EventLog:
+    global _log
+    if _log is None:
+        with _lock:
+            if _log is None:
+                _log = EventLog(get_settings().cache_path)
+    return _log
+
+
+def get_hub() -> FeedHub:
+    global _hub
+    if _hub is None:
+        settings = get_settings()
+        _hub = FeedHub(get_event_log(), settings.events_queue_size, settings.events_poll_interval)
+    return _hub
+
+
+def publish(feed_id: str, type: str, rows: list):
+    """Announces rows just inserted into a feed, e.g. publish(feed_id, "comments", [comment])."""
+    if not rows:
+        return
+    try:
+        invalidate_feed_pages(feed_id)
+        get_event_log().append(feed_id, {"type": type, "feed_id": feed_id, "items": rows})
+    except sqlite3.Error as e:
+        # the write itself succeeded; a missed notification must not fail the request that caused it
+        print(f"Failed to publish {type} for feed {feed_id}: {e}")
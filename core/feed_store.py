@@ -0,0 +1,198 @@
+"""Writing whole feeds (posts and comment trees) in bulk.
+
+Ids are assigned here rather than by the database, so every post and comment of
+a feed goes in with one insert per table regardless of its size, and comments can
+reference their parents within the same insert.
+"""
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+
+from core.clients import get_supabase
+from core.events import publish
+
+
+def materialize_feed(subject_id: str, title: str, global_prompt: str, posts: list) -> dict:
+    """Creates a feed holding `posts` and returns its id and row counts.
+
+    `posts` is a list of {"author_id", "content", "comments": [...]} where each
+    comment is {"author_id", "content"} plus optionally "id" and
+    "parent_comment_id" referring to other comments of the same list, which are
+    remapped to the new ids.
+    """
+    supabase = get_supabase()
+    feed_id = str(uuid.uuid4())
+    feed = {
+        "id": feed_id,
+        "subject_id": subject_id,
+        "title": title,
+        "global_prompt": global_prompt
+    }
+    feed_resp = supabase.table("feeds").insert(feed).execute()
+    if not feed_resp.data:
+        raise HTTPException(status_code=500, detail="Failed to create feed")
+
+    # keep the original order: rows created in one go would otherwise all share a timestamp
+    now = datetime.utcnow()
+    tick = 0
+    post_rows = []
+    comment_rows = []
+    for post in posts:
+        post_id = str(uuid.uuid4())
+        post_rows.append({
+            "id": post_id,
+            "feed_id": feed_id,
+            "author_id": post["author_id"],
+            "content": post["content"],
+            "created_at": (now + timedelta(microseconds=tick)).isoformat()
+        })
+        tick += 1
+        new_ids = {}
+        rows = []
+        for comment in post.get("comments", []):
+            comment_id = str(uuid.uuid4())
+            if comment.get("id"):
+                new_ids[comment["id"]] = comment_id
+            rows.append({
+                "id": comment_id,
+                "post_id": post_id,
+                "author_id": comment["author_id"],
+                "content": comment["content"],
+                "parent_comment_id": comment.get("parent_comment_id"),
+                "created_at": (now + timedelta(microseconds=tick)).isoformat()
+            })
+            tick += 1
+        for row in rows:
+            if row["parent_comment_id"] is not None:
+                row["parent_comment_id"] = new_ids.get(row["parent_comment_id"])
+        comment_rows.extend(rows)
+
+    if post_rows:
+        post_resp = supabase.table("posts").insert(post_rows).execute()
+        if not post_resp.data:
+            raise HTTPException(status_code=500, detail="Failed to create posts")
+        publish(feed_id, "posts", post_resp.data)
+    if comment_rows:
+        comment_resp = supabase.table("comments").insert(comment_rows).execute()
+        if not comment_resp.data:
+            raise HTTPException(status_code=500, detail="Failed to create comments")
+        publish(feed_id, "comments", comment_resp.data)
+    return {"feed_id": feed_id, "posts_created": len(post_rows), "comments_created": len(comment_rows)}
+
+
+def clone_feed(feed_id: str, title: str | None = None, global_prompt: str | None = None):
+    """Copies the visible posts and comment tree of a feed into a new feed; returns None if it doesn't exist."""
+    supabase = get_supabase()
+    feed_resp = supabase.table("feeds").select("*").eq("id", feed_id).maybe_single().execute()
+    if not feed_resp or not feed_resp.data:
+        return None
+    feed = feed_resp.data
+
+    posts_resp = supabase.table("posts").select("id, author_id, content").eq("feed_id", feed_id) \
+        .eq("is_visible", True).order("created_at").execute()
+    posts = posts_resp.data or []
+    comments = []
+    if posts:
+        comments_resp = supabase.table("comments").select("id, post_id, parent_comment_id, author_id, content") \
+            .in_("post_id", [p["id"] for p in posts]).eq("is_visible", True).order("created_at").execute()
+        comments = comments_resp.data or []
+
+    # replies under a hidden comment would lose their context, so only keep comments reachable from the post
+    children = {}
+    for comment in comments:
+        children.setdefault(comment.get("parent_comment_id"), []).append(comment)
+    reachable = set()
+    stack = list(children.get(None, []))
+    while stack:
+        comment = stack.pop()
+        reachable.add(comment["id"])
+        stack.extend(children.get(comment["id"], []))
+    by_post = {p["id"]: [] for p in posts}
+    for comment in comments:
+        if comment["id"] in reachable:
+            by_post[comment["post_id"]].append(comment)
+
+    tree = [{
+        "author_id": post["author_id"],
+        "content": post["content"],
+        "comments": by_post[post["id"]],
+    } for post in posts]
+    return materialize_feed(
+        feed["subject_id"],
+        title or feed.get("title"),
+        feed.get("global_prompt", "") if global_prompt is None else global_prompt,
+        tree,
+    )
+
+
+def load_feed_page(feed_id: str, offset: int, limit: int):
+    """A page of a feed's visible posts with their visible comment trees, or None if the feed doesn't exist.
+
+    Two queries regardless of size: one for the posts of the page (plus one to
+    tell whether there is a next page) and one for all their comments.
+    """
+    supabase = get_supabase()
+    feed_resp = supabase.table("feeds").select("id, subject_id, title, global_prompt").eq("id", feed_id) \
+        .maybe_single().execute()
+    if not feed_resp or not feed_resp.data:
+        return None
+
+    posts_resp = supabase.table("posts").select("*").eq("feed_id", feed_id).eq("is_visible", True) \
+        .order("created_at").order("id").range(offset, offset + limit).execute()
+    posts = posts_resp.data or []
+    has_more = len(posts) > limit
+    posts = posts[:limit]
+    comments = []
+    if posts:
+        comments_resp = supabase.table("comments").select("*").in_("post_id", [p["id"] for p in posts]) \
+            .eq("is_visible", True).order("created_at").execute()
+        comments = comments_resp.data or []
+
+    # one pass to index, one to link; a reply whose parent is hidden is left out along with its own replies
+    nodes = {c["id"]: {**c, "replies": []} for c in comments}
+    by_post = {p["id"]: [] for p in posts}
+    for node in nodes.values():
+        parent_id = node.get("parent_comment_id")
+        if parent_id is None:
+            by_post[node["post_id"]].append(node)
+        elif parent_id in nodes:
+            nodes[parent_id]["replies"].append(node)
+
+    return {
+        "feed": feed_resp.data,
+        "posts": [{**post, "comments": by_post[post["id"]]} for post in posts],
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if has_more else None,
+    }
+
+
+def find_draft(subject_id: str, topic: str):
+    """Returns the newest pre-generated draft for a syllabus topic, if there is one.
+
+    Drafts are optional (see pregenerate.py): without the table, or if it can't be read, there is no draft.
+    """
+    try:
+        resp = get_supabase().table("feed_drafts").select("*").eq("subject_id", subject_id).eq("topic", topic) \
+            .order("created_at", desc=True).limit(1).execute()
+    except Exception as e:
+        print(f"Warning: Could not look up feed drafts: {e}")
+        return None
+    return resp.data[0] if resp.data else None
+
+
+def draft_authors(draft) -> set:
+    authors = set()
+    for post in draft["posts"]:
+        authors.add(post["author_id"])
+        authors.update(c["author_id"] for c in post.get("comments", []))
+    return authors
+
+
+def mark_draft_used(draft):
+    # only statistics; the feed was created already
+    try:
+        get_supabase().table("feed_drafts").update({"uses": (draft.get("uses") or 0) + 1}).eq("id", draft["id"]).execute()
+    except Exception as e:
+        print(f"Warning: Could not count draft use: {e}")
@@ -0,0 +1,171 @@
+"""Idempotent execution of expensive, side-effecting requests.
+
+A request is identified by the client's `Idempotency-Key` header or, without
+one, by a fingerprint of its body. The first request runs; duplicates that
+arrive while it is still running wait for it, on any worker of the host, and
+duplicates that arrive afterwards get the stored result. Failed runs are not
+stored, so a retry after an error runs again.
+
+While the LLM circuit is open (core.breaker), `defer_idempotent` queues the
+run instead (core.deferred) and answers 202 with a job id. The run starts once
+the circuit closes and stores its result under the same key. Its progress can
+be read with `get_job`, and a client retrying with the same key afterwards
+simply gets the result.
+
+Work that writes rows as it goes records how far it got in a progress dict
+saved next to the record. A run that was interrupted, by the circuit opening
+or by the worker dying, is resumed from there by the next run under the same
+key, whether that is a client retry or the queued job.
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+
+from fastapi import HTTPException, Response
+
+from core.breaker import get_breaker
+from core.cache import get_cache
+from core.deferred import defer, register
+
+# explicit keys are remembered for a day; body fingerprints only cover retry storms
+KEYED_TTL = 24 * 3600
+FINGERPRINT_TTL = 15 * 60
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+def fingerprint(scope: str, payload: dict) -> str:
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(f"{scope}:{canonical}".encode("utf-8")).hexdigest()
+
+
+def _record_key(scope: str, idempotency_key: str | None, payload: dict):
+    body_fingerprint = fingerprint(scope, payload)
+    if idempotency_key:
+        return f"idem:{scope}:key:{idempotency_key}", KEYED_TTL, body_fingerprint
+    return f"idem:{scope}:body:{body_fingerprint}", FINGERPRINT_TTL, body_fingerprint
+
+
+class _Progress(dict):
+    """Progress of the run under `key`; saved on every change so the next run under the key resumes from it."""
+
+    def __init__(self, key: str, ttl: float):
+        self._key, self._ttl = f"{key}:progress", ttl
+        super().__init__(get_cache().get(self._key) or {})
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        get_cache().set(self._key, dict(self), ttl=self._ttl)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        get_cache().set(self._key, dict(self), ttl=self._ttl)
+
+
+def _resume(key: str, ttl: float, work):
+    result = work(_Progress(key, ttl))
+    get_cache().delete(f"{key}:progress")
+    return result
+
+
+async def run_idempotent(scope: str, idempotency_key: str | None, payload: dict, work, response: Response | None = None,
+                         admit=None):
+    """Runs `work(progress)` in a worker thread at most once per key and returns its (stored) result.
+
+    `progress` is the dict described in `register_job`. `admit()`, an async
+    context manager such as an admission slot, is entered only around the run
+    itself: duplicates that get the stored result or wait for a run in progress
+    don't take one.
+    """
+    key, ttl, body_fingerprint = _record_key(scope, idempotency_key, payload)
+
+    ran = False
+
+    async def compute():
+        nonlocal ran
+        ran = True
+        async with admit() if admit else contextlib.nullcontext():
+            result = await asyncio.to_thread(_resume, key, ttl, work)
+        return {"fingerprint": body_fingerprint, "result": result}
+
+    record = await get_cache().aget_or_compute(key, compute, ttl=ttl, poll_interval=0.5)
+    if record["fingerprint"] != body_fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request body")
+    if response is not None and not ran:
+        response.headers[REPLAY_HEADER] = "true"
+    return record["result"]
+
+
+_jobs = {}
+
+
+def register_job(scope: str, work):
+    """`work(payload, progress)` runs a deferred request of `scope` from its JSON body.
+
+    `progress` is a dict kept across runs under the same idempotency key. Work
+    that writes rows as it goes records in it how far it got, and skips that
+    part when it runs again after an interruption.
+    """
+    _jobs[scope] = work
+
+
+def set_job(job_id: str, /, **fields):
+    job = get_cache().get(f"job:{job_id}") or {}
+    job.update(fields)
+    get_cache().set(f"job:{job_id}", job, ttl=KEYED_TTL)
+    return job
+
+
+def get_job(job_id: str):
+    return get_cache().get(f"job:{job_id}")
+
+
+def defer_idempotent(scope: str, idempotency_key: str | None, payload: dict, response: Response):
+    """Queues the request to run once the LLM circuit closes; returns its stored result if it already ran."""
+    key, ttl, body_fingerprint = _record_key(scope, idempotency_key, payload)
+    record = get_cache().get(key)
+    if record is not None:
+        if record["fingerprint"] != body_fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request body")
+        response.headers[REPLAY_HEADER] = "true"
+        return record["result"]
+
+    job_id = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+    entry = {"scope": scope, "key": key, "ttl": ttl, "fingerprint": body_fingerprint, "job_id": job_id, "payload": payload}
+    if defer("job", entry, key=job_id):
+        set_job(job_id, job_id=job_id, scope=scope, status="queued")
+    response.status_code = 202
+    response.headers["Retry-After"] = str(int(get_breaker().retry_after()))
+    return get_job(job_id) or {"job_id": job_id, "scope": scope, "status": "queued"}
+
+
+def _run_job(entry: dict):
+    job_id = entry["job_id"]
+    set_job(job_id, status="running")
+    work = _jobs[entry["scope"]]
+    try:
+        record = get_cache().get_or_compute(
+            entry["key"],
+            lambda: {"fingerprint": entry["fingerprint"],
+                     "result": _resume(entry["key"], entry["ttl"], lambda progress: work(entry["payload"], progress))},
+            ttl=entry["ttl"],
+        )
+    except HTTPException as e:
+        if e.status_code < 500:
+            # the request itself is wrong (missing feed, too few personas); running it again won't help
+            set_job(job_id, status="failed", error=e.detail)
+            return
+        set_job(job_id, status="queued")
+        raise
+    except Exception:
+        # retried by the deferred queue
+        set_job(job_id, status="queued")
+        raise
+    set_job(job_id, status="done", result=record["result"])
+
+
+def _give_up_job(entry: dict, error: Exception):
+    set_job(entry["job_id"], status="failed", error=str(error))
+
+
+register("job", _run_job, _give_up_job)
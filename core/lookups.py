@@ -0,0 +1,73 @@
+"""Read-mostly rows that every router needs, served from the shared cache.
+
+Subjects, feeds and personas change rarely but are fetched on almost every
+request, so they are cached host-wide for a few minutes. Anything that writes
+personas must call `invalidate_personas` for the affected subject.
+"""
+import uuid
+
+from core.cache import get_cache
+from core.clients import get_supabase
+
+SUBJECT_TTL = 300
+FEED_TTL = 300
+PERSONAS_TTL = 120
+# a post never moves to another feed
+POST_FEED_TTL = 3600
+# rendered feed pages; also bounds how long a change made outside the API (e.g. hiding a comment) goes unseen
+FEED_PAGE_TTL = 30
+FEED_VERSION_TTL = 24 * 3600
+
+
+def get_subject(subject_id: str):
+    return get_cache().get_or_compute(
+        f"subject:{subject_id}",
+        lambda: get_supabase().table("subjects").select("*").eq("id", subject_id).single().execute().data,
+        ttl=SUBJECT_TTL,
+    )
+
+
+def get_feed(feed_id: str):
+    return get_cache().get_or_compute(
+        f"feed:{feed_id}",
+        lambda: get_supabase().table("feeds").select("*").eq("id", feed_id).single().execute().data,
+        ttl=FEED_TTL,
+    )
+
+
+def get_personas(subject_id: str):
+    return get_cache().get_or_compute(
+        f"personas:{subject_id}",
+        lambda: get_supabase().table("personas").select("*").eq("subject_id", subject_id).execute().data,
+        ttl=PERSONAS_TTL,
+    )
+
+
+def get_post_feed_id(post_id: str):
+    return get_cache().get_or_compute(
+        f"post-feed:{post_id}",
+        lambda: get_supabase().table("posts").select("feed_id").eq("id", post_id).single().execute().data["feed_id"],
+        ttl=POST_FEED_TTL,
+    )
+
+
+def feed_version(feed_id: str) -> str:
+    """Token that changes whenever posts or comments are added to the feed through the API."""
+    cache = get_cache()
+    version = cache.get(f"feed-version:{feed_id}")
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(f"feed-version:{feed_id}", version, ttl=FEED_VERSION_TTL)
+    return version
+
+
+def invalidate_feed_pages(feed_id: str):
+    get_cache().set(f"feed-version:{feed_id}", uuid.uuid4().hex, ttl=FEED_VERSION_TTL)
+
+
+def invalidate_subject(subject_id: str):
+    get_cache().delete(f"subject:{subject_id}")
+
+
+def invalidate_personas(subject_id: str):
+    get_cache().delete(f"personas:{subject_id}")
@@ -0,0 +1,76 @@
+"""Dry runs of LLM-heavy requests.
+
+A `PlanRecorder` stands in for the model: generation code runs unchanged, every
+prompt it would send is recorded instead, and a placeholder of the typical
+answer length comes back so that later prompts quoting earlier answers are the
+right size too. `summary()` then turns the recording into call, token and
+wall-time estimates.
+
+Tokens are estimated locally; the exact count would cost an API call per
+prompt. Wall time uses the median latency recorded for the model the task is
+currently routed to (see core.routing), and falls back to half the task's
+latency budget before any calls were recorded. The generators issue their
+calls one after another, so a call takes at least that latency. With a
+provider quota (`llm_rpm`), the LLM-backed requests running at once (see
+core.admission) share it, and each one's calls can come no faster than its
+share allows.
+"""
+from core.admission import get_admission
+from core.routing import get_task_model, model_health
+from core.settings import get_settings
+
+# typical answer sizes, in tokens, of what the generators ask for
+OUTPUT_TOKENS = {"persona-post": 120, "persona-comment": 70, "persona-reply": 90, "persona-list": 600, "moderation": 2}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Gemini token count: about 4 characters per token for Latin script, 2 for Hebrew and other scripts."""
+    ascii_chars = sum(1 for c in text if c < "\x80")
+    return max(1, round(ascii_chars / 4 + (len(text) - ascii_chars) / 2))
+
+
+class _Placeholder:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class PlanRecorder:
+    """Drop-in for a model that records prompts instead of sending them."""
+
+    def __init__(self, task: str):
+        self.task = task
+        self.calls = []
+
+    def generate_content(self, prompt, **kwargs):
+        # the generators use one model for posts and comments; short prompts that answer a post are comments
+        kind = "persona-comment" if self.task == "persona-post" and "Respond to this post" in prompt else self.task
+        output_tokens = OUTPUT_TOKENS.get(kind, 100)
+        self.calls.append({
+            "kind": kind,
+            "prompt": prompt,
+            "prompt_tokens": estimate_tokens(prompt),
+            "output_tokens": output_tokens,
+        })
+        return _Placeholder(("lorem ipsum " * output_tokens)[:output_tokens * 4])
+
+    def summary(self, include_prompts: bool = True) -> dict:
+        routed = get_task_model(self.task)
+        model = routed.choose()[0]
+        latency = model_health(model).stats()["p50_latency"] or routed.latency_budget / 2
+        # this run shares the quota with the ones already admitted
+        concurrent = get_admission().active + 1
+        rpm = get_settings().llm_rpm
+        seconds_per_call = max(latency, 60.0 * concurrent / rpm) if rpm else latency
+        plan = {
+            "dry_run": True,
+            "model": model,
+            "llm_calls": len(self.calls),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in self.calls),
+            "output_tokens": sum(c["output_tokens"] for c in self.calls),
+            "concurrent_requests": concurrent,
+            "seconds_per_call": round(seconds_per_call, 2),
+            "estimated_seconds": round(seconds_per_call * len(self.calls), 1),
+        }
+        if include_prompts:
+            plan["calls"] = self.calls
+        return plan
@@ -0,0 +1,244 @@
+"""Opt-in sampling profiler for individual requests.
+
+A request is profiled when an admin sends it with `X-Profile: 1`, or while a
+plan armed through /admin/profiling still covers it (the next N requests on
+the host and/or a random share of traffic). While at least one profiled request
+is in flight, a background thread samples the stacks of every thread of the
+worker every `profile_interval` seconds. Because blocking work runs in worker
+threads, a profile also contains whatever else the worker was doing at the
+time; stacks are prefixed with their thread name to tell them apart.
+
+Each profile is written to `profile_dir` as `<id>.folded` (collapsed stacks,
+one "frame;frame;frame count" line per stack, the input flamegraph.pl and
+speedscope expect) and `<id>.json` (request metadata). With no plan armed the
+cost per request is a header scan and a dict lookup.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from core.admin import is_admin
+from core.cache import get_cache
+from core.settings import get_settings
+
+PLAN_KEY = "profiling:plan"
+CLAIMED_KEY = "profiling:claimed"
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+# older profiles are deleted once there are more than this many
+MAX_PROFILES = 200
+PROFILE_ID = re.compile(r"^[0-9A-Za-z_.-]+$")
+
+
+class Profile:
+    def __init__(self, method: str, path: str):
+        slug = re.sub(r"[^0-9A-Za-z]+", "-", path).strip("-")[:60] or "root"
+        self.id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{method.lower()}-{slug}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.duration = None
+        self.status = None
+        self.stacks = Counter()
+        self.samples = 0
+
+
+class Sampler:
+    """One thread per worker that samples all thread stacks while any profile is active."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._labels = {}
+
+    def start(self, profile: Profile):
+        with self._lock:
+            self._active.add(profile)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, profile: Profile):
+        with self._lock:
+            self._active.discard(profile)
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    self._thread = None
+                    return
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                folded = ";".join(reversed(stack))
+                for profile in active:
+                    profile.stacks[folded] += 1
+            for profile in active:
+                profile.samples += 1
+            time.sleep(self.interval)
+
+
+_sampler = None
+_plan = None
+_plan_checked = 0.0
+
+
+def get_sampler() -> Sampler:
+    global _sampler
+    if _sampler is None:
+        _sampler = Sampler(get_settings().profile_interval)
+    return _sampler
+
+
+def arm(next_requests: int = 0, sample_rate: float = 0.0, duration: float = 600) -> dict:
+    """Profiles the next `next_requests` requests and `sample_rate` of all requests on the host for `duration` seconds."""
+    global _plan_checked
+    plan = {"next": next_requests, "sample_rate": sample_rate, "until": time.time() + duration}
+    cache = get_cache()
+    cache.delete(CLAIMED_KEY)
+    cache.set(PLAN_KEY, plan, ttl=duration)
+    _plan_checked = 0.0
+    return plan
+
+
+def disarm():
+    global _plan_checked
+    get_cache().delete(PLAN_KEY)
+    _plan_checked = 0.0
+
+
+def current_plan():
+    """The armed plan, re-read from the shared cache at most once a second."""
+    global _plan, _plan_checked
+    now = time.monotonic()
+    if now - _plan_checked > 1.0:
+        _plan = get_cache().get(PLAN_KEY)
+        _plan_checked = now
+    if _plan and _plan["until"] < time.time():
+        _plan = None
+    return _plan
+
+
+def _wants_profile(headers: dict) -> bool:
+    if headers.get(PROFILE_HEADER.lower()) == "1" and is_admin(headers.get("x-admin-token")):
+        return True
+    plan = current_plan()
+    if not plan:
+        return False
+    if plan["sample_rate"] and random.random() < plan["sample_rate"]:
+        return True
+    if plan["next"]:
+        cache = get_cache()
+        if cache.get(CLAIMED_KEY, 0) < plan["next"]:
+            return cache.incr(CLAIMED_KEY, ttl=max(plan["until"] - time.time(), 1)) <= plan["next"]
+    return False
+
+
+def save_profile(profile: Profile):
+    directory = get_settings().profile_dir
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{profile.id}.folded"), "w", encoding="utf-8") as f:
+        for stack, count in profile.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    meta = {
+        "id": profile.id,
+        "method": profile.method,
+        "path": profile.path,
+        "status": profile.status,
+        "started_at": datetime.utcfromtimestamp(profile.started).isoformat(),
+        "duration": profile.duration,
+        "samples": profile.samples,
+        "interval": get_sampler().interval,
+    }
+    with open(os.path.join(directory, f"{profile.id}.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    names = sorted(n for n in os.listdir(directory) if n.endswith(".json"))
+    for name in names[:-MAX_PROFILES]:
+        for ext in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(directory, name[:-5] + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles() -> list:
+    directory = get_settings().profile_dir
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(directory, name), encoding="utf-8") as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return profiles
+
+
+def profile_path(profile_id: str, ext: str):
+    """Path of a stored profile file, or None if the id is malformed or unknown."""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    path = os.path.join(get_settings().profile_dir, f"{profile_id}{ext}")
+    return path if os.path.isfile(path) else None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles the requests selected by `_wants_profile`."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        if not _wants_profile(headers):
+            return await self.app(scope, receive, send)
+
+        profile = Profile(scope["method"], scope["path"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER.lower().encode(), profile.id.encode())
+                ]
+            await send(message)
+
+        sampler = get_sampler()
+        sampler.start(profile)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profile.duration = time.perf_counter() - start
+            sampler.stop(profile)
+            await asyncio.to_thread(save_profile, profile)
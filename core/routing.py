@@ -0,0 +1,234 @@
+"""Which model serves which task, with fallback when a model degrades.
+
+Call sites ask for a task ("persona-reply", "moderation", ...) instead of a
+model name and get a `RoutedModel`, which has the same `generate_content` as a
+Gemini model. Each call goes to the task's primary model unless that model is
+currently degraded, and a call that fails on the primary is retried once on
+the fallback.
+
+A model is degraded when, over its recent calls in this worker, the error rate
+exceeds ERROR_RATE_LIMIT or the median latency exceeds the task's latency
+budget. Outcomes older than WINDOW_SECONDS are dropped, so a degraded primary
+is used again once its bad period has aged out of the window.
+
+All calls go through the provider-wide circuit breaker in core.breaker.
+
+Interactive tasks (those with "hedge" in their route) are hedged: if the call
+hasn't answered by the `hedge_percentile` latency of the task's recent calls
+on that model, an identical second call is sent and whichever answers first is used. The
+loser's answer is discarded; a blocking call can't be interrupted, so it is
+left to finish in its thread. Hedges are capped at `hedge_budget` extra calls
+per call made, counted per task.
+
+The table can be overridden without code changes through
+CLASSSQUARE_MODEL_ROUTES, a JSON object such as
+{"moderation": {"primary": "models/gemini-2.0-flash-lite", "fallback": "models/gemini-1.5-flash"}}.
+"""
+import json
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from core.breaker import get_breaker
+from core.capture import count
+from core.clients import get_model
+from core.settings import get_settings
+
+# cheap classification on the fastest tier, long-form writing on the stronger one
+DEFAULT_ROUTES = {
+    "moderation": {"primary": "models/gemini-2.0-flash-lite", "fallback": "models/gemini-1.5-flash", "latency_budget": 2.0, "hedge": True},
+    "persona-reply": {"primary": "models/gemini-1.5-flash", "fallback": "models/gemini-2.0-flash", "latency_budget": 8.0, "hedge": True},
+    # one call answering a whole /ask batch takes longer than a single reply; hedging it would double a large call
+    "persona-reply-batch": {"primary": "models/gemini-1.5-flash", "fallback": "models/gemini-2.0-flash", "latency_budget": 30.0},
+    "persona-list": {"primary": "models/gemini-2.0-flash", "fallback": "models/gemini-1.5-flash", "latency_budget": 20.0},
+    "persona-post": {"primary": "models/gemini-2.0-flash", "fallback": "models/gemini-1.5-flash", "latency_budget": 15.0},
+    "syllabus": {"primary": "models/gemini-1.5-flash", "fallback": "models/gemini-2.0-flash", "latency_budget": 60.0},
+}
+WINDOW_SECONDS = 300
+WINDOW_CALLS = 50
+# a model needs this many recent calls before it can be judged degraded
+MIN_CALLS = 5
+ERROR_RATE_LIMIT = 0.3
+# successful calls needed before a hedge deadline is learned; until then half the latency budget is used
+HEDGE_MIN_SAMPLES = 10
+
+
+class ModelHealth:
+    """Rolling latency and error record of one model in this worker."""
+
+    def __init__(self):
+        self._calls = deque(maxlen=WINDOW_CALLS)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self._calls.append((time.monotonic(), latency, ok))
+
+    def _recent(self) -> list:
+        cutoff = time.monotonic() - WINDOW_SECONDS
+        with self._lock:
+            return [c for c in self._calls if c[0] >= cutoff]
+
+    def stats(self) -> dict:
+        calls = self._recent()
+        latencies = [latency for _, latency, ok in calls if ok]
+        return {
+            "calls": len(calls),
+            "error_rate": sum(1 for c in calls if not c[2]) / len(calls) if calls else 0.0,
+            "p50_latency": statistics.median(latencies) if latencies else None,
+        }
+
+    def percentile(self, q: float) -> float | None:
+        latencies = sorted(latency for _, latency, ok in self._recent() if ok)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def degraded(self, latency_budget: float) -> bool:
+        stats = self.stats()
+        if stats["calls"] < MIN_CALLS:
+            return False
+        if stats["error_rate"] > ERROR_RATE_LIMIT:
+            return True
+        return stats["p50_latency"] is not None and stats["p50_latency"] > latency_budget
+
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def model_health(name: str) -> ModelHealth:
+    health = _health.get(name)
+    if health is None:
+        with _health_lock:
+            health = _health.setdefault(name, ModelHealth())
+    return health
+
+
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+
+
+class RoutedModel:
+    def __init__(self, task: str, primary: str, fallback: str | None, latency_budget: float, hedge: bool = False):
+        self.task = task
+        self.primary = primary
+        self.fallback = fallback
+        self.latency_budget = latency_budget
+        self.hedge = hedge
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        # latency of this task's calls per model; a model's overall record mixes in other tasks' prompts
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    def hedge_stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+        }
+
+    def task_health(self, name: str) -> ModelHealth:
+        with self._lock:
+            return self._latency.setdefault(name, ModelHealth())
+
+    def _timed(self, name: str, args, kwargs):
+        start = time.monotonic()
+        try:
+            response = get_model(name).generate_content(*args, **kwargs)
+        except Exception:
+            model_health(name).record(time.monotonic() - start, False)
+            get_breaker().record(time.monotonic() - start, False)
+            raise
+        latency = time.monotonic() - start
+        model_health(name).record(latency, True)
+        self.task_health(name).record(latency, True)
+        get_breaker().record(latency, True)
+        return response
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            if self.hedged + 1 > get_settings().hedge_budget * self.calls:
+                return False
+            self.hedged += 1
+            return True
+
+    def _call(self, name: str, args, kwargs):
+        with self._lock:
+            self.calls += 1
+        count("llm_calls")
+        if not self.hedge:
+            return self._timed(name, args, kwargs)
+
+        deadline = self.task_health(name).percentile(get_settings().hedge_percentile) or self.latency_budget / 2
+        first = _hedge_pool.submit(self._timed, name, args, kwargs)
+        done, _ = wait([first], timeout=deadline)
+        if done or not self._take_hedge():
+            return first.result()
+        count("llm_calls")
+        second = _hedge_pool.submit(self._timed, name, args, kwargs)
+        pending = {first, second}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            answered = [f for f in done if f.exception() is None]
+            if answered:
+                if answered[0] is second:
+                    with self._lock:
+                        self.hedge_wins += 1
+                # the other call can't be interrupted; its answer is simply dropped
+                return answered[0].result()
+            if not pending:
+                return done.pop().result()
+
+    def choose(self) -> list:
+        """Model names to try, in order."""
+        if not self.fallback or self.fallback == self.primary:
+            return [self.primary]
+        if model_health(self.primary).degraded(self.latency_budget) and not model_health(self.fallback).degraded(self.latency_budget):
+            return [self.fallback, self.primary]
+        return [self.primary, self.fallback]
+
+    def generate_content(self, *args, **kwargs):
+        # with the provider down there's nothing to fall back to; fail now rather than after a timeout
+        get_breaker().before_call()
+        names = self.choose()
+        for index, name in enumerate(names):
+            try:
+                return self._call(name, args, kwargs)
+            except Exception as e:
+                if index == len(names) - 1 or not get_breaker().available():
+                    raise
+                print(f"{self.task}: {name} failed ({e}), retrying on {names[index + 1]}")
+
+
+def routes() -> dict:
+    table = {task: dict(route) for task, route in DEFAULT_ROUTES.items()}
+    overrides = get_settings().model_routes
+    if overrides:
+        for task, route in json.loads(overrides).items():
+            table.setdefault(task, {"latency_budget": 10.0}).update(route)
+    return table
+
+
+_models = {}
+
+
+def get_task_model(task: str) -> RoutedModel:
+    model = _models.get(task)
+    if model is None:
+        route = routes()[task]
+        model = _models[task] = RoutedModel(
+            task, route["primary"], route.get("fallback"), route["latency_budget"], route.get("hedge", False)
+        )
+    return model
+
+
+def routing_stats() -> dict:
+    return {
+        "models": {name: health.stats() for name, health in list(_health.items())},
+        "hedging": {task: model.hedge_stats() for task, model in list(_models.items()) if model.hedge},
+    }
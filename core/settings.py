@@ -0,0 +1,105 @@
+"""Application settings, read from the environment exactly once per process."""
+import os
+import tempfile
+from dataclasses import dataclass
+from functools import lru_cache
+
+
+@dataclass(frozen=True)
+class Settings:
+    gemini_api_key: str | None
+    supabase_url: str | None
+    supabase_key: str | None
+    cache_path: str
+    ask_coalesce_window: float
+    ask_coalesce_max_batch: int
+    events_queue_size: int
+    events_poll_interval: float
+    admin_token: str | None
+    profile_dir: str
+    profile_interval: float
+    admission_max_active: int
+    admission_class_active: int
+    admission_user_active: int
+    admission_class_queue: int
+    admission_total_queue: int
+    admission_queue_timeout: float
+    model_routes: str | None
+    hedge_percentile: float
+    hedge_budget: float
+    upload_dir: str
+    max_upload_mb: int
+    syllabus_workers: int
+    capture_dir: str | None
+    capture_file_mb: int
+    capture_files: int
+    feed_growth_workers: int
+    breaker_error_rate: float
+    breaker_slow_seconds: float
+    breaker_min_calls: int
+    breaker_window: float
+    breaker_open_seconds: float
+    llm_rpm: float
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    # python-dotenv is cheap, but there is still no reason to parse .env more than once
+    from dotenv import load_dotenv
+    load_dotenv()
+    return Settings(
+        gemini_api_key=os.getenv("GEMINI_API_KEY"),
+        supabase_url=os.getenv("SUPABASE_URL"),
+        supabase_key=os.getenv("SUPABASE_SERVICE_KEY"),
+        # must be on a local disk shared by all workers of the host
+        cache_path=os.getenv("CLASSSQUARE_CACHE_PATH", os.path.join(tempfile.gettempdir(), "classsquare-cache.sqlite3")),
+        # seconds to wait for more /ask comments on the same post before replying; 0 disables batching
+        ask_coalesce_window=float(os.getenv("CLASSSQUARE_ASK_COALESCE_WINDOW", "1.5")),
+        ask_coalesce_max_batch=int(os.getenv("CLASSSQUARE_ASK_COALESCE_MAX_BATCH", "30")),
+        # events a feed subscriber may fall behind before it is told to resync and dropped
+        events_queue_size=int(os.getenv("CLASSSQUARE_EVENTS_QUEUE_SIZE", "256")),
+        # seconds between checks of the host-wide event log for events published by other workers
+        events_poll_interval=float(os.getenv("CLASSSQUARE_EVENTS_POLL_INTERVAL", "0.2")),
+        # shared secret for /admin endpoints and X-Profile; admin access is off when unset
+        admin_token=os.getenv("CLASSSQUARE_ADMIN_TOKEN"),
+        profile_dir=os.getenv("CLASSSQUARE_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "classsquare-profiles")),
+        # seconds between stack samples while a request is being profiled
+        profile_interval=float(os.getenv("CLASSSQUARE_PROFILE_INTERVAL", "0.01")),
+        # per worker: LLM-backed requests running at once, overall, per class and per user
+        admission_max_active=int(os.getenv("CLASSSQUARE_ADMISSION_MAX_ACTIVE", "16")),
+        admission_class_active=int(os.getenv("CLASSSQUARE_ADMISSION_CLASS_ACTIVE", "4")),
+        admission_user_active=int(os.getenv("CLASSSQUARE_ADMISSION_USER_ACTIVE", "2")),
+        # requests allowed to wait, per class and overall, before new ones get 429
+        admission_class_queue=int(os.getenv("CLASSSQUARE_ADMISSION_CLASS_QUEUE", "40")),
+        admission_total_queue=int(os.getenv("CLASSSQUARE_ADMISSION_TOTAL_QUEUE", "200")),
+        # seconds a request may wait for a slot before it gets 429
+        admission_queue_timeout=float(os.getenv("CLASSSQUARE_ADMISSION_QUEUE_TIMEOUT", "20")),
+        # JSON overrides of the task -> model table in core/routing.py
+        model_routes=os.getenv("CLASSSQUARE_MODEL_ROUTES"),
+        # interactive calls slower than this percentile of recent latency get a second, identical call
+        hedge_percentile=float(os.getenv("CLASSSQUARE_HEDGE_PERCENTILE", "0.95")),
+        # at most this many hedge calls per call made
+        hedge_budget=float(os.getenv("CLASSSQUARE_HEDGE_BUDGET", "0.1")),
+        # uploaded syllabus files wait here until they are processed
+        upload_dir=os.getenv("CLASSSQUARE_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "classsquare-uploads")),
+        max_upload_mb=int(os.getenv("CLASSSQUARE_MAX_UPLOAD_MB", "50")),
+        # syllabus extractions running at once per worker
+        syllabus_workers=int(os.getenv("CLASSSQUARE_SYLLABUS_WORKERS", "2")),
+        # request records for replay are written here; capture is off when unset
+        capture_dir=os.getenv("CLASSSQUARE_CAPTURE_DIR"),
+        capture_file_mb=int(os.getenv("CLASSSQUARE_CAPTURE_FILE_MB", "50")),
+        # capture files kept per host, newest first
+        capture_files=int(os.getenv("CLASSSQUARE_CAPTURE_FILES", "20")),
+        # per worker: posts of lazy feeds generated at once
+        feed_growth_workers=int(os.getenv("CLASSSQUARE_FEED_GROWTH_WORKERS", "4")),
+        # the LLM circuit opens when more than this share of the calls of the last `breaker_window` seconds
+        # failed or took longer than `breaker_slow_seconds`, given at least `breaker_min_calls` calls
+        breaker_error_rate=float(os.getenv("CLASSSQUARE_BREAKER_ERROR_RATE", "0.5")),
+        breaker_slow_seconds=float(os.getenv("CLASSSQUARE_BREAKER_SLOW_SECONDS", "30")),
+        breaker_min_calls=int(os.getenv("CLASSSQUARE_BREAKER_MIN_CALLS", "8")),
+        breaker_window=float(os.getenv("CLASSSQUARE_BREAKER_WINDOW", "60")),
+        # seconds an open circuit fails calls fast before it lets a probe through
+        breaker_open_seconds=float(os.getenv("CLASSSQUARE_BREAKER_OPEN_SECONDS", "30")),
+        # per worker: LLM requests per minute the provider's quota allows; 0 when it isn't limited
+        llm_rpm=float(os.getenv("CLASSSQUARE_LLM_RPM", "0")),
+    )
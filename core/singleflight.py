@@ -0,0 +1,33 @@
+"""Single-flight execution: concurrent callers with the same key share one run.
+
+Within a worker, the first caller starts the work and everyone else awaits the
+same task. With `share_ttl`, the run also goes through the shared cache, so
+identical calls on other workers of the host wait for it too and can reuse the
+result for `share_ttl` seconds.
+"""
+import asyncio
+
+from core.cache import get_cache
+
+
+class SingleFlight:
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._calls = {}
+
+    async def do(self, key: str, fn, share_ttl: float | None = None):
+        """Returns the result of `fn()` (a coroutine function), running it once for all concurrent callers of `key`."""
+        task = self._calls.get(key)
+        if task is None:
+            if share_ttl is None:
+                task = asyncio.ensure_future(fn())
+            else:
+                task = asyncio.ensure_future(get_cache().aget_or_compute(f"{self.namespace}:{key}", fn, ttl=share_ttl))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # one impatient caller disconnecting must not cancel the work the others are waiting on
+        return await asyncio.shield(task)
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split()).casefold()
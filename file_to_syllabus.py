@@ -15,11 +15,12 @@ def extract_text_from_file(filename):
     elif ext == 'pdf':
         with open(filename, 'rb') as f:
             reader = PyPDF2.PdfReader(f)
-            return '\n'.join(page.extract_text() for page in reader.pages if page.extract_text())
+            # extracting a page is slow; do it once per page
+            return '\n'.join(text for text in (page.extract_text() for page in reader.pages) if text)
     else:
         raise ValueError("Unsupported file type: " + ext)
 
-def get_syllabus_json_from_gemini(text, model_name="models/gemini-1.5-flash"):
+def get_syllabus_json_from_gemini(text, model_name=None):
     prompt = (
         "Extract a syllabus from the following text. "
         "Return the result as a JSON object with this structure:\n"
@@ -47,7 +48,11 @@ def get_syllabus_json_from_gemini(text, model_name="models/gemini-1.5-flash"):
         "Only output valid JSON. Here is the text:\n\n"
         f"{text}\n"
     )
-    model = genai.GenerativeModel(model_name)
+    if model_name is None:
+        from core.routing import get_task_model
+        model = get_task_model("syllabus")
+    else:
+        model = genai.GenerativeModel(model_name)
     response = model.generate_content(prompt)
     # Try to extract JSON from the response
     import json, re
@@ -1,34 +1,73 @@
-from fastapi import FastAPI, HTTPException
-import google.generativeai as genai
-import os
-from routes.ask import router as ask_router
-from routes.feed import router as feed_router
-from routes.feed_generation import router as feed_generation_router
-from supabase import create_client
-from dotenv import load_dotenv
-
-load_dotenv()
-
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY environment variable not set")
-genai.configure(api_key=api_key)
-
-# Initialize Gemini model
-model = genai.GenerativeModel("gemini-pro")
-
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
-supabase = create_client(supabase_url, supabase_key)
-
-app = FastAPI()
-app.include_router(ask_router)
-app.include_router(feed_router)
-app.include_router(feed_generation_router)
-
-# Keep this route for user history tracking
-@app.get("/history/{user_id}")
-def get_history(user_id: str):
-    response = supabase.table("interactions").select("*").eq("user_id", user_id).order("timestamp", desc=True).execute()
-    return {"interactions": response.data}
+from contextlib import asynccontextmanager
 
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from core.admission import get_admission
+from core.breaker import CircuitOpenError, get_breaker
+from core.cache import get_cache
+from core.capture import CaptureMiddleware
+from core.clients import get_supabase
+from core.deferred import get_deferred
+from core.events import get_hub
+from core.profiling import ProfilingMiddleware
+from core.routing import routing_stats
+from core.settings import get_settings
+
+
+def create_app() -> FastAPI:
+    settings = get_settings()
+    if not settings.gemini_api_key:
+        raise ValueError("GEMINI_API_KEY environment variable not set")
+
+    from routes.admin import router as admin_router
+    from routes.ask import router as ask_router
+    from routes.events import router as events_router
+    from routes.feed import router as feed_router
+    from routes.feed_generation import router as feed_generation_router
+    from routes.syllabus import router as syllabus_router
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # work deferred while the circuit was open, by this or an earlier worker, drains without waiting for a request
+        get_deferred()
+        yield
+
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(ProfilingMiddleware)
+    if settings.capture_dir:
+        app.add_middleware(CaptureMiddleware)
+    app.include_router(admin_router)
+    app.include_router(ask_router)
+    app.include_router(events_router)
+    app.include_router(feed_router)
+    app.include_router(feed_generation_router)
+    app.include_router(syllabus_router)
+
+    # an LLM call refused by the open circuit that no route turned into a degraded answer
+    @app.exception_handler(CircuitOpenError)
+    async def circuit_open(request: Request, exc: CircuitOpenError):
+        return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(int(exc.retry_after))})
+
+    # Keep this route for user history tracking
+    @app.get("/history/{user_id}")
+    def get_history(user_id: str):
+        response = get_supabase().table("interactions").select("*").eq("user_id", user_id).order("timestamp", desc=True).execute()
+        return {"interactions": response.data}
+
+    @app.get("/health")
+    def health():
+        breaker = get_breaker().stats()
+        return {
+            "status": "ok" if breaker["state"] == "closed" else "degraded",
+            "cache": get_cache().stats(),
+            "feed_subscribers": get_hub().subscriber_count,
+            "admission": get_admission().stats(),
+            "routing": routing_stats(),
+            "breaker": breaker,
+            "deferred": get_deferred().stats(),
+        }
+
+    return app
+
+
+app = create_app()
@@ -0,0 +1,213 @@
+"""Pre-generates draft feeds for syllabus topics during off-peak hours.
+
+Walks the `topic_title`s (and optionally `detailed_points`) of every subject's
+syllabus, most-used topics first, and stores personas plus finished posts and
+comments in `feed_drafts`. When a teacher later picks one of these topics,
+/generate-personas offers the draft's personas and /generate-feed copies the
+draft into a new feed without calling the LLM.
+
+Drafts live in a `feed_drafts` table. Until it exists the API simply never
+finds a draft; create it in Supabase with:
+
+    create table feed_drafts (
+        id uuid primary key default gen_random_uuid(),
+        subject_id uuid not null references subjects (id) on delete cascade,
+        topic text not null,
+        global_prompt text not null,
+        personas jsonb not null,
+        posts jsonb not null,
+        llm_calls int not null default 0,
+        uses int not null default 0,
+        created_at timestamptz not null default now()
+    );
+    create index feed_drafts_subject_topic on feed_drafts (subject_id, topic, created_at desc);
+
+A draft is written under the prompt /generate-prompt gives for the --class-label
+age group. /generate-feed only serves it to a teacher whose global_prompt is the
+same, so pass the label most classes use.
+
+Run it from cron, e.g. every night at 01:00 until 06:00:
+
+    0 1 * * * cd /srv/classsquare && python pregenerate.py --max-llm-calls 600 --rpm 20 --until 06:00
+"""
+import argparse
+import json
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from core.clients import get_supabase
+from core.routing import get_task_model
+from routes.feed_generation import (
+    GeneratePromptRequest,
+    ensure_persona_users,
+    generate_feed_content,
+    generate_prompt,
+    request_personas,
+    save_personas,
+)
+
+# persona listing (up to three rounds) plus up to five posts with two comments each
+MAX_CALLS_PER_DRAFT = 3 + 5 + 5 * 2
+
+
+class BudgetExhausted(Exception):
+    pass
+
+
+class Pacer:
+    """A requests-per-minute limit and a total call budget, shared by every model of a run."""
+
+    def __init__(self, rpm: float, max_calls: int):
+        self.interval = 60.0 / rpm
+        self.max_calls = max_calls
+        self.calls = 0
+        self._next_slot = time.monotonic()
+
+    @property
+    def remaining(self) -> int:
+        return self.max_calls - self.calls
+
+    def wait_turn(self):
+        if self.calls >= self.max_calls:
+            raise BudgetExhausted()
+        wait = self._next_slot - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._next_slot = max(time.monotonic(), self._next_slot) + self.interval
+        self.calls += 1
+
+
+class PacedModel:
+    """Wraps a model so its calls count against `pacer`."""
+
+    def __init__(self, model, pacer: Pacer):
+        self.model = model
+        self.pacer = pacer
+
+    def generate_content(self, *args, **kwargs):
+        self.pacer.wait_turn()
+        return self.model.generate_content(*args, **kwargs)
+
+
+def syllabus_topics(syllabus, include_points: bool) -> list:
+    """Topic strings of a syllabus, in syllabus order, in the format file_to_syllabus.py produces."""
+    if isinstance(syllabus, str):
+        syllabus = json.loads(syllabus) if syllabus.strip() else {}
+    syllabus = syllabus.get("syllabus", syllabus) if isinstance(syllabus, dict) else {}
+    topics = []
+    for section in syllabus.get("subject_curriculum", []):
+        for chapter in section.get("chapters_or_topics", []):
+            if chapter.get("topic_title"):
+                topics.append(chapter["topic_title"].strip())
+            if include_points:
+                topics.extend(p.strip() for p in chapter.get("detailed_points", []) if p and p.strip())
+    return list(dict.fromkeys(topics))
+
+
+def topic_popularity(subject_id: str) -> Counter:
+    """How many feeds have been created per topic, feeds being titled after their topic."""
+    resp = get_supabase().table("feeds").select("title").eq("subject_id", subject_id).execute()
+    return Counter(f["title"] for f in resp.data or [])
+
+
+def drafted_topics(subject_id: str) -> set:
+    resp = get_supabase().table("feed_drafts").select("topic").eq("subject_id", subject_id).execute()
+    return {d["topic"] for d in resp.data or []}
+
+
+def pregenerate_topic(pacer: Pacer, subject: dict, topic: str, persona_count: int, class_label: str):
+    calls_before = pacer.calls
+    # each step on the model routed for it, as the API does, within the run's one budget
+    personas = request_personas(PacedModel(get_task_model("persona-list"), pacer), topic, persona_count)
+    if len(personas) < 3:
+        raise ValueError(f"only {len(personas)} personas generated")
+    save_personas(subject["id"], personas)
+    ensure_persona_users(personas)
+
+    selected = random.sample(personas, min(len(personas), random.randint(6, 12)))
+    global_prompt = generate_prompt(GeneratePromptRequest(
+        subject_id=subject["id"], class_id=class_label, topic=topic, personas=[p["name"] for p in selected]
+    ))["prompt"]
+    posts = generate_feed_content(PacedModel(get_task_model("persona-post"), pacer), selected, topic, global_prompt)
+
+    get_supabase().table("feed_drafts").insert({
+        "subject_id": subject["id"],
+        "topic": topic,
+        "global_prompt": global_prompt,
+        "personas": personas,
+        "posts": posts,
+        "llm_calls": pacer.calls - calls_before,
+        "uses": 0,
+        "created_at": datetime.utcnow().isoformat()
+    }).execute()
+
+
+def parse_deadline(value: str | None):
+    if not value:
+        return None
+    hour, minute = map(int, value.split(":"))
+    deadline = datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if deadline <= datetime.now():
+        deadline += timedelta(days=1)
+    return deadline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subject", help="only this subject id (default: every subject with a syllabus)")
+    parser.add_argument("--max-llm-calls", type=int, required=True, help="total LLM call budget for this run")
+    parser.add_argument("--rpm", type=float, default=15, help="LLM requests per minute")
+    parser.add_argument("--until", help="stop starting new topics after this local time (HH:MM)")
+    parser.add_argument("--include-points", action="store_true", help="also draft feeds for detailed_points")
+    parser.add_argument("--personas", type=int, default=15, help="personas to generate per topic")
+    parser.add_argument("--class-label", default="all", help="age group used in the draft's global prompt")
+    args = parser.parse_args()
+
+    supabase = get_supabase()
+    query = supabase.table("subjects").select("id, name, syllabus")
+    if args.subject:
+        query = query.eq("id", args.subject)
+    subjects = [s for s in query.execute().data or [] if s.get("syllabus")]
+
+    # most popular topics first across all subjects; ties keep syllabus order
+    queue = []
+    for subject in subjects:
+        try:
+            topics = syllabus_topics(subject["syllabus"], args.include_points)
+        except ValueError as e:
+            print(f"Skipping {subject['name']}: unreadable syllabus ({e})")
+            continue
+        popularity = topic_popularity(subject["id"])
+        done = drafted_topics(subject["id"])
+        for index, topic in enumerate(topics):
+            if topic not in done:
+                queue.append((-popularity[topic], index, subject, topic))
+    queue.sort(key=lambda item: (item[0], item[1]))
+    print(f"{len(queue)} topics without a draft")
+
+    pacer = Pacer(args.rpm, args.max_llm_calls)
+    deadline = parse_deadline(args.until)
+    drafted = 0
+    for _, _, subject, topic in queue:
+        if deadline and datetime.now() >= deadline:
+            print("Reached --until, stopping")
+            break
+        if pacer.remaining < MAX_CALLS_PER_DRAFT:
+            print("LLM call budget exhausted, stopping")
+            break
+        try:
+            pregenerate_topic(pacer, subject, topic, args.personas, args.class_label)
+            drafted += 1
+            print(f"Drafted {subject['name']} / {topic}")
+        except BudgetExhausted:
+            print("LLM call budget exhausted, stopping")
+            break
+        except Exception as e:
+            print(f"Failed to draft {subject['name']} / {topic}: {e}")
+    print(f"Drafted {drafted} feeds using {pacer.calls} LLM calls")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+from core.admin import require_admin
+from core import profiling
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+class ProfilingPlan(BaseModel):
+    next: int = Field(0, ge=0)  # profile the next N requests on this host
+    sample_rate: float = Field(0.0, ge=0.0, le=1.0)  # and/or this share of all requests
+    duration: int = Field(600, gt=0, le=24 * 3600)  # seconds until the plan expires
+
+@router.get("/profiling")
+def get_profiling():
+    return {"plan": profiling.current_plan()}
+
+@router.post("/profiling")
+def arm_profiling(data: ProfilingPlan):
+    return {"plan": profiling.arm(data.next, data.sample_rate, data.duration)}
+
+@router.delete("/profiling")
+def disarm_profiling():
+    profiling.disarm()
+    return {"plan": None}
+
+@router.get("/profiles")
+def list_profiles():
+    return {"profiles": profiling.list_profiles()}
+
+@router.get("/profiles/{profile_id}")
+def download_profile(profile_id: str, format: str = "folded"):
+    if format not in ("folded", "json"):
+        raise HTTPException(status_code=400, detail="format must be 'folded' or 'json'")
+    path = profiling.profile_path(profile_id, f".{format}")
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "application/json" if format == "json" else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=f"{profile_id}.{format}")
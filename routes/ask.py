@@ -1,124 +1,352 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 from datetime import datetime
-import google.generativeai as genai
-from supabase import create_client
-import os
-from dotenv import load_dotenv
-load_dotenv()
+import asyncio
+import json
+import random
+from core.clients import get_supabase
+from core.admission import get_admission
+from core.breaker import CircuitOpenError, get_breaker
+from core.cache import cached_completion, get_cache
+from core.coalesce import Coalescer
+from core.deferred import defer, register
+from core.events import publish
+from core.lookups import get_feed, get_personas, get_post_feed_id, get_subject
+from core.routing import get_task_model
+from core.settings import get_settings
+from core.singleflight import SingleFlight
 
 # Setup
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel("models/gemini-1.5-flash")
-
-supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
 router = APIRouter()
 
+# how long a finished reply is handed to repeated /ask calls for the same comment on any worker
+ASK_REPLAY_TTL = 120
+# recent replies per subject, served while the LLM is unavailable
+REPLY_POOL_SIZE = 50
+REPLY_POOL_TTL = 7 * 24 * 3600
+
 # Request schema
 class AskByComment(BaseModel):
     comment_id: str
 
+class Degraded(Exception):
+    """The LLM is unavailable for `comment`; each caller answers with its own degraded_reply, never a shared one."""
+    def __init__(self, comment):
+        super().__init__("The language model is unavailable right now")
+        self.comment = comment
+
+_coalescer = None
+_inflight = SingleFlight("ask")
+
+def get_coalescer() -> Coalescer:
+    global _coalescer
+    if _coalescer is None:
+        settings = get_settings()
+        _coalescer = Coalescer(reply_to_comments, settings.ask_coalesce_window, settings.ask_coalesce_max_batch, admit_batch)
+    return _coalescer
+
 @router.post("/ask")
 async def ask_by_comment(data: AskByComment):
     try:
-        # 1. Fetch the comment
-        comment_resp = supabase.table("comments").select("*").eq("id", data.comment_id).single().execute()
-        if not comment_resp.data:
-            raise HTTPException(status_code=404, detail="Comment not found.")
-        comment = comment_resp.data
-        post_id = comment["post_id"]
-        parent_comment_id = comment.get("parent_comment_id")
-        author_id = comment["author_id"]
-        message = comment["content"]
-
-        # 2. Fetch the post to get feed_id
-        post_resp = supabase.table("posts").select("feed_id").eq("id", post_id).single().execute()
-        if not post_resp.data or not post_resp.data["feed_id"]:
-            raise HTTPException(status_code=404, detail="Post is missing a valid feed_id")
-        feed_id = post_resp.data["feed_id"]
-
-        # 3. Fetch the feed to get subject_id
-        feed_resp = supabase.table("feeds").select("subject_id, global_prompt").eq("id", feed_id).single().execute()
-        if not feed_resp.data or not feed_resp.data["subject_id"]:
-            raise HTTPException(status_code=404, detail="Feed is missing a valid subject_id")
-        subject_id = feed_resp.data["subject_id"]
-        global_prompt = feed_resp.data.get("global_prompt", "")
-
-        # 4. Fetch the subject
-        subject_resp = supabase.table("subjects").select("name, general_prompt").eq("id", subject_id).single().execute()
-        if not subject_resp.data:
-            raise HTTPException(status_code=404, detail="Subject not found.")
-        subject = subject_resp.data
-
-        # 5. Determine the author to respond to (parent comment or post)
-        if parent_comment_id:
-            # Get the parent comment's author
-            parent_resp = supabase.table("comments").select("author_id").eq("id", parent_comment_id).single().execute()
-            if not parent_resp.data:
-                raise HTTPException(status_code=404, detail="Parent comment not found.")
-            target_author_id = parent_resp.data["author_id"]
-        else:
-            # No parent comment — use post author
-            post_author_resp = supabase.table("posts").select("author_id").eq("id", post_id).single().execute()
-            if not post_author_resp.data:
-                raise HTTPException(status_code=404, detail="Post author not found.")
-            target_author_id = post_author_resp.data["author_id"]
+        # a double-clicked /ask joins the reply already being written instead of writing a second one
+        return await _inflight.do(data.comment_id, lambda: answer_comment(data.comment_id), share_ttl=ASK_REPLAY_TTL)
+    except Degraded as e:
+        # outside the single flight, so the stand-in is neither cached nor handed to the next /ask
+        return await asyncio.to_thread(degraded_reply, e.comment)
 
-        # 6. Fetch personas for the subject
-        personas_resp = supabase.table("personas").select("*").eq("subject_id", subject_id).execute()
-        personas = personas_resp.data
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if not personas:
-            raise HTTPException(status_code=404, detail=f"No personas found for subject_id {subject_id}")
+async def answer_comment(comment_id):
+    # 1. Fetch the comment
+    comment_resp = await asyncio.to_thread(
+        get_supabase().table("comments").select("*").eq("id", comment_id).single().execute
+    )
+    if not comment_resp.data:
+        raise HTTPException(status_code=404, detail="Comment not found.")
+    comment = comment_resp.data
 
-        # 7. Pick a persona based on the parent comment author (not same as parent author)
-        responding_persona = next((p for p in personas if p["id"] != target_author_id), None)
-        if not responding_persona:
-            raise HTTPException(status_code=404, detail="No suitable persona found to respond.")
+    # 2. An inappropriate comment is hidden, not answered
+    if not await asyncio.to_thread(moderate, comment):
+        return {"reply": None, "hidden": True}
+
+    # 3. With the LLM down, don't take a slot only to fail: answer from the subject's recent replies
+    if not get_breaker().available():
+        raise Degraded(comment)
+
+    # 4. Wait briefly for classmates commenting on the same post and answer them together;
+    #    the batch then waits for one admission slot of its class (see admit_batch)
+    try:
+        return await get_coalescer().submit(comment["post_id"], comment)
+    except CircuitOpenError:
+        raise Degraded(comment)
+
+@asynccontextmanager
+async def admit_batch(post_id, comments):
+    """Admission for one batch of /ask comments: a single LLM call, so a single slot of the feed's class.
+
+    The per-user cap applies to the author of the comment that opened the batch.
+    """
+    feed_id = await asyncio.to_thread(get_post_feed_id, post_id)
+    async with get_admission().admit(f"feed:{feed_id}", comments[0]["author_id"]):
+        yield
+
+def Filter(comment: str, post: str, feed: str, subject: str, comment_id: str = None, fail_open: bool = True):
+    prompt: str = "I have this "
+    if not comment is None:
+        prompt += f"comment: '{comment}', under the "
+    prompt += f"post:'{post}', which is on the feed: '{feed}', on the subject of: '{subject}'. Using ONLY THE WORDS(!!!) True or False please determine whether this comment is considered appropriate in an educational and respectful discussion. \n"
+    prompt += "When judging please do so by the following STRICT criteria:\n"
+    prompt += "1. The comment is too short to make sense, or just doesn't make sense in general\n"
+    prompt += "2. The comment is / mostly consists of repeated characters\n"
+    prompt += "3. The comment **CONTAINS ANY PROFANITY, HATE SPEECH, OR OFFENSIVE LANGUAGE WHATSOEVER. This is ABSOLUTELY UNACCEPTABLE in an educational environment.**\n\n"
+    prompt += "4. The comment is irrelevant to the subject at hand.\n"
+    prompt += "5. The comments uses only Emojis of any kind"
+    prompt += "6. The comment is an exact copy of the post\n"
+    prompt += "Examples:\n"
+    prompt += "Comment: 'Hello', Post: 'General', Feed: 'Welcome', Subject: 'Introduction' -> True\n"
+    prompt += "Comment: 'asdfasdf', Post: 'Tech', Feed: 'Coding', Subject: 'Debugging' -> False\n"
+    prompt += "Comment: 'fuck you', Post: 'Sports', Feed: 'Discussion', Subject: 'Game Recap' -> False\n" # Added a negative example
+    prompt += "Comment: 'This is great!', Post: 'Art', Feed: 'Critique', Subject: 'Painting' -> True\n"
+    prompt += "Comment: 'can I get a high five?', Post:'I am Leonardo Da Vinci, AMA', Feed: 'Famous Artists', Subject: 'History' -> False"
+    prompt += "\nBased on the criteria and examples, for the comment: '{message}', should the answer be True or False?"
+    # the same comment on the same post gets the same verdict, whichever worker asks
+    try:
+        response_text = cached_completion("moderation", prompt, ttl=3600).strip().lower()
+    except Exception as e:
+        if not fail_open:
+            raise
+        # the LLM is down or failing: let the comment through now and moderate it once it is back
+        print(f"Moderation unavailable, deferring: {e}")
+        if comment_id is not None:
+            defer("moderation", {"comment_id": comment_id, "comment": comment, "post": post, "feed": feed, "subject": subject},
+                  key=f"moderation:{comment_id}")
+        return True
+    response = response_text == "true"
+    return response
+
+def moderate(comment) -> bool:
+    """Runs Filter on `comment` and hides it if it fails; whether it may stay up.
+
+    While the LLM is unavailable the comment stays up and is moderated once it is back.
+    """
+    post_resp = get_supabase().table("posts").select("feed_id, content").eq("id", comment["post_id"]).maybe_single().execute()
+    post = post_resp.data if post_resp else None
+    feed = get_feed(post["feed_id"]) if post and post["feed_id"] else None
+    subject = get_subject(feed["subject_id"]) if feed and feed["subject_id"] else None
+    if not subject:
+        # answering it reports what is missing
+        return True
+    if Filter(comment["content"], post["content"], feed["title"], subject["name"], comment["id"]):
+        return True
+    get_supabase().table("comments").update({"is_visible": False}).eq("id", comment["id"]).execute()
+    return False
+
+def moderate_deferred(payload):
+    """Runs moderation that was skipped while the LLM was unavailable and hides the comment if it fails."""
+    if not Filter(payload["comment"], payload["post"], payload["feed"], payload["subject"], fail_open=False):
+        get_supabase().table("comments").update({"is_visible": False}).eq("id", payload["comment_id"]).execute()
+
+def degraded_reply(comment):
+    """A recent reply by one of the subject's personas, marked "degraded"; the real reply is queued for when the LLM is back.
+
+    The stand-in is not stored as a comment. The real reply is, and reaches the
+    feed's subscribers as a comments event.
+    """
+    defer("ask", {"comment_id": comment["id"]}, key=f"ask:{comment['id']}")
+    feed = get_feed(get_post_feed_id(comment["post_id"]))
+    pool = get_cache().get(f"persona-replies:{feed['subject_id']}") if feed else None
+    if not pool:
+        retry_after = str(int(get_breaker().retry_after()))
+        raise HTTPException(status_code=503, detail="Replies are delayed; this comment will be answered shortly",
+                            headers={"Retry-After": retry_after})
+    cached = random.choice(pool)
+    return {"reply": cached["reply"], "persona": cached["persona"], "degraded": True}
+
+def remember_replies(subject_id, new_replies):
+    key = f"persona-replies:{subject_id}"
+    pool = new_replies + (get_cache().get(key) or [])
+    get_cache().set(key, pool[:REPLY_POOL_SIZE], ttl=REPLY_POOL_TTL)
 
-        # 8. Fetch recent interactions for this user (if user is real)
-        user_resp = supabase.table("users").select("name").eq("id", author_id).maybe_single().execute()
-        username = user_resp.data["name"] if user_resp.data else "a participant"
+def answer_deferred(payload):
+    """Writes the real reply to a comment that got a degraded one."""
+    comment_resp = get_supabase().table("comments").select("*").eq("id", payload["comment_id"]).maybe_single().execute()
+    if not comment_resp or not comment_resp.data:
+        return
+    comment = comment_resp.data
+    if comment.get("is_visible") is False:
+        # hidden by moderation meanwhile
+        return
+    try:
+        result = reply_to_comments(comment["post_id"], [comment])[0]
+    except HTTPException as e:
+        result = e
+    if isinstance(result, HTTPException) and result.status_code < 500:
+        print(f"Deferred reply to {comment['id']} dropped: {result.detail}")
+    elif isinstance(result, Exception):
+        raise result
+
+def build_reply_prompt(persona, subject, message, username, interaction_history):
+    prompt = (
+        f"You are {persona['name']}, a historical or literary figure.\n"
+        f"Topic: {subject['name']}\n"
+        f"Subject context: {subject['general_prompt']}\n\n"
+    )
+
+    if persona.get("prompt"):
+        prompt += f"Persona background: {persona['prompt']}\n\n"
+
+    if interaction_history:
+        prompt += f"Here are some recent things {username} has asked or discussed:\n{interaction_history}\n\n"
+
+    prompt += f"Now respond to this message:\n{message}\n\n"
+    prompt += f"Respond as {persona['name']} would, keeping a consistent tone and voice."
+    return prompt
+
+def build_batch_prompt(subject, post, tasks):
+    prompt = (
+        f"Several students commented on the same post in a class discussion.\n"
+        f"Topic: {subject['name']}\n"
+        f"Subject context: {subject['general_prompt']}\n"
+        f"Post: {post['content']}\n\n"
+        f"Write one reply to each comment below, each in the voice of the historical or literary figure named for it, keeping that figure's consistent tone and voice.\n\n"
+    )
+    for task in tasks:
+        persona = task["persona"]
+        prompt += f"comment_id: {task['comment']['id']}\n"
+        prompt += f"Reply as: {persona['name']}\n"
+        if persona.get("prompt"):
+            prompt += f"Persona background: {persona['prompt']}\n"
+        if task["interaction_history"]:
+            prompt += f"Recent things {task['username']} has asked or discussed:\n{task['interaction_history']}\n"
+        prompt += f"Comment by {task['username']}: {task['comment']['content']}\n\n"
+    prompt += 'Return ONLY a JSON object of the form {"replies": [{"comment_id": "...", "reply": "..."}]} with exactly one entry per comment_id above.'
+    return prompt
+
+def reply_to_comments(post_id, comments):
+    """Replies to every comment in `comments` (all on post `post_id`) with one LLM call.
+
+    Context shared by the whole post is loaded once. Returns one {"reply": ...}
+    per comment, or an exception for comments that could not be answered.
+    """
+    supabase = get_supabase()
+    model = get_task_model("persona-reply")
+
+    # 1. Fetch the post to get feed_id
+    post_resp = supabase.table("posts").select("feed_id, author_id, content").eq("id", post_id).single().execute()
+    if not post_resp.data or not post_resp.data["feed_id"]:
+        raise HTTPException(status_code=404, detail="Post is missing a valid feed_id")
+    post = post_resp.data
+
+    # 2. Fetch the feed to get subject_id
+    feed = get_feed(post["feed_id"])
+    if not feed or not feed["subject_id"]:
+        raise HTTPException(status_code=404, detail="Feed is missing a valid subject_id")
+    subject_id = feed["subject_id"]
+
+    # 3. Fetch the subject
+    subject = get_subject(subject_id)
+    if not subject:
+        raise HTTPException(status_code=404, detail="Subject not found.")
+
+    # 4. Fetch personas for the subject
+    personas = get_personas(subject_id)
+    if not personas:
+        raise HTTPException(status_code=404, detail=f"No personas found for subject_id {subject_id}")
+
+    # 5. A comment a persona already answered keeps that answer instead of getting a second reply
+    persona_ids = {p["id"] for p in personas}
+    existing_resp = supabase.table("comments").select("parent_comment_id, author_id, content") \
+        .in_("parent_comment_id", [c["id"] for c in comments]).execute()
+    answered = {r["parent_comment_id"]: r["content"] for r in existing_resp.data or [] if r["author_id"] in persona_ids}
 
+    # 6. Determine the author each comment responds to (parent comment or post)
+    parent_ids = list({c["parent_comment_id"] for c in comments if c.get("parent_comment_id")})
+    parent_authors = {}
+    if parent_ids:
+        parents_resp = supabase.table("comments").select("id, author_id").in_("id", parent_ids).execute()
+        parent_authors = {p["id"]: p["author_id"] for p in parents_resp.data or []}
+
+    # 7. Fetch names and recent interactions of the commenting users (if they are real)
+    author_ids = list({c["author_id"] for c in comments})
+    users_resp = supabase.table("users").select("id, name").in_("id", author_ids).execute()
+    usernames = {u["id"]: u["name"] for u in users_resp.data or []}
+
+    histories = {}
+    for author_id in author_ids:
         interactions_resp = supabase.table("interactions").select("message, reply") \
             .eq("user_id", author_id).order("timestamp", desc=True).limit(3).execute()
-
-        interaction_history = "\n".join(
+        histories[author_id] = "\n".join(
             [f"Q: {i['message']}\nA: {i['reply']}" for i in interactions_resp.data]
         ) if interactions_resp.data else ""
 
-        # 9. Build the prompt
-        prompt = (
-            f"You are {responding_persona['name']}, a historical or literary figure.\n"
-            f"Topic: {subject['name']}\n"
-            f"Subject context: {subject['general_prompt']}\n\n"
-        )
-
-        if responding_persona.get("prompt"):
-            prompt += f"Persona background: {responding_persona['prompt']}\n\n"
-
-        if interaction_history:
-            prompt += f"Here are some recent things {username} has asked or discussed:\n{interaction_history}\n\n"
+    results = [None] * len(comments)
+    tasks = []
+    for index, comment in enumerate(comments):
+        if comment["id"] in answered:
+            results[index] = {"reply": answered[comment["id"]]}
+            continue
+        parent_comment_id = comment.get("parent_comment_id")
+        if parent_comment_id:
+            target_author_id = parent_authors.get(parent_comment_id)
+            if target_author_id is None:
+                results[index] = HTTPException(status_code=404, detail="Parent comment not found.")
+                continue
+        else:
+            target_author_id = post["author_id"]
 
-        prompt += f"Now respond to this message:\n{message}\n\n"
-        prompt += f"Respond as {responding_persona['name']} would, keeping a consistent tone and voice."
+        # 8. Pick a persona that isn't the author being replied to
+        responding_persona = next((p for p in personas if p["id"] != target_author_id), None)
+        if not responding_persona:
+            results[index] = HTTPException(status_code=404, detail="No suitable persona found to respond.")
+            continue
+        tasks.append({
+            "index": index,
+            "comment": comment,
+            "persona": responding_persona,
+            "username": usernames.get(comment["author_id"], "a participant"),
+            "interaction_history": histories[comment["author_id"]],
+        })
 
-        # 10. Generate response
-        response = model.generate_content(prompt)
-        reply_text = response.text.strip()
+    # 9. Generate all replies in one call; a lone comment keeps the plain single-reply prompt
+    replies = {}
+    if len(tasks) > 1:
+        try:
+            response = get_task_model("persona-reply-batch").generate_content(
+                build_batch_prompt(subject, post, tasks),
+                generation_config={"response_mime_type": "application/json"},
+            )
+            for item in json.loads(response.text).get("replies", []):
+                if item.get("comment_id") and item.get("reply"):
+                    replies[str(item["comment_id"])] = item["reply"].strip()
+        except Exception as e:
+            print(f"Batched reply failed, answering comments one by one: {e}")
+    for task in tasks:
+        if str(task["comment"]["id"]) not in replies:
+            prompt = build_reply_prompt(task["persona"], subject, task["comment"]["content"], task["username"], task["interaction_history"])
+            replies[str(task["comment"]["id"])] = model.generate_content(prompt).text.strip()
 
-        # 11. Save the new comment
-        new_comment = {
+    # 10. Save all new comments in one insert
+    if tasks:
+        new_comments = [{
             "post_id": post_id,
-            "parent_comment_id": data.comment_id,
-            "author_id": responding_persona["id"],
-            "content": reply_text,
+            "parent_comment_id": task["comment"]["id"],
+            "author_id": task["persona"]["id"],
+            "content": replies[str(task["comment"]["id"])],
             "created_at": datetime.utcnow().isoformat()
-        }
-
-        supabase.table("comments").insert(new_comment).execute()
+        } for task in tasks]
+        insert_resp = supabase.table("comments").insert(new_comments).execute()
+        publish(post["feed_id"], "comments", insert_resp.data or new_comments)
+        remember_replies(subject_id, [
+            {"persona": task["persona"]["name"], "reply": replies[str(task["comment"]["id"])]} for task in tasks
+        ])
 
-        return {"reply": reply_text}
+    for task in tasks:
+        results[task["index"]] = {"reply": replies[str(task["comment"]["id"])]}
+    return results
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+register("ask", answer_deferred)
+register("moderation", moderate_deferred)
@@ -0,0 +1,44 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import asyncio
+from core.events import get_hub
+
+router = APIRouter()
+
+# idle connections get a ping so proxies don't time them out
+KEEPALIVE_INTERVAL = 25
+
+@router.websocket("/feeds/{feed_id}/events")
+async def feed_events(websocket: WebSocket, feed_id: str, after: int | None = None):
+    """Pushes {"id", "type": "posts" | "comments", "feed_id", "items": [...]} as rows are added to the feed.
+
+    Reconnect with ?after=<last id received> to get what was missed. On
+    {"type": "resync"} the client should reload the feed and reconnect without `after`.
+    """
+    await websocket.accept()
+    hub = get_hub()
+    subscription = hub.subscribe(feed_id, after)
+    # the client never sends anything we need, but reading is how a disconnect is noticed
+    receiver = asyncio.create_task(_drain(websocket))
+    try:
+        while not receiver.done():
+            getter = asyncio.create_task(subscription.next())
+            done, _ = await asyncio.wait({getter, receiver}, timeout=KEEPALIVE_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                if not receiver.done():
+                    await websocket.send_json({"type": "ping"})
+                continue
+            event = getter.result()
+            await websocket.send_json(event)
+            if event["type"] == "resync":
+                await websocket.close(code=1013)
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        hub.unsubscribe(subscription)
+
+async def _drain(websocket: WebSocket):
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
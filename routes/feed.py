@@ -1,146 +1,340 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from pydantic import BaseModel, Field
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import google.generativeai as genai
-from supabase import create_client
-import os
-from dotenv import load_dotenv
-load_dotenv()
+import asyncio
+import hashlib
+import json
+from core.admission import get_admission
+from core.breaker import CircuitOpenError, get_breaker
+from core.cache import get_cache
+from core.clients import get_supabase
+from core.deferred import defer, register
+from core.events import publish
+from core.feed_store import load_feed_page
+from core.idempotency import defer_idempotent, register_job, run_idempotent
+from core.lookups import FEED_PAGE_TTL, feed_version, get_feed, get_personas, get_subject, invalidate_feed_pages
+from core.planning import PlanRecorder
+from core.routing import get_task_model
+from core.settings import get_settings
 
 # Setup
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel("models/gemini-1.5-flash")
-
-supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
 router = APIRouter()
+# a lazy run's plan is kept this long; posts not read by then are never generated
+GROWTH_TTL = 7 * 24 * 3600
 
 class FeedPopulationRequest(BaseModel):
     feed_id: str
     topic: str  # NEW: selected topic from frontend
-    num_initial_posts: int = 8  # Default number of initial posts
+    num_initial_posts: int = Field(8, ge=0)  # Default number of initial posts
     num_comments_per_post: int = 8  # Default number of comments per post
+    lazy: bool = False  # Generate only the first page now, the rest as the feed is read
+    first_page: int = Field(3, ge=1)  # Posts generated up front when lazy
+
+@router.get("/feeds/{feed_id}")
+def read_feed(feed_id: str, offset: int = Query(0, ge=0), limit: int = Query(20, ge=1, le=100),
+              if_none_match: str | None = Header(None)):
+    """Visible posts of a feed, oldest first, each with its nested tree of visible comments under "comments"/"replies".
+
+    While a lazy run still has posts to generate, pages hold at most its `first_page` posts; follow "next_offset".
+    """
+    plan = get_cache().get(f"feed-growth:{feed_id}")
+    if plan and pending_posts(feed_id):
+        # a reader only ever makes the next small page be generated, not the whole rest of the run
+        limit = min(limit, plan["request"]["first_page"])
+    # a page is rendered once per feed version and served as-is until the feed changes
+    key = f"feed-page:{feed_id}:{feed_version(feed_id)}:{offset}:{limit}"
+    page = get_cache().get(key)
+    if page is None:
+        content = load_feed_page(feed_id, offset, limit)
+        if content is None:
+            raise HTTPException(status_code=404, detail="Feed not found")
+        content["pending_posts"] = pending_posts(feed_id)
+        if content["next_offset"] is None and content["pending_posts"] and len(content["posts"]) == limit:
+            content["next_offset"] = offset + limit
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":"))
+        page = {"etag": f'"{hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]}"', "body": body}
+        get_cache().set(key, page, ttl=FEED_PAGE_TTL)
+    # keep one page ahead of the reader, so scrolling on never waits for generation
+    grow_feed(feed_id, offset + 2 * limit)
+
+    headers = {"ETag": page["etag"], "Cache-Control": "no-cache"}
+    if if_none_match and page["etag"] in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=page["body"], media_type="application/json", headers=headers)
 
 @router.post("/populate-feed")
-async def populate_feed(data: FeedPopulationRequest):
+async def populate_feed(data: FeedPopulationRequest, response: Response, idempotency_key: str | None = Header(None),
+                        dry_run: bool = Query(False)):
+    if dry_run:
+        # only reads: estimate the cost instead of paying it
+        plan = await asyncio.to_thread(fill_feed, data, True)
+        plan["estimated_queue_seconds"] = get_admission().expected_wait(f"feed:{data.feed_id}")
+        return plan
+    payload = data.model_dump(mode="json")
+    # with the LLM down, accept the request as a job that runs once it is back
+    if not get_breaker().available():
+        return defer_idempotent("populate-feed", idempotency_key, payload, response)
+    # a retried request joins the run already in progress, or gets its result once it finished;
+    # after an interrupted run it picks up behind the posts and comments that run stored.
+    # Only a request that runs the job waits for an admission slot.
     try:
-        # 1. Fetch the feed and its subject
-        feed_resp = supabase.table("feeds").select("subject_id, global_prompt").eq("id", data.feed_id).single().execute()
-        if not feed_resp.data:
-            raise HTTPException(status_code=404, detail="Feed not found")
-        
-        feed = feed_resp.data
-        subject_id = feed["subject_id"]
-        global_prompt = feed.get("global_prompt", "")
-
-        # 2. Fetch the subject
-        subject_resp = supabase.table("subjects").select("name, general_prompt").eq("id", subject_id).single().execute()
-        if not subject_resp.data:
-            raise HTTPException(status_code=404, detail="Subject not found")
-        
-        subject = subject_resp.data
-
-        # 3. Fetch personas for this subject
-        personas_resp = supabase.table("personas").select("*").eq("subject_id", subject_id).execute()
-        if not personas_resp.data:
-            raise HTTPException(status_code=404, detail="No personas found for this subject")
-        
-        personas = personas_resp.data
-        # Fallback: ensure all personas have a name
-        for p in personas:
-            if not p.get('name') or not p['name'].strip():
-                p['name'] = f"Persona_{p.get('id', '')}"
-
-        # Detect language from topic
-        def detect_language(text):
-            for c in text:
-                if '\u0590' <= c <= '\u05FF':
-                    return 'hebrew'
-            return 'english'
-        language = detect_language(data.topic)
-        language_instruction = {
-            'hebrew': 'כתוב את כל התגובה, כולל שם הדמות, בעברית. כתוב בסגנון פוסט או תגובה ברשת חברתית, כולל אימוג׳ים אם מתאים לדמות.',
-            'english': 'Write your entire response, including the persona name, in English. Style it like a real social media post or comment, using emojis if it fits the character.'
-        }[language]
-
-        # 4. Generate initial posts
-        posts = []
-        for _ in range(data.num_initial_posts):
-            post_persona = personas[_ % len(personas)]
-            persona_name = post_persona.get('name', f"Persona_{post_persona.get('id','')}")
-            persona_background = post_persona.get('prompt', '')
-            post_prompt = (
-                f"GLOBAL FEED PROMPT: {global_prompt}\n"
-                f"You are {persona_name}, a historical or literary figure.\n"
-                f"Topic: {data.topic}\n"
-                f"Subject context: {subject['general_prompt']}\n"
-                f"Persona background: {persona_background}\n\n"
-                f"Write a believable, casual social media post (3-5 sentences) as if you are posting about your everyday life, events, or thoughts related to this topic. Do NOT just list keywords. Use first-person, make it engaging and authentic. If your character is quirky, use emojis and social media conventions. Do not use hashtags.\n"
-                f"{language_instruction}"
-            )
-            post_content = model.generate_content(post_prompt).text.strip()
-            
-            # Create the post
-            post = {
-                "feed_id": data.feed_id,
-                "author_id": post_persona["id"],
-                "content": post_content,
-                "created_at": datetime.utcnow().isoformat()
-            }
-            
-            # Create a temporary user for the persona if it doesn't exist
-            user_check = supabase.table("users").select("id").eq("id", post_persona["id"]).execute()
-            if not user_check.data:
-                temp_user = {
-                    "id": post_persona["id"],
-                    "username": post_persona["name"].lower().replace(" ", "_"),
-                    "name": post_persona["name"],
-                    "role": "student",
-                    "password_hash": "$2b$10$ZHzvfUBiHM/Ldio6jlLdQuqLlR9egTi/HEOyb0Kttr/90Yj0df65W"  # Default hash
-                }
-                supabase.table("users").insert(temp_user).execute()
-            
-            post_resp = supabase.table("posts").insert(post).execute()
-            if not post_resp.data:
-                raise HTTPException(status_code=500, detail="Failed to create post")
-            
-            posts.append(post_resp.data[0])
-
-        # 5. Generate comments for each post
-        for post in posts:
-            comment_personas = [p for p in personas if p["id"] != post["author_id"]]
-            for i in range(data.num_comments_per_post):
-                comment_persona = comment_personas[i % len(comment_personas)]
-                comment_name = comment_persona.get('name', f"Persona_{comment_persona.get('id','')}")
-                comment_background = comment_persona.get('prompt', '')
-                comment_prompt = (
-                    f"GLOBAL FEED PROMPT: {global_prompt}\n"
-                    f"You are {comment_name}, a historical or literary figure.\n"
-                    f"Topic: {data.topic}\n"
-                    f"Subject context: {subject['general_prompt']}\n"
-                    f"Persona background: {comment_background}\n\n"
-                    f"Respond to this post by {post['author_id']} (content: {post['content']}) as if you are commenting on social media. Write a believable, casual, first-person comment (1-2 sentences) that adds to the conversation. If your character is quirky, use emojis and social media conventions. Do not use hashtags.\n"
-                    f"{language_instruction}"
-                )
-                comment_content = model.generate_content(comment_prompt).text.strip()
-                
-                # Create the comment
-                comment = {
-                    "post_id": post["id"],
-                    "author_id": comment_persona["id"],
-                    "content": comment_content,
-                    "created_at": datetime.utcnow().isoformat()
-                }
-                
-                comment_resp = supabase.table("comments").insert(comment).execute()
-                if not comment_resp.data:
-                    raise HTTPException(status_code=500, detail="Failed to create comment")
+        return await run_idempotent("populate-feed", idempotency_key, payload,
+                                    lambda progress: fill_feed(data, progress=progress), response,
+                                    admit=lambda: get_admission().admit(f"feed:{data.feed_id}"))
+    except CircuitOpenError:
+        return defer_idempotent("populate-feed", idempotency_key, payload, response)
+
+def fill_feed(data: FeedPopulationRequest, dry_run: bool = False, progress: dict | None = None):
+    """Adds posts and comments to the feed; with `dry_run`, returns the generation plan without calling the LLM or writing anything.
 
+    With `data.lazy`, only the first `data.first_page` posts are generated now; see `grow_feed` for the rest.
+    `progress` records the rows stored so far; passing the dict of an interrupted run resumes it after them.
+    """
+    model = PlanRecorder("persona-post") if dry_run else get_task_model("persona-post")
+    progress = {} if progress is None else progress
+    try:
+        context = feed_context(data)
+        count = min(data.num_initial_posts, data.first_page) if data.lazy else data.num_initial_posts
+        if data.lazy and not dry_run and "start" not in progress:
+            # where this run's posts begin in the feed, so reads can tell which of them they are close to
+            progress["start"] = len(get_supabase().table("posts").select("id").eq("feed_id", data.feed_id).eq("is_visible", True).execute().data or [])
+        for index in range(progress.get("posts", 0), count):
+            populate_post(data, context, index, model, dry_run, progress)
+            progress.update(posts=index + 1, post=None, comments=0)
+        deferred = data.num_initial_posts - count
+
+        if dry_run:
+            return {**model.summary(), "posts_planned": count, "comments_planned": count * data.num_comments_per_post,
+                    "posts_deferred": deferred}
+        if deferred:
+            plan_growth(data, progress.get("start", 0), count)
         return {
             "message": "Feed populated successfully",
-            "posts_created": len(posts),
-            "comments_created": len(posts) * data.num_comments_per_post,
+            "posts_created": count,
+            "comments_created": count * data.num_comments_per_post,
+            "posts_deferred": deferred,
             "topic_used": data.topic
         }
 
+    except (CircuitOpenError, HTTPException):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def feed_context(data: FeedPopulationRequest) -> dict:
+    """What every post of a populate run is generated from: the feed's prompt, its subject, personas and language."""
+    # 1. Fetch the feed and its subject
+    feed = get_feed(data.feed_id)
+    if not feed:
+        raise HTTPException(status_code=404, detail="Feed not found")
+
+    subject_id = feed["subject_id"]
+    global_prompt = feed.get("global_prompt", "")
+
+    # 2. Fetch the subject
+    subject = get_subject(subject_id)
+    if not subject:
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+    # 3. Fetch personas for this subject
+    personas = get_personas(subject_id)
+    if not personas:
+        raise HTTPException(status_code=404, detail="No personas found for this subject")
+
+    # Fallback: ensure all personas have a name
+    for p in personas:
+        if not p.get('name') or not p['name'].strip():
+            p['name'] = f"Persona_{p.get('id', '')}"
+
+    # Detect language from topic
+    def detect_language(text):
+        for c in text:
+            if '\u0590' <= c <= '\u05FF':
+                return 'hebrew'
+        return 'english'
+    language = detect_language(data.topic)
+    language_instruction = {
+        'hebrew': 'כתוב את כל התגובה, כולל שם הדמות, בעברית. כתוב בסגנון פוסט או תגובה ברשת חברתית, כולל אימוג׳ים אם מתאים לדמות.',
+        'english': 'Write your entire response, including the persona name, in English. Style it like a real social media post or comment, using emojis if it fits the character.'
+    }[language]
+    return {"global_prompt": global_prompt, "subject": subject, "personas": personas, "language_instruction": language_instruction}
+
+def generate_post(data: FeedPopulationRequest, context: dict, index: int, model, dry_run: bool = False):
+    """Generates and stores the post of post number `index` of a populate run."""
+    supabase = get_supabase()
+    global_prompt = context["global_prompt"]
+    subject = context["subject"]
+    personas = context["personas"]
+    language_instruction = context["language_instruction"]
+
+    # 4. Generate the post
+    post_persona = personas[index % len(personas)]
+    persona_name = post_persona.get('name', f"Persona_{post_persona.get('id','')}")
+    persona_background = post_persona.get('prompt', '')
+    post_prompt = (
+        f"GLOBAL FEED PROMPT: {global_prompt}\n"
+        f"You are {persona_name}, a historical or literary figure.\n"
+        f"Topic: {data.topic}\n"
+        f"Subject context: {subject['general_prompt']}\n"
+        f"Persona background: {persona_background}\n\n"
+        f"Write a believable, casual social media post (3-5 sentences) as if you are posting about your everyday life, events, or thoughts related to this topic. Do NOT just list keywords. Use first-person, make it engaging and authentic. If your character is quirky, use emojis and social media conventions. Do not use hashtags.\n"
+        f"{language_instruction}"
+    )
+    post_content = model.generate_content(post_prompt).text.strip()
+
+    # Create the post
+    post = {
+        "feed_id": data.feed_id,
+        "author_id": post_persona["id"],
+        "content": post_content,
+        "created_at": datetime.utcnow().isoformat()
+    }
+    if dry_run:
+        post["id"] = f"planned-post-{index}"
+    else:
+        # Create a temporary user for the persona if it doesn't exist
+        user_check = supabase.table("users").select("id").eq("id", post_persona["id"]).execute()
+        if not user_check.data:
+            temp_user = {
+                "id": post_persona["id"],
+                "username": post_persona["name"].lower().replace(" ", "_"),
+                "name": post_persona["name"],
+                "role": "student",
+                "password_hash": "$2b$10$ZHzvfUBiHM/Ldio6jlLdQuqLlR9egTi/HEOyb0Kttr/90Yj0df65W"  # Default hash
+            }
+            supabase.table("users").insert(temp_user).execute()
+
+        post_resp = supabase.table("posts").insert(post).execute()
+        if not post_resp.data:
+            raise HTTPException(status_code=500, detail="Failed to create post")
+        post = post_resp.data[0]
+        publish(data.feed_id, "posts", post_resp.data)
+    return post
+
+def populate_post(data: FeedPopulationRequest, context: dict, index: int, model, dry_run: bool = False,
+                  progress: dict | None = None):
+    """Generates and stores post number `index` of a populate run together with its comments; returns the post.
+
+    `progress` holds the stored post ("post") and how many of its comments are stored ("comments");
+    given those of an interrupted attempt, only the missing comments are generated.
+    """
+    supabase = get_supabase()
+    global_prompt = context["global_prompt"]
+    subject = context["subject"]
+    personas = context["personas"]
+    language_instruction = context["language_instruction"]
+    progress = {} if progress is None else progress
+    if progress.get("post"):
+        post = progress["post"]
+    else:
+        post = generate_post(data, context, index, model, dry_run)
+        if not dry_run:
+            progress.update(post=post, comments=0)
+
+    # 5. Generate its comments
+    comment_personas = [p for p in personas if p["id"] != post["author_id"]]
+    for i in range(progress.get("comments", 0), data.num_comments_per_post):
+        comment_persona = comment_personas[i % len(comment_personas)]
+        comment_name = comment_persona.get('name', f"Persona_{comment_persona.get('id','')}")
+        comment_background = comment_persona.get('prompt', '')
+        comment_prompt = (
+            f"GLOBAL FEED PROMPT: {global_prompt}\n"
+            f"You are {comment_name}, a historical or literary figure.\n"
+            f"Topic: {data.topic}\n"
+            f"Subject context: {subject['general_prompt']}\n"
+            f"Persona background: {comment_background}\n\n"
+            f"Respond to this post by {post['author_id']} (content: {post['content']}) as if you are commenting on social media. Write a believable, casual, first-person comment (1-2 sentences) that adds to the conversation. If your character is quirky, use emojis and social media conventions. Do not use hashtags.\n"
+            f"{language_instruction}"
+        )
+        comment_content = model.generate_content(comment_prompt).text.strip()
+        if dry_run:
+            continue
+
+        # Create the comment
+        comment = {
+            "post_id": post["id"],
+            "author_id": comment_persona["id"],
+            "content": comment_content,
+            "created_at": datetime.utcnow().isoformat()
+        }
+
+        comment_resp = supabase.table("comments").insert(comment).execute()
+        if not comment_resp.data:
+            raise HTTPException(status_code=500, detail="Failed to create comment")
+        publish(data.feed_id, "comments", comment_resp.data)
+        progress["comments"] = i + 1
+    return post
+
+# Lazy feeds: the rest of a lazy populate run is generated as readers approach it.
+# The plan and its counters live in the shared cache, so every worker of the host
+# grows the feed and no post is generated twice.
+
+def plan_growth(data: FeedPopulationRequest, start: int, generated: int):
+    cache = get_cache()
+    cache.set(f"feed-growth:{data.feed_id}", {"request": data.model_dump(mode="json"), "start": start}, ttl=GROWTH_TTL)
+    # posts of the run handed out to a generator, and posts stored
+    cache.set(f"feed-growth:{data.feed_id}:claimed", generated, ttl=GROWTH_TTL)
+    cache.set(f"feed-growth:{data.feed_id}:stored", generated, ttl=GROWTH_TTL)
+
+def pending_posts(feed_id: str) -> int:
+    """Posts of a lazy run that are planned but not stored yet."""
+    plan = get_cache().get(f"feed-growth:{feed_id}")
+    if not plan:
+        return 0
+    return max(0, plan["request"]["num_initial_posts"] - get_cache().get(f"feed-growth:{feed_id}:stored", 0))
+
+def grow_feed(feed_id: str, upto: int):
+    """Starts generating the planned posts that would fall within the first `upto` posts of the feed."""
+    plan = get_cache().get(f"feed-growth:{feed_id}")
+    if not plan or not get_breaker().available():
+        return
+    target = min(plan["request"]["num_initial_posts"], upto - plan["start"])
+    if target <= get_cache().get(f"feed-growth:{feed_id}:claimed", 0):
+        return
+    first = get_cache().advance(f"feed-growth:{feed_id}:claimed", target, ttl=GROWTH_TTL)
+    for index in range(first, target):
+        growth_pool().submit(grow_claimed_post, plan, index)
+
+def grow_post(plan: dict, index: int, progress: dict | None = None):
+    """Generates and stores post number `index` of a lazy run, then counts it as stored.
+
+    `progress` is as for `populate_post`.
+    """
+    data = FeedPopulationRequest(**plan["request"])
+    populate_post(data, feed_context(data), index, get_task_model("persona-post"), progress=progress)
+    count_grown(data.feed_id)
+
+def count_grown(feed_id: str):
+    get_cache().incr(f"feed-growth:{feed_id}:stored", ttl=GROWTH_TTL)
+    invalidate_feed_pages(feed_id)
+
+def grow_claimed_post(plan: dict, index: int):
+    progress = {}
+    try:
+        grow_post(plan, index, progress)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        # the post stays claimed and the deferred queue finishes it: once the circuit closes,
+        # or after a backoff when the error was a passing one
+        print(f"Growing feed {plan['request']['feed_id']} paused at post {index}: {e}")
+        defer("feed-growth", {"plan": plan, "index": index, "progress": progress},
+              key=f"feed-growth:{plan['request']['feed_id']}:{index}")
+
+def grow_deferred(payload: dict):
+    # `progress` is updated in place, so a retry of the entry skips what this attempt stored
+    grow_post(payload["plan"], payload["index"], payload["progress"])
+
+def give_up_growth(payload: dict, error: Exception):
+    # the feed ends up one post short rather than showing it as pending forever
+    count_grown(payload["plan"]["request"]["feed_id"])
+
+register_job("populate-feed", lambda payload, progress: fill_feed(FeedPopulationRequest(**payload), progress=progress))
+register("feed-growth", grow_deferred, give_up_growth)
+
+_growth_pool = None
+
+def growth_pool() -> ThreadPoolExecutor:
+    global _growth_pool
+    if _growth_pool is None:
+        _growth_pool = ThreadPoolExecutor(max_workers=get_settings().feed_growth_workers, thread_name_prefix="feed-growth")
+    return _growth_pool
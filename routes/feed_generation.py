@@ -1,26 +1,27 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query, Response
 from pydantic import BaseModel, Field
-from datetime import datetime
-import google.generativeai as genai
-from supabase import create_client
-import os
-from dotenv import load_dotenv
-import yaml
-from langchain.prompts import PromptTemplate
+from core.admission import get_admission
+from core.breaker import CircuitOpenError, get_breaker
+from core.cache import get_cache
+from core.clients import get_supabase
+from core.feed_store import clone_feed, draft_authors, find_draft, mark_draft_used, materialize_feed
+from core.idempotency import defer_idempotent, get_job, register_job, run_idempotent
+from core.lookups import get_personas, get_subject, invalidate_personas
+from core.planning import PlanRecorder
+from core.routing import get_task_model
+from core.singleflight import SingleFlight, normalize
+import asyncio
 import random
 import uuid
 import json
 from typing import Optional, List, Dict
 import time
-load_dotenv()
 
 # Setup
-supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"))
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel("models/gemini-2.0-flash")
-
 router = APIRouter()
 
+_persona_flights = SingleFlight("generate-personas")
+
 class PersonaIn(BaseModel):
     name: str
     prompt: str
@@ -51,110 +52,94 @@ class GeneratePromptRequest(BaseModel):
     topic: str
     personas: list[str] = Field(..., min_items=1)
 
+class CloneFeedRequest(BaseModel):
+    feed_id: str
+    title: str | None = None
+    global_prompt: str | None = None
+
 class SubjectIn(BaseModel):
     name: str
     description: str
     syllabus: str
 
-@router.post("/generate-feed")
-async def generate_feed(data: GenerateFeedRequest):
-    # 1. Validate class, subject
-    class_resp = supabase.table("classes").select("id").eq("id", data.class_id).single().execute()
-    if not class_resp.data:
-        raise HTTPException(status_code=404, detail="Class not found")
-    subject_resp = supabase.table("subjects").select("id, syllabus, name").eq("id", data.subject_id).single().execute()
-    if not subject_resp.data:
-        raise HTTPException(status_code=404, detail="Subject not found")
-    subject = subject_resp.data
-    topic = data.topic
-    def detect_language(text):
-        for c in text:
-            if '\u0590' <= c <= '\u05FF':
-                return 'hebrew'
-        return 'english'
-    language = detect_language(topic)
-    language_instruction = {
-        'hebrew': 'כתוב את התגובה בעברית בלבד, בסגנון פוסט או תגובה ברשת חברתית, ללא התחלה בשם הדמות. כתוב רק את התוכן כאילו אתה הדמות, אל תציין את שמך בתחילת הפוסט או התגובה.',
-        'english': 'Write your response in English only, styled like a real social media post or comment, but do NOT start with your name. Write only the content as if you are the persona, do not mention your name at the beginning.'
-    }[language]
-    # 2. Save personas (selected + manual)
-    all_personas = data.selected_personas + data.manual_personas
-    persona_ids = []
-    for persona in all_personas:
-        if hasattr(persona, 'dict'):
-            persona_dict = persona.dict()
-        else:
-            persona_dict = persona
-        existing = supabase.table("personas").select("id").eq("subject_id", data.subject_id).eq("name", persona_dict['name']).maybe_single().execute()
-        if existing and existing.data:
-            persona_id = existing.data["id"]
+def detect_language(text):
+    for c in text:
+        if '\u0590' <= c <= '\u05FF':
+            return 'hebrew'
+    return 'english'
+
+def save_personas(subject_id, personas):
+    """Stores any of `personas` (dicts with name/prompt) the subject doesn't have yet and sets their 'id'."""
+    supabase = get_supabase()
+    # "Theodor Herzl" and "theodor  herzl" are the same persona
+    existing_ids = {normalize(p["name"]): p["id"] for p in get_personas(subject_id)}
+    for persona in personas:
+        if normalize(persona['name']) in existing_ids:
+            persona_id = existing_ids[normalize(persona['name'])]
         else:
             insert = {
-                "subject_id": data.subject_id,
-                "name": persona_dict['name'],
-                "prompt": persona_dict['prompt']
+                "subject_id": subject_id,
+                "name": persona['name'],
+                "prompt": persona['prompt']
             }
             resp = supabase.table("personas").insert(insert).execute()
             if not resp.data:
-                raise HTTPException(status_code=500, detail=f"Failed to save persona {persona_dict['name']}")
+                raise HTTPException(status_code=500, detail=f"Failed to save persona {persona['name']}")
             persona_id = resp.data[0]["id"]
-        if hasattr(persona, 'dict'):
-            persona.id = persona_id
-        else:
-            persona['id'] = persona_id
-        persona_ids.append(persona_id)
-        
-        # Create user for persona if it doesn't exist
+            existing_ids[normalize(persona['name'])] = persona_id
+            invalidate_personas(subject_id)
+        persona['id'] = persona_id
+    return personas
+
+def ensure_persona_users(personas):
+    """Posts and comments are authored by users, so every persona needs a matching user row."""
+    supabase = get_supabase()
+    for persona in personas:
+        persona_id = persona['id']
         user_check = supabase.table("users").select("id").eq("id", persona_id).maybe_single().execute()
         if not user_check or not user_check.data:
             # Create a unique username by adding a timestamp
             timestamp = int(time.time())
-            base_username = persona_dict['name'].lower().replace(" ", "_")
+            base_username = persona['name'].lower().replace(" ", "_")
             username = f"{base_username}_{timestamp}"
             
             temp_user = {
                 "id": persona_id,
                 "username": username,
-                "name": persona_dict['name'],
+                "name": persona['name'],
                 "role": "student",
                 "password_hash": "$2b$10$ZHzvfUBiHM/Ldio6jlLdQuqLlR9egTi/HEOyb0Kttr/90Yj0df65W"
             }
             try:
                 resp = supabase.table("users").insert(temp_user).execute()
                 if not resp.data:
-                    raise HTTPException(status_code=500, detail=f"Failed to create user for persona {persona_dict['name']}")
+                    raise HTTPException(status_code=500, detail=f"Failed to create user for persona {persona['name']}")
             except Exception as e:
                 print(f"Error creating user: {e}")
                 # If user creation fails, we can't proceed
-                raise HTTPException(status_code=500, detail=f"Failed to create user for persona {persona_dict['name']}")
+                raise HTTPException(status_code=500, detail=f"Failed to create user for persona {persona['name']}")
 
-    # 3. Create the feed
-    feed = {
-        "subject_id": data.subject_id,
-        "title": topic,
-        "global_prompt": data.global_prompt
-    }
-    feed_resp = supabase.table("feeds").insert(feed).execute()
-    if not feed_resp.data:
-        raise HTTPException(status_code=500, detail="Failed to create feed")
-    feed_id = feed_resp.data[0]["id"]
-    
-    # 4. Populate the feed with posts/comments using all personas for the subject and the selected topic
-    all_personas = data.selected_personas + data.manual_personas
-    if not all_personas or len(all_personas) < 3:
-        raise HTTPException(status_code=400, detail="Not enough personas to populate feed")
-    num_personas = min(len(all_personas), random.randint(6, 12))
-    selected_personas = random.sample(all_personas, num_personas)
+def generate_feed_content(model, personas, topic, global_prompt):
+    """Writes the posts and comments of a feed without storing anything.
+
+    `personas` are dicts with id/name/prompt. Returns posts in the shape
+    `core.feed_store.materialize_feed` takes.
+    """
+    # langchain is slow to import; only pay for it once a feed is actually generated
+    from langchain.prompts import PromptTemplate
+    language = detect_language(topic)
+    language_instruction = {
+        'hebrew': 'כתוב את התגובה בעברית בלבד, בסגנון פוסט או תגובה ברשת חברתית, ללא התחלה בשם הדמות. כתוב רק את התוכן כאילו אתה הדמות, אל תציין את שמך בתחילת הפוסט או התגובה.',
+        'english': 'Write your response in English only, styled like a real social media post or comment, but do NOT start with your name. Write only the content as if you are the persona, do not mention your name at the beginning.'
+    }[language]
     posts = []
-    num_posts = min(len(selected_personas), 5)
+    num_posts = min(len(personas), 5)
     for i in range(num_posts):
-        post_persona = selected_personas[i % len(selected_personas)]
-        if hasattr(post_persona, 'dict'):
-            post_persona = post_persona.dict()
+        post_persona = personas[i % len(personas)]
         persona_name = post_persona.get('name', f"Persona_{post_persona.get('id','')}")
         persona_background = post_persona.get('prompt', '')
         post_prompt = (
-            f"GLOBAL FEED PROMPT: {data.global_prompt}\n"
+            f"GLOBAL FEED PROMPT: {global_prompt}\n"
             f"You are {persona_name}, a real historical figure.\n"
             f"Topic: {topic}\n"
             f"Persona background: {persona_background}\n\n"
@@ -163,36 +148,22 @@ async def generate_feed(data: GenerateFeedRequest):
         )
         post_prompt_template = PromptTemplate(input_variables=["global_prompt", "persona_name", "topic", "persona_background", "language_instruction"], template=post_prompt)
         formatted_post_prompt = post_prompt_template.format(
-            global_prompt=data.global_prompt,
+            global_prompt=global_prompt,
             persona_name=persona_name,
             topic=topic,
             persona_background=persona_background,
             language_instruction=language_instruction
         )
         post_content = model.generate_content(formatted_post_prompt).text.strip()
-        post = {
-            "feed_id": feed_id,
-            "author_id": post_persona["id"],
-            "content": post_content,
-            "created_at": datetime.utcnow().isoformat()
-        }
-        post_resp = supabase.table("posts").insert(post).execute()
-        if not post_resp.data:
-            raise HTTPException(status_code=500, detail="Failed to create post")
-        posts.append(post_resp.data[0])
+        posts.append({"author_id": post_persona["id"], "content": post_content, "comments": []})
     for post in posts:
-        comment_personas = []
-        for p in selected_personas:
-            if hasattr(p, 'dict'):
-                p = p.dict()
-            if p["id"] != post["author_id"]:
-                comment_personas.append(p)
+        comment_personas = [p for p in personas if p["id"] != post["author_id"]]
         for i in range(min(2, len(comment_personas))):
             comment_persona = comment_personas[i % len(comment_personas)]
             comment_name = comment_persona.get('name', f"Persona_{comment_persona.get('id','')}")
             comment_background = comment_persona.get('prompt', '')
             comment_prompt = (
-                f"GLOBAL FEED PROMPT: {data.global_prompt}\n"
+                f"GLOBAL FEED PROMPT: {global_prompt}\n"
                 f"You are {comment_name}, a real historical figure.\n"
                 f"Topic: {topic}\n"
                 f"Persona background: {comment_background}\n\n"
@@ -201,7 +172,7 @@ async def generate_feed(data: GenerateFeedRequest):
             )
             comment_prompt_template = PromptTemplate(input_variables=["global_prompt", "comment_name", "topic", "comment_background", "author_id", "post_content", "language_instruction"], template=comment_prompt)
             formatted_comment_prompt = comment_prompt_template.format(
-                global_prompt=data.global_prompt,
+                global_prompt=global_prompt,
                 comment_name=comment_name,
                 topic=topic,
                 comment_background=comment_background,
@@ -210,136 +181,217 @@ async def generate_feed(data: GenerateFeedRequest):
                 language_instruction=language_instruction
             )
             comment_content = model.generate_content(formatted_comment_prompt).text.strip()
-            comment = {
-                "post_id": post["id"],
-                "author_id": comment_persona["id"],
-                "content": comment_content,
-                "created_at": datetime.utcnow().isoformat()
-            }
-            supabase.table("comments").insert(comment).execute()
+            post["comments"].append({"author_id": comment_persona["id"], "content": comment_content})
+    return posts
+
+@router.post("/generate-feed")
+async def generate_feed(data: GenerateFeedRequest, response: Response, idempotency_key: str | None = Header(None),
+                        dry_run: bool = Query(False)):
+    if dry_run:
+        # only reads: estimate the cost instead of paying it
+        plan = await asyncio.to_thread(create_feed, data, True)
+        plan["estimated_queue_seconds"] = get_admission().expected_wait(f"class:{data.class_id}")
+        return plan
+    payload = data.model_dump(mode="json")
+    # with the LLM down, accept the request as a job that runs once it is back
+    if not get_breaker().available():
+        return defer_idempotent("generate-feed", idempotency_key, payload, response)
+    # a retried request joins the run already in progress, or gets its result once it finished;
+    # only a request that runs the job waits for an admission slot
+    try:
+        return await run_idempotent("generate-feed", idempotency_key, payload, lambda progress: create_feed(data), response,
+                                    admit=lambda: get_admission().admit(f"class:{data.class_id}"))
+    except CircuitOpenError:
+        return defer_idempotent("generate-feed", idempotency_key, payload, response)
+
+@router.get("/generation-jobs/{job_id}")
+def get_generation_job(job_id: str):
+    """Status of a /generate-feed or /populate-feed request that was accepted with 202; "result" once it is "done"."""
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def create_feed(data: GenerateFeedRequest, dry_run: bool = False):
+    """Creates the feed; with `dry_run`, returns the generation plan without calling the LLM or writing anything."""
+    supabase = get_supabase()
+    # 1. Validate class, subject
+    class_resp = supabase.table("classes").select("id").eq("id", data.class_id).single().execute()
+    if not class_resp.data:
+        raise HTTPException(status_code=404, detail="Class not found")
+    subject = get_subject(data.subject_id)
+    if not subject:
+        raise HTTPException(status_code=404, detail="Subject not found")
+    topic = data.topic
+    all_personas = data.selected_personas + data.manual_personas
+    if not all_personas or len(all_personas) < 3:
+        raise HTTPException(status_code=400, detail="Not enough personas to populate feed")
+
+    # 2. Save personas (selected + manual)
+    if dry_run:
+        # personas that would be created get a stand-in id
+        existing_ids = {normalize(p["name"]): p["id"] for p in get_personas(data.subject_id)}
+        persona_dicts = [{"name": p.name, "prompt": p.prompt, "id": existing_ids.get(normalize(p.name), f"new:{p.name}")}
+                         for p in all_personas]
+    else:
+        persona_dicts = save_personas(data.subject_id, [{"name": p.name, "prompt": p.prompt} for p in all_personas])
+        for persona, persona_dict in zip(all_personas, persona_dicts):
+            persona.id = persona_dict['id']
+        ensure_persona_users(persona_dicts)
+
+    # 3. Serve the pre-generated draft for this topic if the teacher kept all of its personas and its prompt;
+    #    a draft written for another prompt (e.g. another age group) would not be what they asked for
+    draft = find_draft(data.subject_id, topic)
+    if (draft and draft_authors(draft) <= {p['id'] for p in persona_dicts}
+            and normalize(draft.get("global_prompt") or "") == normalize(data.global_prompt)):
+        if dry_run:
+            return {**PlanRecorder("persona-post").summary(), "source": "draft"}
+        created = materialize_feed(data.subject_id, topic, data.global_prompt, draft["posts"])
+        mark_draft_used(draft)
+        authors = draft_authors(draft)
+        return {
+            "feed_id": created["feed_id"],
+            "posts_created": created["posts_created"],
+            "personas_used": [p['name'] for p in persona_dicts if p['id'] in authors],
+            "topic_used": topic,
+            "message": "Feed created from a pre-generated draft."
+        }
+
+    # 4. Generate posts/comments using the selected personas and topic, then store the feed in one go
+    num_personas = min(len(persona_dicts), random.randint(6, 12))
+    selected_personas = random.sample(persona_dicts, num_personas)
+    if dry_run:
+        recorder = PlanRecorder("persona-post")
+        generate_feed_content(recorder, selected_personas, topic, data.global_prompt)
+        return {**recorder.summary(), "source": "generate", "personas_used": [p['name'] for p in selected_personas]}
+    posts = generate_feed_content(get_task_model("persona-post"), selected_personas, topic, data.global_prompt)
+    created = materialize_feed(data.subject_id, topic, data.global_prompt, posts)
     return {
-        "feed_id": feed_id,
-        "posts_created": len(posts),
-        "personas_used": [p.name if hasattr(p, 'name') else p['name'] for p in selected_personas],
+        "feed_id": created["feed_id"],
+        "posts_created": created["posts_created"],
+        "personas_used": [p['name'] for p in selected_personas],
         "topic_used": topic,
         "message": "Feed created and populated successfully."
     }
 
+register_job("generate-feed", lambda payload, progress: create_feed(GenerateFeedRequest(**payload)))
+
+@router.post("/clone-feed")
+def clone_feed_for_class(data: CloneFeedRequest):
+    """Copy an existing feed (posts and comment threads) for another class without generating anything.
+
+    Feeds hold no class, so as with /generate-feed the caller links the new feed_id to its class.
+    """
+    created = clone_feed(data.feed_id, data.title, data.global_prompt)
+    if created is None:
+        raise HTTPException(status_code=404, detail="Feed not found")
+    return {
+        "feed_id": created["feed_id"],
+        "source_feed_id": data.feed_id,
+        "posts_created": created["posts_created"],
+        "comments_created": created["comments_created"],
+        "message": "Feed cloned successfully."
+    }
+
+PERSONA_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"name": {"type": "string"}, "prompt": {"type": "string"}},
+        "required": ["name", "prompt"],
+    },
+}
+MAX_PERSONA_ROUNDS = 3
+
+def request_personas(model, topic, count):
+    """Asks the model for `count` personas relevant to `topic`; returns dicts with name/prompt.
+
+    Answers are constrained to PERSONA_SCHEMA. Valid personas are kept as they
+    arrive and a follow-up round only asks for the shortfall, naming the ones
+    already chosen so they aren't repeated.
+    """
+    persona_topic = topic
+    language = detect_language(persona_topic)
+    personas = []
+    seen = set()
+    for attempt in range(MAX_PERSONA_ROUNDS):
+        missing = count - len(personas)
+        if missing <= 0:
+            break
+        persona_language_instruction = {
+            'hebrew': f"ציין {missing} דמויות היסטוריות אמיתיות ורלוונטיות שהיו קשורות ישירות לנושא '{persona_topic}'. עבור כל דמות, כתוב שם מלא (name) ומשפט רקע קצר על פועלה או עמדתה בנושא (prompt). אל תמציא דמויות. אל תוסיף דמויות שאינן קשורות ישירות לנושא. חשוב: כל הדמויות חייבות להיות אמיתיות ולא מומצאות. ודא שכל שם הוא של דמות היסטורית מוכרת, או של אדם אמיתי בלבד. אל תכלול דמויות בדיוניות, דמויות מספרות, או שמות שאינם קיימים במציאות. אל תחזור על דמויות שהוזכרו בעבר, ונסה להעדיף דמויות פחות מוכרות או פחות מוזכרות, כל עוד הן רלוונטיות לנושא.",
+            'english': f"List {missing} real, relevant historical figures directly related to the topic '{persona_topic}'. For each, provide the full name (name) and a short background sentence about their role or stance on the topic (prompt). Do not invent personas. Do not include figures not directly relevant to the topic. Important: All characters must be real and not invented. Ensure every name is a well-known historical figure or a real person only. Do not include fictional characters, book/movie/game characters, or made-up names. Do not repeat characters you have already mentioned in previous generations. Prioritize lesser-known or less frequently mentioned real historical figures relevant to the topic. Avoid always listing the most famous figures first."
+        }[language]
+        if personas:
+            taken = ", ".join(p['name'] for p in personas)
+            persona_language_instruction += {
+                'hebrew': f" אל תכלול את הדמויות שכבר נבחרו: {taken}.",
+                'english': f" Do not include these figures, who were already chosen: {taken}."
+            }[language]
+        print(f"Generating personas with Gemini API... (attempt {attempt+1}, {missing} needed)")
+        try:
+            result = model.generate_content(
+                persona_language_instruction,
+                generation_config={"response_mime_type": "application/json", "response_schema": PERSONA_SCHEMA},
+            ).text
+            items = json.loads(result)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            print(f"Error generating personas: {e}")
+            continue
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            name = str(item.get('name') or '').strip()
+            prompt = str(item.get('prompt') or '').strip()
+            if name and prompt and normalize(name) not in seen:
+                seen.add(normalize(name))
+                personas.append({"name": name, "prompt": prompt})
+    if len(personas) < count:
+        print(f"Only got {len(personas)} of {count} personas.")
+    return personas[:count]
+
 @router.post("/generate-personas")
 async def generate_personas(data: GeneratePersonasRequest):
+    # teachers asking for the same subject and topic at once share one generation (and one set of inserts)
+    key = f"{data.subject_id}:{data.count}:{normalize(data.topic)}"
+    async with get_admission().admit(f"subject:{data.subject_id}"):
+        return await _persona_flights.do(key, lambda: asyncio.to_thread(list_personas, data), share_ttl=60)
+
+def list_personas(data: GeneratePersonasRequest):
     try:
-        subject_resp = supabase.table("subjects").select("name").eq("id", data.subject_id).single().execute()
-        subject_name = subject_resp.data["name"] if subject_resp.data else "the subject"
+        subject = get_subject(data.subject_id)
+        subject_name = subject["name"] if subject else "the subject"
     except Exception as e:
         print(f"Warning: Could not fetch subject: {e}")
         subject_name = "the subject"
     persona_topic = data.topic
     print(f"Persona topic: {persona_topic}")
-    def detect_language(text):
-        for c in text:
-            if '\u0590' <= c <= '\u05FF':
-                return 'hebrew'
-        return 'english'
-    language = detect_language(persona_topic)
-    persona_language_instruction = {
-        'hebrew': f"ציין {data.count} דמויות היסטוריות אמיתיות ורלוונטיות שהיו קשורות ישירות לנושא '{persona_topic}'. עבור כל דמות, כתוב שם מלא ומשפט רקע קצר על פועלה או עמדתה בנושא. אל תמציא דמויות. אל תוסיף דמויות שאינן קשורות ישירות לנושא. החזר אך ורק רשימת YAML של מילונים, כל אחד עם המפתחות 'name' ו-'prompt', ללא מספור, עיצוב markdown, קוד בלוק (ללא ```yaml או ```), כותרות, או מפתחות נוספים. חשוב: כל הדמויות חייבות להיות אמיתיות ולא מומצאות. ודא שכל שם הוא של דמות היסטורית מוכרת, או של אדם אמיתי בלבד. אל תכלול דמויות בדיוניות, דמויות מספרות, או שמות שאינם קיימים במציאות. אל תחזור על דמויות שהוזכרו בעבר, ונסה להעדיף דמויות פחות מוכרות או פחות מוזכרות, כל עוד הן רלוונטיות לנושא.",
-        'english': f"List {data.count} real, relevant historical figures directly related to the topic '{persona_topic}'. For each, provide the full name and a short background sentence about their role or stance on the topic. Do not invent personas. Do not include figures not directly relevant to the topic. Output ONLY a YAML list of dictionaries, each with 'name' and 'prompt' keys, and nothing else. Do NOT include numbering, markdown styling, code blocks (no ```yaml or ```), headers, or extra keys. Important: All characters must be real and not invented. Ensure every name is a well-known historical figure or a real person only. Do not include fictional characters, book/movie/game characters, or made-up names. Do not repeat characters you have already mentioned in previous generations. Prioritize lesser-known or less frequently mentioned real historical figures relevant to the topic. Avoid always listing the most famous figures first."
-    }[language]
-    persona_prompt_template = PromptTemplate(
-        input_variables=["count", "persona_topic"],
-        template=persona_language_instruction
+
+    # a pre-generated draft already settled on personas for this topic; offer its authors first
+    draft = find_draft(data.subject_id, persona_topic)
+    if draft and len(draft["personas"]) >= data.count:
+        authors = draft_authors(draft)
+        ranked = sorted(draft["personas"], key=lambda p: p['id'] not in authors)
+        return {"personas": [PersonaIn(name=p['name'], prompt=p['prompt'], id=p['id']).model_dump() for p in ranked[:data.count]]}
+
+    # identical persona questions from any worker within a few minutes reuse the same answer
+    generation_key = f"generated-personas:{data.subject_id}:{data.count}:{persona_topic}"
+    personas = get_cache().get_or_compute(
+        generation_key, lambda: request_personas(get_task_model("persona-list"), persona_topic, data.count), ttl=600
     )
-    max_retries = 3
-    personas = []
-    for attempt in range(max_retries):
-        persona_prompt = persona_prompt_template.format(count=data.count, persona_topic=persona_topic)
-        print(f"Generating personas with Gemini API... (attempt {attempt+1})")
-        result = model.generate_content(persona_prompt).text.strip()
-        if result.startswith('```yaml'):
-            result = result[len('```yaml'):].strip()
-        if result.startswith('```'):
-            result = result[len('```'):].strip()
-        if result.endswith('```'):
-            result = result[:-3].strip()
-        lines = result.split('\n')
-        start_idx = 0
-        for i, line in enumerate(lines):
-            if line.strip().startswith('-') or line.strip().startswith('{'):
-                start_idx = i
-                break
-        filtered_result = '\n'.join(lines[start_idx:])
-        print(f"Filtered result for YAML parsing:\n{filtered_result}")
-        try:
-            yaml_data = yaml.safe_load(filtered_result)
-            if isinstance(yaml_data, dict):
-                for key in ["personas", "דמויות", "characters", "list"]:
-                    if key in yaml_data and isinstance(yaml_data[key], list):
-                        yaml_data = yaml_data[key]
-                        break
-            if isinstance(yaml_data, list):
-                for item in yaml_data:
-                    if isinstance(item, dict) and 'name' in item and 'prompt' in item:
-                        personas.append({"name": item['name'].strip(), "prompt": item['prompt'].strip()})
-            else:
-                for line in filtered_result.split('\n'):
-                    if not line.strip():
-                        continue
-                    if ':' in line:
-                        name, prompt = line.split(':', 1)
-                        personas.append({"name": name.strip(), "prompt": prompt.strip()})
-                    elif '-' in line:
-                        name, prompt = line.split('-', 1)
-                        personas.append({"name": name.strip(), "prompt": prompt.strip()})
-                    else:
-                        personas.append({"name": line.strip(), "prompt": ""})
-        except Exception as e:
-            print(f"Error parsing YAML: {e}")
-            for line in filtered_result.split('\n'):
-                if not line.strip():
-                    continue
-                if ':' in line:
-                    name, prompt = line.split(':', 1)
-                    personas.append({"name": name.strip(), "prompt": prompt.strip()})
-                elif '-' in line:
-                    name, prompt = line.split('-', 1)
-                    personas.append({"name": name.strip(), "prompt": prompt.strip()})
-                else:
-                    personas.append({"name": line.strip(), "prompt": ""})
-        personas = [p for p in personas if p['name'] and p['prompt']]
-        if len(personas) >= data.count:
-            break
-        else:
-            print(f"Retrying persona generation, only got {len(personas)} valid personas.")
-            personas = []
+    if not personas:
+        # don't let a failed generation stick for everyone else
+        get_cache().delete(generation_key)
     print("Personas generated successfully.")
-    saved_personas = []
-    for persona in personas:
-        existing = supabase.table("personas").select("id").eq("subject_id", data.subject_id).eq("name", persona['name']).maybe_single().execute()
-        if existing and existing.data:
-            persona_id = existing.data["id"]
-        else:
-            insert = {
-                "subject_id": data.subject_id,
-                "name": persona['name'],
-                "prompt": persona['prompt']
-            }
-            resp = supabase.table("personas").insert(insert).execute()
-            if not resp.data:
-                raise HTTPException(status_code=500, detail=f"Failed to save persona {persona['name']}")
-            persona_id = resp.data[0]["id"]
-        persona['id'] = persona_id
-        saved_personas.append(persona)
-    persona_objects = [PersonaIn(name=p['name'], prompt=p['prompt'], id=p['id']) for p in saved_personas]
+    saved_personas = save_personas(data.subject_id, personas)
+    persona_objects = [PersonaIn(name=p['name'], prompt=p['prompt'], id=p['id']).model_dump() for p in saved_personas]
     return {"personas": persona_objects}
 
 @router.post("/generate-prompt")
 def generate_prompt(data: GeneratePromptRequest):
     topic_summary = data.topic
-    def detect_language(text):
-        for c in text:
-            if '\u0590' <= c <= '\u05FF':
-                return 'hebrew'
-        return 'english'
     language = detect_language(topic_summary)
     language_display = {
         'hebrew': 'Hebrew',
@@ -359,6 +411,7 @@ def generate_prompt(data: GeneratePromptRequest):
 @router.post("/subjects")
 async def create_subject(subject: SubjectIn):
     """Create a new subject."""
+    supabase = get_supabase()
     try:
         # Check if subject with same name exists
         existing = supabase.table("subjects").select("id").eq("name", subject.name).maybe_single().execute()
@@ -0,0 +1,164 @@
+from fastapi import APIRouter, HTTPException, Request
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from datetime import datetime
+import asyncio
+import json
+import os
+import uuid
+from core.cache import get_cache
+from core.clients import get_supabase
+from core.lookups import invalidate_subject
+from core.settings import get_settings
+
+router = APIRouter()
+
+ALLOWED_EXTENSIONS = {"pdf", "docx", "txt"}
+# job status is kept for a day after the upload
+JOB_TTL = 24 * 3600
+COPY_CHUNK = 1024 * 1024
+# room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+UPLOAD_SCHEMA = {
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}},
+    }}},
+}
+
+class UploadTooLarge(MultiPartException):
+    pass
+
+_job_slots = None
+_running = set()
+
+def job_slots() -> asyncio.Semaphore:
+    # extraction and generation hold a whole document's text; only a few run at once per worker
+    global _job_slots
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(get_settings().syllabus_workers)
+    return _job_slots
+
+def set_job(job_id, **fields):
+    job = get_cache().get(f"syllabus-job:{job_id}") or {}
+    job.update(fields, updated_at=datetime.utcnow().isoformat())
+    get_cache().set(f"syllabus-job:{job_id}", job, ttl=JOB_TTL)
+    return job
+
+@router.post("/subjects/{subject_id}/syllabus", status_code=202, openapi_extra={"requestBody": UPLOAD_SCHEMA})
+async def upload_syllabus(subject_id: str, request: Request):
+    """Accepts a PDF/DOCX/TXT syllabus (multipart field "file") and builds the subject's syllabus from it in the background.
+
+    Returns a job id; poll GET /syllabus-jobs/{job_id} until its status is "done" or "failed".
+    """
+    settings = get_settings()
+    max_bytes = settings.max_upload_mb * 1024 * 1024
+    too_large = HTTPException(status_code=413, detail=f"File is larger than {settings.max_upload_mb} MB")
+    if int(request.headers.get("content-length") or 0) > max_bytes + MULTIPART_OVERHEAD:
+        raise too_large
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    if not await asyncio.to_thread(subject_exists, subject_id):
+        raise HTTPException(status_code=404, detail="Subject not found")
+
+    # parsed here instead of by a File() parameter: a body sent without Content-Length (chunked)
+    # is cut off once it passes the limit, rather than spooled to disk in full first
+    try:
+        form = await MultiPartParser(request.headers, limited(request.stream(), max_bytes + MULTIPART_OVERHEAD)).parse()
+    except UploadTooLarge:
+        raise too_large
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    try:
+        file = form.get("file")
+        if not isinstance(file, UploadFile):
+            raise HTTPException(status_code=400, detail='Missing the "file" field')
+        extension = (file.filename or "").lower().rsplit(".", 1)[-1]
+        if extension not in ALLOWED_EXTENSIONS:
+            raise HTTPException(status_code=415, detail=f"Unsupported file type, expected one of: {', '.join(sorted(ALLOWED_EXTENSIONS))}")
+
+        # the parser spooled the file; move it over chunk by chunk
+        job_id = str(uuid.uuid4())
+        os.makedirs(settings.upload_dir, exist_ok=True)
+        path = os.path.join(settings.upload_dir, f"{job_id}.{extension}")
+        size = await asyncio.to_thread(save_upload, file.file, path, max_bytes)
+        if size is None:
+            raise too_large
+    finally:
+        await form.close()
+
+    job = set_job(job_id, id=job_id, subject_id=subject_id, filename=file.filename, size=size, status="queued")
+    task = asyncio.create_task(run_job(job_id, subject_id, path))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return job
+
+@router.get("/syllabus-jobs/{job_id}")
+def get_syllabus_job(job_id: str):
+    job = get_cache().get(f"syllabus-job:{job_id}")
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+async def limited(stream, max_bytes):
+    """Passes `stream` through, raising UploadTooLarge as soon as more than `max_bytes` came in."""
+    size = 0
+    async for chunk in stream:
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(f"Request body is larger than {max_bytes} bytes")
+        yield chunk
+
+def subject_exists(subject_id):
+    resp = get_supabase().table("subjects").select("id").eq("id", subject_id).maybe_single().execute()
+    return bool(resp and resp.data)
+
+def save_upload(source, path, max_bytes):
+    """Copies `source` to `path` in chunks; returns the size, or None (and no file) if it exceeds `max_bytes`."""
+    size = 0
+    with open(path, "wb") as out:
+        while chunk := source.read(COPY_CHUNK):
+            size += len(chunk)
+            if size > max_bytes:
+                break
+            out.write(chunk)
+    if size > max_bytes:
+        os.remove(path)
+        return None
+    return size
+
+async def run_job(job_id, subject_id, path):
+    try:
+        async with job_slots():
+            await asyncio.to_thread(build_syllabus, job_id, subject_id, path)
+    except Exception as e:
+        print(f"Syllabus job {job_id} failed: {e}")
+        set_job(job_id, status="failed", error=str(e))
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def build_syllabus(job_id, subject_id, path):
+    # PyPDF2, python-docx and the Gemini SDK are only needed here
+    from file_to_syllabus import extract_text_from_file, get_syllabus_json_from_gemini
+
+    # 1. Extract the text
+    set_job(job_id, status="extracting")
+    text = extract_text_from_file(path)
+    if not text.strip():
+        raise ValueError("No text could be extracted from the file")
+
+    # 2. Turn it into a syllabus
+    set_job(job_id, status="generating", text_length=len(text))
+    syllabus = get_syllabus_json_from_gemini(text)
+
+    # 3. Store it on the subject
+    supabase = get_supabase()
+    resp = supabase.table("subjects").update({"syllabus": json.dumps(syllabus, ensure_ascii=False)}).eq("id", subject_id).execute()
+    if not resp.data:
+        raise ValueError("Failed to update subject")
+    invalidate_subject(subject_id)
+    chapters = syllabus.get("syllabus", syllabus).get("subject_curriculum", [])
+    set_job(job_id, status="done", topics=sum(len(s.get("chapters_or_topics", [])) for s in chapters))
@@ -1,40 +1,36 @@
-import requests
 import json
 from dotenv import load_dotenv
 import os
 
+from classsquare_client import ClassSquareClient, ClassSquareError
+
 load_dotenv()
 
 # Test configuration
 API_URL = "http://localhost:8000"  # Default FastAPI URL
 TEST_FEED_ID = "your_feed_id_here"  # Replace with an actual feed ID from your database
+TEST_TOPIC = "your_topic_here"  # Replace with a topic from the feed's syllabus
 
 def test_populate_feed():
-    # Test data
-    data = {
-        "feed_id": TEST_FEED_ID,
-        "num_initial_posts": 2,  # Using smaller numbers for testing
-        "num_comments_per_post": 1
-    }
-    
     try:
-        # Make the request
-        response = requests.post(f"{API_URL}/populate-feed", json=data)
-        
+        with ClassSquareClient(API_URL) as api:
+            # Make the request, using smaller numbers for testing
+            result = api.populate_feed(TEST_FEED_ID, TEST_TOPIC, num_initial_posts=2, num_comments_per_post=1)
+
         # Print response details
-        print(f"Status Code: {response.status_code}")
         print("Response:")
-        print(json.dumps(response.json(), indent=2))
-        
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+
         # Basic validation
-        if response.status_code == 200:
-            result = response.json()
-            print("\nTest Results:")
-            print(f"✓ Posts created: {result['posts_created']}")
-            print(f"✓ Comments created: {result['comments_created']}")
-        else:
-            print(f"❌ Error: {response.json().get('detail', 'Unknown error')}")
-            
+        if "job_id" in result:
+            print(f"\nThe LLM is unavailable; the request was queued as job {result['job_id']}")
+            return
+        print("\nTest Results:")
+        print(f"✓ Posts created: {result['posts_created']}")
+        print(f"✓ Comments created: {result['comments_created']}")
+
+    except ClassSquareError as e:
+        print(f"❌ Error: {e.detail}")
     except Exception as e:
         print(f"❌ Test failed: {str(e)}")
 
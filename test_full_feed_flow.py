@@ -1,7 +1,8 @@
-import requests
 import json
 import time
 
+from classsquare_client import ClassSquareClient
+
 API_URL = "http://localhost:8000"
 
 # Use existing IDs from your database
@@ -11,33 +12,20 @@ SUBJECT_ID = "d7f5d600-8a41-4d0a-879f-a087f77a21f5"
 # Choose a specific topic from the syllabus
 TOPIC = "הקונגרס הציוני בבזל"
 
+api = ClassSquareClient(API_URL)
+
 def test_generate_personas():
     print("Testing /generate-personas ...")
-    resp = requests.post(
-        f"{API_URL}/generate-personas",
-        json={"subject_id": SUBJECT_ID, "count": 6, "topic": TOPIC}
-    )
-    print("Status:", resp.status_code)
-    print("Response:", json.dumps(resp.json(), indent=2))
-    personas = resp.json().get("personas", [])
+    personas = api.generate_personas(SUBJECT_ID, TOPIC, count=6)
+    print("Response:", json.dumps(personas, indent=2, ensure_ascii=False))
     assert len(personas) > 0, "No personas returned"
     return personas
 
 def test_generate_prompt(personas):
     print("\nTesting /generate-prompt ...")
     persona_names = [p["name"] for p in personas][:1]  # Use at least one persona name
-    resp = requests.post(
-        f"{API_URL}/generate-prompt",
-        json={
-            "subject_id": SUBJECT_ID,
-            "class_id": CLASS_ID,
-            "topic": TOPIC,
-            "personas": persona_names
-        }
-    )
-    print("Status:", resp.status_code)
-    print("Response:", json.dumps(resp.json(), indent=2))
-    prompt = resp.json().get("prompt")
+    prompt = api.generate_prompt(SUBJECT_ID, CLASS_ID, TOPIC, persona_names)
+    print("Response:", json.dumps({"prompt": prompt}, indent=2, ensure_ascii=False))
     assert prompt, "No prompt returned"
     return prompt
 
@@ -46,22 +34,17 @@ def test_generate_feed(personas, prompt):
     # Pick personas for selected_personas
     selected_personas = personas
     # No manual personas, only generated ones
-    data = {
-        "class_id": CLASS_ID,
-        "subject_id": SUBJECT_ID,
-        "global_prompt": prompt,
-        "topic": TOPIC,
-        "selected_personas": selected_personas,
-        "manual_personas": []
-    }
-    resp = requests.post(f"{API_URL}/generate-feed", json=data)
-    print("Status:", resp.status_code)
-    try:
-        print("Response:", json.dumps(resp.json(), indent=2))
-    except Exception:
-        print("Raw response:", resp.text)
-    assert resp.status_code == 200, "Feed creation failed"
-    return resp.json()
+    result = api.generate_feed(CLASS_ID, SUBJECT_ID, prompt, TOPIC, selected_personas, manual_personas=[])
+    # while the LLM is unavailable the feed is generated as a job once it is back
+    while result.get("status") in ("queued", "running"):
+        print(f"Job {result['job_id']} is {result['status']}, waiting ...")
+        time.sleep(5)
+        result = api.generation_job(result["job_id"])
+    if result.get("status") == "done":
+        result = result["result"]
+    print("Response:", json.dumps(result, indent=2, ensure_ascii=False))
+    assert "feed_id" in result, "Feed creation failed"
+    return result
 
 if __name__ == "__main__":
     try:
@@ -70,4 +53,6 @@ if __name__ == "__main__":
         test_generate_feed(personas, prompt)
     except Exception as e:
         print(f"Test failed: {e}")
-        exit(1)
\ No newline at end of file
+        exit(1)
+    finally:
+        api.close()
\ No newline at end of file
@@ -0,0 +1,121 @@
+"""Stand-ins for the host-wide SQLite stores and Supabase, shared by the unit tests."""
+import uuid
+
+import pytest
+
+from core import cache, clients, deferred
+from core.cache import SharedCache
+from core.deferred import DeferredQueue
+
+
+class Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class Query:
+    """The slice of the Supabase query builder the app uses, over in-memory rows."""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.rows = list(db.tables.setdefault(table, []))
+        self.one = None
+        self.bounds = None
+        self.ordering = []
+        self.action = None
+        db.queries.append(table)
+
+    def select(self, columns="*"):
+        return self
+
+    def eq(self, column, value):
+        self.rows = [r for r in self.rows if r.get(column) == value]
+        return self
+
+    def in_(self, column, values):
+        self.rows = [r for r in self.rows if r.get(column) in values]
+        return self
+
+    def order(self, column, desc=False):
+        # like PostgREST, the first order() is the primary sort key
+        self.ordering.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end)
+        return self
+
+    def limit(self, count):
+        self.bounds = (0, count - 1)
+        return self
+
+    def single(self):
+        self.one = "single"
+        return self
+
+    def maybe_single(self):
+        self.one = "maybe"
+        return self
+
+    def insert(self, rows):
+        self.action = ("insert", rows if isinstance(rows, list) else [rows])
+        return self
+
+    def update(self, values):
+        self.action = ("update", values)
+        return self
+
+    def execute(self):
+        if self.action and self.action[0] == "insert":
+            rows = [{"id": str(uuid.uuid4()), "is_visible": True, **row} for row in self.action[1]]
+            self.db.tables[self.table].extend(rows)
+            return Result([dict(row) for row in rows])
+        if self.action:
+            for row in self.rows:
+                row.update(self.action[1])
+            return Result([dict(row) for row in self.rows])
+        for column, desc in reversed(self.ordering):
+            self.rows.sort(key=lambda r: r[column], reverse=desc)
+        rows = self.rows[self.bounds[0]:self.bounds[1] + 1] if self.bounds else self.rows
+        rows = [dict(row) for row in rows]
+        if self.one == "single":
+            if len(rows) != 1:
+                raise RuntimeError(f"expected one row of {self.table}, got {len(rows)}")
+            return Result(rows[0])
+        if self.one == "maybe":
+            return Result(rows[0]) if rows else None
+        return Result(rows)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.tables = {}
+        self.queries = []
+
+    def table(self, name):
+        return Query(self, name)
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    """The app's Supabase client (get_supabase), over empty in-memory tables."""
+    db = FakeSupabase()
+    monkeypatch.setattr(clients, "_supabase", db)
+    return db
+
+
+@pytest.fixture
+def shared_cache(tmp_path, monkeypatch):
+    """The host-wide cache (get_cache), on a fresh file."""
+    store = SharedCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(cache, "_cache", store)
+    return store
+
+
+@pytest.fixture
+def deferred_queue(tmp_path, monkeypatch):
+    """The deferred queue (get_deferred) without its drain thread; tests run entries themselves."""
+    queue = DeferredQueue(str(tmp_path / "deferred.sqlite3"))
+    monkeypatch.setattr(deferred, "_queue", queue)
+    return queue
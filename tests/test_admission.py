@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from core.admission import AdmissionController
+
+
+def controller(max_active, class_active, user_active=2, class_queue=10, queue_timeout=5.0):
+    return AdmissionController(max_active=max_active, class_active=class_active, user_active=user_active,
+                               class_queue=class_queue, total_queue=100, queue_timeout=queue_timeout)
+
+
+async def hold(admission, order, name, class_key, user_key=None, release=None):
+    async with admission.admit(class_key, user_key):
+        order.append(name)
+        await (release.wait() if release else asyncio.sleep(0.01))
+
+
+def test_requests_beyond_the_class_cap_wait_for_a_slot():
+    async def main():
+        admission = controller(10, 2)
+        release = asyncio.Event()
+        order = []
+        tasks = [asyncio.create_task(hold(admission, order, i, "a", release=release)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        assert order == [0, 1]
+        assert admission.stats() == {"active": 2, "queued": 1, "shed": 0}
+        release.set()
+        await asyncio.gather(*tasks)
+        assert order == [0, 1, 2]
+        assert admission.stats() == {"active": 0, "queued": 0, "shed": 0}
+
+    asyncio.run(main())
+
+
+def test_a_quiet_class_is_not_stuck_behind_a_bursting_one():
+    async def main():
+        admission = controller(1, 1)
+        order = []
+        burst = [asyncio.create_task(hold(admission, order, f"a{i}", "a")) for i in range(5)]
+        await asyncio.sleep(0)
+        quiet = asyncio.create_task(hold(admission, order, "b0", "b"))
+        await asyncio.gather(*burst, quiet)
+        # classes take turns for freed slots: b0 waits for one of a's queued requests, not all four
+        assert order == ["a0", "a1", "b0", "a2", "a3", "a4"]
+
+    asyncio.run(main())
+
+
+def test_the_per_user_cap_holds_within_a_class():
+    async def main():
+        admission = controller(10, 10, user_active=1)
+        release = asyncio.Event()
+        order = []
+        tasks = [asyncio.create_task(hold(admission, order, name, "a", user, release))
+                 for name, user in [("u1-first", "u1"), ("u1-second", "u1"), ("u2", "u2")]]
+        await asyncio.sleep(0.01)
+        assert sorted(order) == ["u1-first", "u2"]
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+
+def test_a_full_class_queue_sheds_with_retry_after():
+    async def main():
+        admission = controller(1, 1, class_queue=1)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(admission, [], "running", "a", release=release))
+        waiting = asyncio.create_task(hold(admission, [], "waiting", "a", release=release))
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as shed:
+            async with admission.admit("a"):
+                pass
+        assert shed.value.status_code == 429
+        assert int(shed.value.headers["Retry-After"]) >= 1
+        assert admission.stats()["shed"] == 1
+        # another class still has room in its own queue
+        other = asyncio.create_task(hold(admission, [], "other", "b", release=release))
+        await asyncio.sleep(0.01)
+        assert admission.stats()["queued"] == 2
+        release.set()
+        await asyncio.gather(running, waiting, other)
+
+    asyncio.run(main())
+
+
+def test_waiting_past_the_queue_timeout_sheds():
+    async def main():
+        admission = controller(1, 1, queue_timeout=0.05)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(admission, [], "running", "a", release=release))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as shed:
+            async with admission.admit("a"):
+                pass
+        assert shed.value.status_code == 429
+        assert admission.stats()["queued"] == 0
+        release.set()
+        await running
+
+    asyncio.run(main())
+
+
+def test_a_cancelled_waiter_leaves_the_queue():
+    async def main():
+        admission = controller(1, 1)
+        release = asyncio.Event()
+        running = asyncio.create_task(hold(admission, [], "running", "a", release=release))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold(admission, [], "gave up", "a"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        release.set()
+        await running
+        assert admission.stats() == {"active": 0, "queued": 0, "shed": 0}
+
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+from core.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def breaker(open_seconds=0.05):
+    """Opens once half of at least 4 calls failed or took over a second."""
+    return CircuitBreaker(error_rate=0.5, slow_seconds=1.0, min_calls=4, window=60.0, open_seconds=open_seconds)
+
+
+def trip(b):
+    for _ in range(b.min_calls):
+        b.record(0.01, False)
+    assert b.state == OPEN
+
+
+def test_stays_closed_until_enough_calls_failed():
+    b = breaker()
+    for _ in range(3):
+        b.record(0.01, False)
+    assert b.state == CLOSED
+    # 3 of 4 failed
+    b.record(0.01, True)
+    assert b.state == OPEN
+
+
+def test_failures_below_the_error_rate_keep_it_closed():
+    b = breaker()
+    for ok in [True, False, True, False, True, True]:
+        b.record(0.01, ok)
+    assert b.state == CLOSED
+    b.before_call()
+
+
+def test_slow_calls_count_as_failures():
+    b = breaker()
+    for _ in range(4):
+        b.record(2.0, True)
+    assert b.state == OPEN
+
+
+def test_an_open_circuit_refuses_calls_with_retry_after():
+    b = breaker(open_seconds=30)
+    trip(b)
+    assert not b.available()
+    with pytest.raises(CircuitOpenError) as refused:
+        b.before_call()
+    assert 1.0 <= refused.value.retry_after <= 30
+    assert b.stats() == {"state": OPEN, "opened": 1, "rejected": 1}
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success():
+    b = breaker()
+    trip(b)
+    time.sleep(0.06)
+    assert b.available()
+    b.before_call()
+    assert b.state == HALF_OPEN
+    # the probe is out; everyone else keeps getting the degraded path
+    assert not b.available()
+    with pytest.raises(CircuitOpenError):
+        b.before_call()
+    b.record(0.01, True)
+    assert b.state == CLOSED
+    b.before_call()
+
+
+def test_a_failed_probe_opens_it_again():
+    b = breaker()
+    trip(b)
+    time.sleep(0.06)
+    b.before_call()
+    b.record(0.01, False)
+    assert b.state == OPEN
+    assert b.stats()["opened"] == 2
+
+
+def test_a_probe_that_never_reports_back_is_replaced():
+    b = breaker()
+    trip(b)
+    time.sleep(0.06)
+    b.before_call()
+    time.sleep(0.06)
+    assert b.available()
+    b.before_call()
+
+
+def test_late_answers_while_open_are_ignored():
+    b = breaker(open_seconds=30)
+    trip(b)
+    for _ in range(10):
+        b.record(0.01, True)
+    assert b.state == OPEN
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from core.cache import SharedCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SharedCache(str(tmp_path / "cache.sqlite3"))
+
+
+def test_get_or_compute_stores_the_value(cache):
+    assert cache.get_or_compute("k", lambda: {"a": 1}) == {"a": 1}
+    assert cache.get_or_compute("k", lambda: pytest.fail("computed twice")) == {"a": 1}
+
+
+def test_concurrent_misses_compute_once(cache):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return "v"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["v"] * 5
+    assert len(calls) == 1
+
+
+def test_failed_compute_is_not_stored_and_frees_the_lease(cache):
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute("k", fail)
+    assert cache.get("k") is None
+    assert cache.get_or_compute("k", lambda: "v") == "v"
+
+
+def test_lease_is_renewed_while_computing(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache.sqlite3"), lease_ttl=0.3)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(1.0)
+        return "v"
+
+    first = threading.Thread(target=cache.get_or_compute, args=("k", slow))
+    first.start()
+    # well past lease_ttl: without renewal this caller would take over the lease and compute again
+    time.sleep(0.6)
+    assert cache.get_or_compute("k", slow) == "v"
+    first.join()
+    assert len(calls) == 1
+
+
+def test_async_lease_is_renewed_while_computing(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache.sqlite3"), lease_ttl=0.3)
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(1.0)
+        return "v"
+
+    async def main():
+        first = asyncio.create_task(cache.aget_or_compute("k", slow))
+        await asyncio.sleep(0.6)
+        second = await asyncio.to_thread(cache.get_or_compute, "k", lambda: "other")
+        return await first, second
+
+    assert asyncio.run(main()) == ("v", "v")
+    assert len(calls) == 1
+
+
+def test_expired_entries_miss(cache):
+    cache.set("k", "v", ttl=0.05)
+    time.sleep(0.1)
+    assert cache.get("k", "missing") == "missing"
+
+
+def test_incr_counts_from_zero_and_is_atomic(cache):
+    assert cache.incr("n") == 1
+    threads = [threading.Thread(target=lambda: [cache.incr("n") for _ in range(20)]) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.get("n") == 101
+    assert cache.incr("n", -1) == 100
+
+
+def test_advance_returns_the_previous_value_and_never_lowers(cache):
+    assert cache.advance("n", 3) == 0
+    assert cache.advance("n", 2) == 3
+    assert cache.get("n") == 3
+    assert cache.advance("n", 5) == 3
+    assert cache.get("n") == 5
+
+
+def test_racing_advances_get_disjoint_ranges(cache):
+    claimed = []
+    lock = threading.Lock()
+
+    def advance(to):
+        previous = cache.advance("n", to)
+        with lock:
+            claimed.extend(range(previous, to))
+
+    threads = [threading.Thread(target=advance, args=(to,)) for to in [4, 8, 8, 12, 6, 12]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == list(range(12))
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+
+import httpx
+import pytest
+from fastapi import FastAPI, Header
+from fastapi.testclient import TestClient
+
+from classsquare_client import replay
+from core import capture
+from core.capture import CaptureMiddleware, CaptureWriter, body_shape
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    writer = CaptureWriter(str(tmp_path / "captures"), max_bytes=1024 * 1024, keep=5)
+    monkeypatch.setattr(capture, "_writer", writer)
+    return writer
+
+
+def records(writer):
+    return replay.read_records([os.path.join(writer.directory, name) for name in os.listdir(writer.directory)])
+
+
+@pytest.fixture
+def app():
+    app = FastAPI()
+
+    @app.post("/feeds/{feed_id}/echo")
+    def echo(feed_id: str, body: dict, idempotency_key: str | None = Header(None)):
+        capture.count("llm_calls", 2)
+        capture.count("db_queries")
+        return {"feed_id": feed_id, "key": idempotency_key, **body}
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    app.add_middleware(CaptureMiddleware)
+    return app
+
+
+def test_body_shape_keeps_ids_numbers_and_flags_and_hides_text():
+    body = {"feed_id": "f1", "topic": "Napoleon", "count": 3, "lazy": True, "persona_ids": ["p1", "p2"],
+            "personas": [{"name": "Ada", "id": "p3"}]}
+    shape = body_shape(body)
+    assert shape == {"feed_id": "f1", "topic": {"$str": 8}, "count": 3, "lazy": True, "persona_ids": ["p1", "p2"],
+                     "personas": [{"name": {"$str": 3}, "id": "p3"}]}
+    filled = replay.fill(shape)
+    assert len(filled["topic"]) == 8 and filled["personas"][0]["id"] == "p3"
+
+
+def test_each_request_is_recorded_with_its_route_and_downstream_calls(app, writer):
+    client = TestClient(app)
+    client.post("/feeds/f1/echo?x=1", json={"topic": "secret"}, headers={"Idempotency-Key": "k"})
+    client.get("/health")
+    [record] = records(writer)
+    assert record["endpoint"] == "/feeds/{feed_id}/echo"
+    assert record["path"] == "/feeds/f1/echo" and record["query"] == "x=1"
+    assert record["status"] == 200 and record["idempotency_key"] is True
+    assert record["llm_calls"] == 2 and record["db_queries"] == 1
+    assert record["body"] == {"topic": {"$str": 6}}
+    assert "secret" not in json.dumps(record)
+
+
+def test_the_writer_rotates_and_keeps_the_newest_files(tmp_path):
+    writer = CaptureWriter(str(tmp_path), max_bytes=1, keep=2)
+    for i in range(4):
+        writer.write({"i": i})
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 2
+    assert [r["i"] for r in replay.read_records([str(tmp_path / name) for name in files])] == [2, 3]
+
+
+def test_replay_sends_the_captured_request_with_a_fresh_idempotency_key(app, writer):
+    TestClient(app).post("/feeds/f1/echo", json={"topic": "secret"}, headers={"Idempotency-Key": "k"})
+    [record] = records(writer)
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            return await replay.send(http, record)
+
+    result = asyncio.run(main())
+    assert result["status"] == 200
+    [captured, replayed] = records(writer)
+    assert replayed["path"] == captured["path"] and replayed["body"] == captured["body"]
+    assert replayed["idempotency_key"] is True
+
+
+def test_summaries_count_server_errors_per_endpoint():
+    results = [{"method": "GET", "endpoint": "/feeds/{feed_id}", "status": status, "latency_ms": latency}
+               for status, latency in [(200, 10), (200, 20), (500, 30), ("error: ReadTimeout", 40)]]
+    summary = replay.summarize(results)["GET /feeds/{feed_id}"]
+    assert summary["count"] == 4 and summary["errors"] == 2
+    assert summary["p50"] == 30
@@ -0,0 +1,89 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from core.coalesce import Coalescer
+
+
+class Recorder:
+    """Handler that answers each item with its double, or fails items that are exceptions."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, key, items):
+        self.batches.append((key, list(items)))
+        return [item if isinstance(item, Exception) else item * 2 for item in items]
+
+
+async def submit_all(coalescer, submissions):
+    return await asyncio.gather(*(coalescer.submit(key, item) for key, item in submissions), return_exceptions=True)
+
+
+def test_items_of_a_key_within_the_window_share_one_call():
+    handler = Recorder()
+    coalescer = Coalescer(handler, window=0.05, max_batch=10)
+    results = asyncio.run(submit_all(coalescer, [("a", 1), ("a", 2), ("b", 3), ("a", 4)]))
+    assert results == [2, 4, 6, 8]
+    assert sorted(handler.batches) == [("a", [1, 2, 4]), ("b", [3])]
+
+
+def test_a_full_batch_goes_out_without_waiting():
+    handler = Recorder()
+    coalescer = Coalescer(handler, window=0.05, max_batch=2)
+    results = asyncio.run(submit_all(coalescer, [("a", i) for i in range(5)]))
+    assert results == [0, 2, 4, 6, 8]
+    assert [items for _, items in handler.batches] == [[0, 1], [2, 3], [4]]
+
+
+def test_an_exception_result_fails_only_its_item():
+    handler = Recorder()
+    coalescer = Coalescer(handler, window=0.05, max_batch=10)
+    error = ValueError("bad item")
+    results = asyncio.run(submit_all(coalescer, [("a", 1), ("a", error), ("a", 3)]))
+    assert results == [2, error, 6]
+
+
+def test_a_failing_handler_fails_the_whole_batch():
+    def handler(key, items):
+        raise RuntimeError("down")
+
+    coalescer = Coalescer(handler, window=0.05, max_batch=10)
+    results = asyncio.run(submit_all(coalescer, [("a", 1), ("a", 2)]))
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_without_a_window_every_item_is_its_own_call():
+    handler = Recorder()
+    coalescer = Coalescer(handler, window=0, max_batch=10)
+    assert asyncio.run(submit_all(coalescer, [("a", 1), ("a", 2)])) == [2, 4]
+    assert handler.batches == [("a", [1]), ("a", [2])]
+
+
+@pytest.mark.parametrize("window", [0.05, 0])
+def test_admit_runs_once_per_batch(window):
+    admitted = []
+
+    @asynccontextmanager
+    async def admit(key, items):
+        admitted.append((key, list(items)))
+        yield
+
+    coalescer = Coalescer(Recorder(), window=window, max_batch=30, admit=admit)
+    results = asyncio.run(submit_all(coalescer, [("a", i) for i in range(30)]))
+    assert results == [i * 2 for i in range(30)]
+    assert len(admitted) == (1 if window else 30)
+
+
+def test_a_refused_admission_fails_the_batch_without_calling_the_handler():
+    @asynccontextmanager
+    async def admit(key, items):
+        raise PermissionError("no slot")
+        yield
+
+    handler = Recorder()
+    coalescer = Coalescer(handler, window=0.05, max_batch=10, admit=admit)
+    results = asyncio.run(submit_all(coalescer, [("a", 1), ("a", 2)]))
+    assert all(isinstance(r, PermissionError) for r in results)
+    assert handler.batches == []
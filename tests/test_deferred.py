@@ -0,0 +1,167 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException, Response
+
+from core import deferred, idempotency
+from core.breaker import CircuitBreaker, CircuitOpenError
+from core.deferred import MAX_ATTEMPTS
+from core.idempotency import defer_idempotent, get_job, run_idempotent
+
+BODY = {"feed_id": "f1", "num_initial_posts": 4}
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    """Registers `handler` for the "test" kind; returns the payloads it was given and what was given up."""
+    seen = {"runs": [], "given_up": []}
+
+    def use(handler):
+        def run(payload):
+            seen["runs"].append(dict(payload))
+            handler(payload)
+        monkeypatch.setitem(deferred._handlers, "test", (run, lambda payload, error: seen["given_up"].append(str(error))))
+        return seen
+    return use
+
+
+def rerun(queue):
+    """Claims the next entry as if its backoff had passed, and runs it."""
+    queue._conn().execute("UPDATE deferred SET run_after = 0")
+    queue._run(*queue.claim())
+
+
+def attempts(queue):
+    return queue._conn().execute("SELECT attempts FROM deferred").fetchone()[0]
+
+
+def test_an_entry_with_a_key_is_queued_once(deferred_queue):
+    assert deferred_queue.push("test", {"n": 1}, key="a")
+    assert not deferred_queue.push("test", {"n": 2}, key="a")
+    assert deferred_queue.push("test", {"n": 3})
+    assert deferred_queue.stats() == {"test": 2}
+
+
+def test_a_claimed_entry_is_hidden_from_other_workers(deferred_queue):
+    deferred_queue.push("test", {"n": 1})
+    assert deferred_queue.claim()[1:] == ("test", {"n": 1}, 1)
+    assert deferred_queue.claim() is None
+
+
+def test_an_open_circuit_retries_without_using_up_attempts(deferred_queue, handled):
+    def handler(payload):
+        raise CircuitOpenError(5)
+
+    seen = handled(handler)
+    deferred_queue.push("test", {})
+    for _ in range(MAX_ATTEMPTS + 2):
+        rerun(deferred_queue)
+    assert attempts(deferred_queue) == 0
+    assert deferred_queue.stats() == {"test": 1} and seen["given_up"] == []
+
+
+def test_a_failed_entry_is_retried_with_what_it_recorded(deferred_queue, handled):
+    def handler(payload):
+        payload["done"] = payload.get("done", 0) + 1
+        if payload["done"] < 3:
+            raise RuntimeError("provider error")
+
+    seen = handled(handler)
+    deferred_queue.push("test", {})
+    rerun(deferred_queue)
+    rerun(deferred_queue)
+    rerun(deferred_queue)
+    assert [run.get("done") for run in seen["runs"]] == [None, 1, 2]
+    assert deferred_queue.stats() == {}
+
+
+def test_an_entry_is_given_up_after_max_attempts(deferred_queue, handled):
+    def handler(payload):
+        raise RuntimeError("bad request")
+
+    seen = handled(handler)
+    deferred_queue.push("test", {})
+    for _ in range(MAX_ATTEMPTS):
+        rerun(deferred_queue)
+    assert len(seen["runs"]) == MAX_ATTEMPTS
+    assert seen["given_up"] == ["bad request"]
+    assert deferred_queue.stats() == {}
+
+
+def test_an_unknown_kind_is_left_for_a_worker_that_knows_it(deferred_queue):
+    deferred_queue.push("from-a-newer-build", {})
+    rerun(deferred_queue)
+    assert attempts(deferred_queue) == 0
+    assert deferred_queue.stats() == {"from-a-newer-build": 1}
+
+
+@pytest.fixture
+def jobs(monkeypatch, shared_cache, deferred_queue):
+    """A "populate-feed" job whose work is set by the test; returns the list the work records its runs in."""
+    runs = []
+    monkeypatch.setattr(idempotency, "get_breaker", lambda: CircuitBreaker(
+        error_rate=0.5, slow_seconds=1.0, min_calls=4, window=60.0, open_seconds=30.0))
+
+    def use(work):
+        def job(payload, progress):
+            runs.append(payload)
+            return work(payload, progress)
+        monkeypatch.setitem(idempotency._jobs, "populate-feed", job)
+        return runs
+    return use
+
+
+def test_a_deferred_request_answers_202_with_one_job_per_key(jobs, deferred_queue):
+    jobs(lambda payload, progress: "done")
+    response = Response()
+    job = defer_idempotent("populate-feed", "k1", BODY, response)
+    assert response.status_code == 202 and "Retry-After" in response.headers
+    assert job["status"] == "queued"
+    assert defer_idempotent("populate-feed", "k1", BODY, Response())["job_id"] == job["job_id"]
+    assert deferred_queue.stats() == {"job": 1}
+
+
+def test_a_job_stores_its_result_for_the_retrying_client(jobs, deferred_queue):
+    runs = jobs(lambda payload, progress: {"posts_created": payload["num_initial_posts"]})
+    job_id = defer_idempotent("populate-feed", "k1", BODY, Response())["job_id"]
+    rerun(deferred_queue)
+    assert get_job(job_id)["status"] == "done"
+    assert get_job(job_id)["result"] == {"posts_created": 4}
+
+    response = Response()
+    result = asyncio.run(run_idempotent("populate-feed", "k1", BODY, lambda progress: pytest.fail("ran again"), response))
+    assert result == {"posts_created": 4}
+    assert response.headers[idempotency.REPLAY_HEADER] == "true"
+    assert defer_idempotent("populate-feed", "k1", BODY, Response()) == {"posts_created": 4}
+    assert len(runs) == 1
+
+
+def test_a_job_for_a_bad_request_fails_without_retrying(jobs, deferred_queue):
+    def work(payload, progress):
+        raise HTTPException(status_code=404, detail="Feed not found")
+
+    jobs(work)
+    job_id = defer_idempotent("populate-feed", "k1", BODY, Response())["job_id"]
+    rerun(deferred_queue)
+    assert get_job(job_id) == {"job_id": job_id, "scope": "populate-feed", "status": "failed", "error": "Feed not found"}
+    assert deferred_queue.stats() == {}
+
+
+def test_an_interrupted_job_resumes_from_its_progress(jobs, deferred_queue):
+    stored, interruptions = [], [CircuitOpenError(5)]
+
+    def work(payload, progress):
+        for index in range(progress.get("posts", 0), payload["num_initial_posts"]):
+            if index == 2 and interruptions:
+                raise interruptions.pop()
+            stored.append(index)
+            progress["posts"] = index + 1
+        return {"posts_created": len(stored)}
+
+    jobs(work)
+    job_id = defer_idempotent("populate-feed", "k1", BODY, Response())["job_id"]
+    rerun(deferred_queue)
+    assert get_job(job_id)["status"] == "queued"
+    rerun(deferred_queue)
+    assert get_job(job_id)["result"] == {"posts_created": 4}
+    assert stored == [0, 1, 2, 3]
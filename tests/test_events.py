@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from core import events
+from core.events import RESYNC, EventLog, FeedHub
+from core.lookups import feed_version
+
+
+@pytest.fixture
+def log(tmp_path):
+    return EventLog(str(tmp_path / "events.sqlite3"))
+
+
+def post_event(log, feed_id, text):
+    log.append(feed_id, {"type": "posts", "feed_id": feed_id, "items": [{"content": text}]})
+
+
+def texts(events):
+    return [event["items"][0]["content"] for event in events]
+
+
+def test_subscribers_get_new_events_of_their_feed_only(log):
+    async def main():
+        hub = FeedHub(log, queue_size=10, poll_interval=0.01)
+        post_event(log, "f1", "before")
+        subscription = hub.subscribe("f1")
+        post_event(log, "f2", "other feed")
+        post_event(log, "f1", "first")
+        post_event(log, "f1", "second")
+        received = [await asyncio.wait_for(subscription.next(), 1) for _ in range(2)]
+        assert texts(received) == ["first", "second"]
+        assert subscription.queue.empty()
+        hub.unsubscribe(subscription)
+        assert hub.subscriber_count == 0
+
+    asyncio.run(main())
+
+
+def test_a_reconnecting_subscriber_resumes_after_its_last_event(log):
+    async def main():
+        hub = FeedHub(log, queue_size=10, poll_interval=0.01)
+        post_event(log, "f1", "seen")
+        seen = log.last_id()
+        post_event(log, "f1", "missed")
+        subscription = hub.subscribe("f1", after=seen)
+        post_event(log, "f1", "live")
+        received = [await asyncio.wait_for(subscription.next(), 1) for _ in range(2)]
+        assert texts(received) == ["missed", "live"]
+
+    asyncio.run(main())
+
+
+def test_a_subscriber_that_falls_behind_is_told_to_resync_and_dropped(log):
+    async def main():
+        hub = FeedHub(log, queue_size=2, poll_interval=0.01)
+        subscription = hub.subscribe("f1")
+        for i in range(5):
+            post_event(log, "f1", f"post {i}")
+        await asyncio.sleep(0.1)
+        assert subscription.dropped
+        assert await subscription.next() == RESYNC
+        assert subscription.queue.empty()
+
+    asyncio.run(main())
+
+
+def test_publish_logs_the_rows_and_invalidates_the_feed_pages(log, shared_cache, monkeypatch):
+    monkeypatch.setattr(events, "_log", log)
+    version = feed_version("f1")
+    events.publish("f1", "comments", [{"id": "c1"}])
+    events.publish("f1", "comments", [])
+    assert [payload for _, _, payload in log.since(0)] == [{"type": "comments", "feed_id": "f1", "items": [{"id": "c1"}]}]
+    assert feed_version("f1") != version
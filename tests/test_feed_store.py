@@ -0,0 +1,100 @@
+import pytest
+
+from core import feed_store
+
+
+def post(id, created_at, visible=True):
+    return {"id": id, "feed_id": "f1", "author_id": "a1", "content": id, "created_at": created_at, "is_visible": visible}
+
+
+def comment(id, post_id, parent=None, visible=True, created_at="2025-01-01"):
+    return {"id": id, "post_id": post_id, "parent_comment_id": parent, "author_id": "a2", "content": id,
+            "created_at": created_at, "is_visible": visible}
+
+
+@pytest.fixture
+def db(supabase):
+    supabase.tables.update({
+        "feeds": [{"id": "f1", "subject_id": "s1", "title": "T", "global_prompt": "G"}],
+        "posts": [post("p1", "1"), post("p2", "2"), post("hidden", "3", visible=False), post("p3", "4")],
+        "comments": [
+            comment("c1", "p1", created_at="1"),
+            comment("c1a", "p1", parent="c1", created_at="2"),
+            comment("c1a-i", "p1", parent="c1a", created_at="3"),
+            comment("c2", "p1", created_at="4"),
+            comment("gone", "p1", visible=False, created_at="5"),
+            comment("under-gone", "p1", parent="gone", created_at="6"),
+            comment("d1", "p2"),
+        ],
+    })
+    supabase.queries.clear()
+    return supabase
+
+
+def shape(nodes):
+    return [(n["id"], shape(n["replies"])) for n in nodes]
+
+
+def test_builds_the_visible_comment_tree_of_each_post(db):
+    page = feed_store.load_feed_page("f1", 0, 10)
+    assert [p["id"] for p in page["posts"]] == ["p1", "p2", "p3"]
+    p1, p2, p3 = page["posts"]
+    assert shape(p1["comments"]) == [("c1", [("c1a", [("c1a-i", [])])]), ("c2", [])]
+    assert shape(p2["comments"]) == [("d1", [])]
+    assert p3["comments"] == []
+    assert page["feed"]["id"] == "f1"
+    assert page["next_offset"] is None
+
+
+def test_pages_through_visible_posts(db):
+    first = feed_store.load_feed_page("f1", 0, 2)
+    assert [p["id"] for p in first["posts"]] == ["p1", "p2"]
+    assert first["next_offset"] == 2
+    second = feed_store.load_feed_page("f1", first["next_offset"], 2)
+    assert [p["id"] for p in second["posts"]] == ["p3"]
+    assert second["next_offset"] is None
+
+
+def test_queries_do_not_grow_with_the_feed(db):
+    feed_store.load_feed_page("f1", 0, 10)
+    assert db.queries == ["feeds", "posts", "comments"]
+
+
+def test_a_missing_feed_is_none(db):
+    assert feed_store.load_feed_page("nope", 0, 10) is None
+
+
+def test_an_empty_page_skips_the_comments_query(db):
+    page = feed_store.load_feed_page("f1", 10, 10)
+    assert page["posts"] == []
+    assert db.queries == ["feeds", "posts"]
+
+
+@pytest.fixture
+def published(monkeypatch):
+    events = []
+    monkeypatch.setattr(feed_store, "publish", lambda feed_id, type, rows: events.append((feed_id, type, len(rows))))
+    return events
+
+
+def test_a_clone_copies_the_visible_posts_and_comment_trees(db, published):
+    created = feed_store.clone_feed("f1", title="Copy")
+    new_id = created["feed_id"]
+    assert new_id != "f1"
+    assert (created["posts_created"], created["comments_created"]) == (3, 5)
+    assert [f for f in db.tables["feeds"] if f["id"] == new_id] == [
+        {"id": new_id, "subject_id": "s1", "title": "Copy", "global_prompt": "G", "is_visible": True}
+    ]
+    page = feed_store.load_feed_page(new_id, 0, 10)
+    assert [p["content"] for p in page["posts"]] == ["p1", "p2", "p3"]
+    # same tree under new ids: replies point at the copies of their parents
+    copy_shape = [[(c["content"], [(r["content"], len(r["replies"])) for r in c["replies"]]) for c in p["comments"]]
+                  for p in page["posts"]]
+    assert copy_shape == [[("c1", [("c1a", 1)]), ("c2", [])], [("d1", [])], []]
+    assert {c["id"] for p in page["posts"] for c in p["comments"]}.isdisjoint({"c1", "c2", "d1"})
+    assert published == [(new_id, "posts", 3), (new_id, "comments", 5)]
+
+
+def test_cloning_a_missing_feed_is_none(db, published):
+    assert feed_store.clone_feed("nope") is None
+    assert published == []
@@ -0,0 +1,136 @@
+import types
+
+import pytest
+
+from core.breaker import CircuitBreaker, CircuitOpenError
+from core.deferred import MAX_ATTEMPTS
+from routes import feed
+from routes.feed import FeedPopulationRequest
+
+
+class Answer:
+    def __init__(self, text):
+        self.text = text
+
+
+class Model:
+    """Writes numbered posts and comments; `fail` is raised by every call while it is set."""
+
+    def __init__(self):
+        self.fail = None
+        self.calls = 0
+
+    def generate_content(self, prompt):
+        if self.fail:
+            raise self.fail
+        self.calls += 1
+        return Answer(f"text {self.calls}")
+
+
+@pytest.fixture
+def model(monkeypatch, supabase, shared_cache, deferred_queue):
+    supabase.tables.update({
+        "feeds": [{"id": "f1", "subject_id": "s1", "title": "T", "global_prompt": "G"}],
+        "subjects": [{"id": "s1", "name": "History", "general_prompt": "gp"}],
+        "personas": [{"id": f"p{i}", "subject_id": "s1", "name": f"Persona {i}", "prompt": "bg"} for i in range(3)],
+        "users": [{"id": f"p{i}"} for i in range(3)],
+        "posts": [],
+        "comments": [],
+    })
+    model = Model()
+    monkeypatch.setattr(feed, "get_task_model", lambda task: model)
+    monkeypatch.setattr(feed, "publish", lambda feed_id, type, rows: None)
+    breaker = CircuitBreaker(error_rate=0.5, slow_seconds=10.0, min_calls=100, window=60.0, open_seconds=30.0)
+    monkeypatch.setattr(feed, "get_breaker", lambda: breaker)
+    # grow in the calling thread, so each test sees the outcome at once
+    monkeypatch.setattr(feed, "growth_pool", lambda: types.SimpleNamespace(submit=lambda fn, *args: fn(*args)))
+    return model
+
+
+def start_lazy_feed(posts=5, first_page=2, comments=2):
+    request = FeedPopulationRequest(feed_id="f1", topic="Rome", num_initial_posts=posts, num_comments_per_post=comments,
+                                    lazy=True, first_page=first_page)
+    return feed.fill_feed(request)
+
+
+def rows(supabase, table):
+    return [row["content"] for row in supabase.tables[table]]
+
+
+def run_queued(queue):
+    """Runs every queued entry once, ignoring backoff."""
+    queue._conn().execute("UPDATE deferred SET run_after = 0")
+    while (entry := queue.claim()) is not None:
+        queue._run(*entry)
+
+
+def test_only_the_first_page_is_generated_up_front(model, supabase):
+    result = start_lazy_feed()
+    assert (result["posts_created"], result["posts_deferred"]) == (2, 3)
+    assert len(supabase.tables["posts"]) == 2 and len(supabase.tables["comments"]) == 4
+    assert feed.pending_posts("f1") == 3
+
+
+def test_growing_generates_each_planned_post_once(model, supabase):
+    start_lazy_feed()
+    feed.grow_feed("f1", 4)
+    feed.grow_feed("f1", 4)
+    assert len(supabase.tables["posts"]) == 4
+    feed.grow_feed("f1", 100)
+    assert len(supabase.tables["posts"]) == 5 and len(supabase.tables["comments"]) == 10
+    assert feed.pending_posts("f1") == 0
+
+
+def test_a_post_that_fails_is_queued_and_finished_later_without_duplicates(model, supabase, deferred_queue):
+    start_lazy_feed(comments=3)
+    # the post goes in, then its second comment fails
+    calls = model.calls
+    original = model.generate_content
+
+    def fail_on_second_comment(prompt):
+        if model.calls == calls + 2:
+            raise RuntimeError("provider error")
+        return original(prompt)
+
+    model.generate_content = fail_on_second_comment
+    feed.grow_feed("f1", 3)
+    assert len(supabase.tables["posts"]) == 3 and len(supabase.tables["comments"]) == 7
+    assert feed.pending_posts("f1") == 3
+    assert deferred_queue.stats() == {"feed-growth": 1}
+
+    model.generate_content = original
+    run_queued(deferred_queue)
+    assert len(supabase.tables["posts"]) == 3 and len(supabase.tables["comments"]) == 9
+    assert feed.pending_posts("f1") == 2
+    assert deferred_queue.stats() == {}
+
+
+def test_an_open_circuit_pauses_growth_without_using_up_attempts(model, supabase, deferred_queue):
+    start_lazy_feed()
+    model.fail = CircuitOpenError(5)
+    feed.grow_feed("f1", 3)
+    for _ in range(MAX_ATTEMPTS + 1):
+        run_queued(deferred_queue)
+    assert deferred_queue.stats() == {"feed-growth": 1}
+    assert feed.pending_posts("f1") == 3
+
+    model.fail = None
+    run_queued(deferred_queue)
+    assert len(supabase.tables["posts"]) == 3
+    assert feed.pending_posts("f1") == 2
+
+
+def test_a_post_that_keeps_failing_is_given_up_and_no_longer_pending(model, supabase, deferred_queue):
+    start_lazy_feed()
+    model.fail = RuntimeError("bad request")
+    feed.grow_feed("f1", 3)
+    for _ in range(MAX_ATTEMPTS):
+        run_queued(deferred_queue)
+    assert deferred_queue.stats() == {}
+    assert len(supabase.tables["posts"]) == 2
+    assert feed.pending_posts("f1") == 2
+
+
+def test_first_page_must_be_positive():
+    with pytest.raises(ValueError):
+        FeedPopulationRequest(feed_id="f1", topic="Rome", lazy=True, first_page=0)
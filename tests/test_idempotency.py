@@ -0,0 +1,89 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+from fastapi import HTTPException, Response
+
+from core.idempotency import REPLAY_HEADER, run_idempotent
+
+BODY = {"feed_id": "f1", "num_initial_posts": 4}
+
+
+def run(work, key="k1", body=BODY, response=None, admit=None):
+    return asyncio.run(run_idempotent("populate-feed", key, body, work, response, admit=admit))
+
+
+def test_a_retry_gets_the_stored_result(shared_cache):
+    calls = []
+
+    def work(progress):
+        calls.append(1)
+        return {"posts_created": 4}
+
+    assert run(work) == {"posts_created": 4}
+    response = Response()
+    assert run(work, response=response) == {"posts_created": 4}
+    assert response.headers[REPLAY_HEADER] == "true"
+    assert len(calls) == 1
+
+
+def test_a_key_reused_with_another_body_is_rejected(shared_cache):
+    run(lambda progress: "done")
+    with pytest.raises(HTTPException) as rejected:
+        run(lambda progress: pytest.fail("ran again"), body={**BODY, "num_initial_posts": 5})
+    assert rejected.value.status_code == 422
+
+
+def test_without_a_key_identical_bodies_share_a_run(shared_cache):
+    calls = []
+    run(lambda progress: calls.append(1), key=None)
+    run(lambda progress: calls.append(1), key=None)
+    assert len(calls) == 1
+
+
+def test_concurrent_duplicates_wait_for_the_first_run(shared_cache):
+    calls = []
+
+    def work(progress):
+        calls.append(1)
+        time.sleep(0.2)
+        return "done"
+
+    async def main():
+        return await asyncio.gather(*(run_idempotent("populate-feed", "k1", BODY, work) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["done"] * 3
+    assert len(calls) == 1
+
+
+def test_a_retry_after_an_interrupted_run_resumes_instead_of_repeating_rows(shared_cache):
+    stored = []
+
+    def work(progress, fail_at=None):
+        for index in range(progress.get("posts", 0), 4):
+            if index == fail_at:
+                raise RuntimeError("provider error")
+            stored.append(index)
+            progress["posts"] = index + 1
+        return {"posts_created": 4}
+
+    with pytest.raises(RuntimeError):
+        run(lambda progress: work(progress, fail_at=2))
+    assert run(work) == {"posts_created": 4}
+    assert stored == [0, 1, 2, 3]
+    # a finished run leaves no progress behind for the next one under the key
+    assert shared_cache.get("idem:populate-feed:key:k1:progress") is None
+
+
+def test_only_the_run_itself_is_admitted(shared_cache):
+    admitted = []
+
+    @asynccontextmanager
+    async def admit():
+        admitted.append(1)
+        yield
+
+    run(lambda progress: "done", admit=admit)
+    run(lambda progress: "done", admit=admit)
+    assert len(admitted) == 1
@@ -0,0 +1,78 @@
+import dataclasses
+import types
+
+import pytest
+
+from core import planning, routing
+from core.planning import PlanRecorder, estimate_tokens
+from core.settings import get_settings
+from routes.feed import FeedPopulationRequest, fill_feed
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Sets the provider quota and the requests already admitted; 2 s recorded per call of persona-post."""
+    monkeypatch.setattr(routing, "_health", {})
+    primary = routing.routes()["persona-post"]["primary"]
+    for _ in range(3):
+        routing.model_health(primary).record(2.0, True)
+
+    def set_limits(rpm=0.0, active=0):
+        settings = dataclasses.replace(get_settings(), llm_rpm=rpm)
+        monkeypatch.setattr(planning, "get_settings", lambda: settings)
+        monkeypatch.setattr(planning, "get_admission", lambda: types.SimpleNamespace(active=active))
+    set_limits()
+    return set_limits
+
+
+def record(calls):
+    recorder = PlanRecorder("persona-post")
+    for _ in range(calls):
+        post = recorder.generate_content("Write a post").text
+        recorder.generate_content(f"Respond to this post: {post}")
+    return recorder
+
+
+def test_prompts_are_recorded_with_placeholder_answers_of_the_usual_size():
+    recorder = record(1)
+    assert [c["kind"] for c in recorder.calls] == ["persona-post", "persona-comment"]
+    # the comment prompt quotes a post-sized placeholder
+    assert recorder.calls[1]["prompt_tokens"] >= planning.OUTPUT_TOKENS["persona-post"]
+
+
+def test_token_estimates_count_hebrew_denser_than_latin():
+    assert estimate_tokens("abcd" * 10) == 10
+    assert estimate_tokens("שלום" * 10) == 20
+
+
+def test_wall_time_is_latency_bound_without_a_quota(limits):
+    plan = record(3).summary(include_prompts=False)
+    assert plan["llm_calls"] == 6
+    assert plan["seconds_per_call"] == 2.0
+    assert plan["estimated_seconds"] == 12.0
+    assert "calls" not in plan
+
+
+def test_requests_running_at_once_share_the_quota(limits):
+    # 60 rpm alone: a call a second, faster than the 2 s latency
+    limits(rpm=60)
+    assert record(3).summary()["estimated_seconds"] == 12.0
+    # three more requests running: each gets 15 rpm, a call every 4 s
+    limits(rpm=60, active=3)
+    plan = record(3).summary()
+    assert plan["concurrent_requests"] == 4
+    assert plan["seconds_per_call"] == 4.0
+    assert plan["estimated_seconds"] == 24.0
+
+
+def test_a_dry_run_of_populate_feed_writes_nothing(limits, supabase, shared_cache):
+    supabase.tables.update({
+        "feeds": [{"id": "f1", "subject_id": "s1", "title": "T", "global_prompt": "G"}],
+        "subjects": [{"id": "s1", "name": "History", "general_prompt": "gp"}],
+        "personas": [{"id": f"p{i}", "subject_id": "s1", "name": f"Persona {i}", "prompt": "bg"} for i in range(3)],
+    })
+    plan = fill_feed(FeedPopulationRequest(feed_id="f1", topic="Rome", num_initial_posts=2, num_comments_per_post=3),
+                     dry_run=True)
+    assert plan["llm_calls"] == 8
+    assert (plan["posts_planned"], plan["comments_planned"]) == (2, 6)
+    assert supabase.tables.get("posts", []) == [] and supabase.tables.get("comments", []) == []
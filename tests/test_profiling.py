@@ -0,0 +1,66 @@
+import dataclasses
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from core import admin, profiling
+from core.settings import get_settings
+
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    settings = dataclasses.replace(get_settings(), admin_token="secret", profile_dir=str(tmp_path / "profiles"),
+                                   profile_interval=0.002)
+    monkeypatch.setattr(profiling, "get_settings", lambda: settings)
+    monkeypatch.setattr(admin, "get_settings", lambda: settings)
+    monkeypatch.setattr(profiling, "_sampler", None)
+    return settings
+
+
+@pytest.fixture
+def client(settings, shared_cache):
+    app = FastAPI()
+
+    @app.get("/slow")
+    def slow():
+        busy_until(time.perf_counter() + 0.05)
+        return {"ok": True}
+
+    app.add_middleware(profiling.ProfilingMiddleware)
+    yield TestClient(app)
+    profiling.disarm()
+
+
+def busy_until(deadline):
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_an_admin_request_with_x_profile_is_profiled(client):
+    response = client.get("/slow", headers={"X-Profile": "1", "X-Admin-Token": "secret"})
+    profile_id = response.headers[profiling.PROFILE_ID_HEADER]
+    [meta] = profiling.list_profiles()
+    assert meta["id"] == profile_id
+    assert meta["path"] == "/slow" and meta["status"] == 200 and meta["samples"] > 0
+    with open(profiling.profile_path(profile_id, ".folded"), encoding="utf-8") as f:
+        assert "busy_until" in f.read()
+
+
+def test_x_profile_without_the_admin_token_is_ignored(client):
+    response = client.get("/slow", headers={"X-Profile": "1", "X-Admin-Token": "wrong"})
+    assert profiling.PROFILE_ID_HEADER not in response.headers
+    assert profiling.list_profiles() == []
+
+
+def test_an_armed_plan_profiles_the_next_requests_only(client):
+    profiling.arm(next_requests=2)
+    responses = [client.get("/slow") for _ in range(4)]
+    assert [profiling.PROFILE_ID_HEADER in r.headers for r in responses] == [True, True, False, False]
+    assert len(profiling.list_profiles()) == 2
+
+
+def test_profile_ids_cannot_leave_the_profile_directory(settings):
+    assert profiling.profile_path("../../etc/passwd", ".json") is None
+    assert profiling.profile_path("unknown", ".json") is None
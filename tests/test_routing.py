@@ -0,0 +1,152 @@
+import dataclasses
+import threading
+import time
+
+import pytest
+
+from core import routing
+from core.breaker import CircuitBreaker, CircuitOpenError
+from core.routing import RoutedModel
+from core.settings import get_settings
+
+
+class Answer:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Answers with its name and the call's number; raises for the calls listed in `fail`, sleeps for those in `slow`."""
+
+    def __init__(self, name, fail=(), slow=()):
+        self.name = name
+        self.fail = set(fail)
+        self.slow = set(slow)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        if call in self.slow:
+            time.sleep(0.3)
+        if call in self.fail or "all" in self.fail:
+            raise RuntimeError(f"{self.name} failed")
+        return Answer(f"{self.name} {call}" if self.slow else self.name)
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    # never trips on its own; tests open it explicitly
+    breaker = CircuitBreaker(error_rate=0.5, slow_seconds=10.0, min_calls=100, window=60.0, open_seconds=30.0)
+    monkeypatch.setattr(routing, "get_breaker", lambda: breaker)
+    return breaker
+
+
+@pytest.fixture
+def models(monkeypatch, breaker):
+    models = {}
+    monkeypatch.setattr(routing, "get_model", lambda name: models[name])
+    monkeypatch.setattr(routing, "_health", {})
+    return models
+
+
+def test_a_failed_call_is_retried_on_the_fallback(models):
+    models["primary"], models["fallback"] = FakeModel("primary", fail=["all"]), FakeModel("fallback")
+    model = RoutedModel("task", "primary", "fallback", latency_budget=1.0)
+    assert model.generate_content("hi").text == "fallback"
+    assert models["primary"].calls == 1
+
+
+def test_a_degraded_primary_is_tried_after_the_fallback(models):
+    models["primary"], models["fallback"] = FakeModel("primary", fail=["all"]), FakeModel("fallback")
+    model = RoutedModel("task", "primary", "fallback", latency_budget=1.0)
+    for _ in range(routing.MIN_CALLS):
+        model.generate_content("hi")
+    assert model.choose() == ["fallback", "primary"]
+    calls = models["primary"].calls
+    assert model.generate_content("hi").text == "fallback"
+    assert models["primary"].calls == calls
+
+
+def test_without_a_fallback_the_error_is_raised(models):
+    models["primary"] = FakeModel("primary", fail=[1])
+    model = RoutedModel("task", "primary", None, latency_budget=1.0)
+    with pytest.raises(RuntimeError):
+        model.generate_content("hi")
+    assert model.generate_content("hi").text == "primary"
+
+
+def test_an_open_circuit_fails_before_calling_any_model(models, breaker):
+    models["primary"], models["fallback"] = FakeModel("primary"), FakeModel("fallback")
+    breaker._open(time.monotonic())
+    model = RoutedModel("task", "primary", "fallback", latency_budget=1.0)
+    with pytest.raises(CircuitOpenError):
+        model.generate_content("hi")
+    assert models["primary"].calls == models["fallback"].calls == 0
+
+
+def test_no_fallback_once_the_failure_opened_the_circuit(models, monkeypatch):
+    breaker = CircuitBreaker(error_rate=0.5, slow_seconds=10.0, min_calls=1, window=60.0, open_seconds=30.0)
+    monkeypatch.setattr(routing, "get_breaker", lambda: breaker)
+    models["primary"], models["fallback"] = FakeModel("primary", fail=["all"]), FakeModel("fallback")
+    model = RoutedModel("task", "primary", "fallback", latency_budget=1.0)
+    with pytest.raises(RuntimeError):
+        model.generate_content("hi")
+    assert models["fallback"].calls == 0
+
+
+def test_task_overrides_come_from_settings(monkeypatch):
+    settings = dataclasses.replace(get_settings(), model_routes='{"moderation": {"primary": "models/x"}, "new": {"primary": "models/y"}}')
+    monkeypatch.setattr(routing, "get_settings", lambda: settings)
+    table = routing.routes()
+    assert table["moderation"]["primary"] == "models/x"
+    assert table["moderation"]["fallback"] == routing.DEFAULT_ROUTES["moderation"]["fallback"]
+    assert table["new"] == {"primary": "models/y", "latency_budget": 10.0}
+
+
+@pytest.fixture
+def hedge_budget(monkeypatch):
+    def set_budget(budget):
+        settings = dataclasses.replace(get_settings(), hedge_budget=budget, hedge_percentile=0.95)
+        monkeypatch.setattr(routing, "get_settings", lambda: settings)
+    set_budget(1.0)
+    return set_budget
+
+
+def hedged_model():
+    # until latencies are learned the hedge deadline is half the budget, 0.05s
+    return RoutedModel("task", "primary", None, latency_budget=0.1, hedge=True)
+
+
+def test_a_slow_call_is_hedged_and_the_first_answer_wins(models, hedge_budget):
+    models["primary"] = FakeModel("primary", slow=[1])
+    model = hedged_model()
+    assert model.generate_content("hi").text == "primary 2"
+    assert model.hedge_stats() == {"calls": 1, "hedged": 1, "hedge_wins": 1, "hedge_rate": 1.0}
+
+
+def test_a_fast_call_is_not_hedged(models, hedge_budget):
+    models["primary"] = FakeModel("primary", slow=[2])
+    model = hedged_model()
+    assert model.generate_content("hi").text == "primary 1"
+    assert models["primary"].calls == 1
+    assert model.hedge_stats()["hedged"] == 0
+
+
+def test_a_failed_hedge_waits_for_the_original_call(models, hedge_budget):
+    models["primary"] = FakeModel("primary", slow=[1], fail=[2])
+    model = hedged_model()
+    assert model.generate_content("hi").text == "primary 1"
+    assert model.hedge_stats()["hedge_wins"] == 0
+
+
+def test_hedges_stay_within_the_budget(models, hedge_budget):
+    hedge_budget(0.5)
+    models["primary"] = FakeModel("primary", slow=[1, 2, 4])
+    model = hedged_model()
+    # the first call may not hedge (1 > 0.5 * 1); the second may (1 <= 0.5 * 2)
+    assert model.generate_content("hi").text == "primary 1"
+    assert model.generate_content("hi").text == "primary 3"
+    assert model.hedge_stats()["hedged"] == 1
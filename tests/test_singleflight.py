@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from core.singleflight import SingleFlight
+
+
+class Work:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(self.delay)
+        return f"result {call}"
+
+
+def test_concurrent_callers_share_one_run():
+    async def main():
+        flight, work = SingleFlight("test"), Work()
+        results = await asyncio.gather(*(flight.do("k", work) for _ in range(5)), flight.do("other", work))
+        assert results == ["result 1"] * 5 + ["result 2"]
+        assert work.calls == 2
+        # without share_ttl nothing is kept once the run finished
+        assert await flight.do("k", work) == "result 3"
+
+    asyncio.run(main())
+
+
+def test_a_cancelled_caller_does_not_cancel_the_run():
+    async def main():
+        flight, work = SingleFlight("test"), Work()
+        impatient = asyncio.create_task(flight.do("k", work))
+        patient = asyncio.create_task(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        assert await patient == "result 1"
+        with pytest.raises(asyncio.CancelledError):
+            await impatient
+
+    asyncio.run(main())
+
+
+def test_a_failure_reaches_every_caller_and_is_not_kept():
+    async def main():
+        flight = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+
+        results = await asyncio.gather(flight.do("k", fail), flight.do("k", fail), return_exceptions=True)
+        assert [str(r) for r in results] == ["boom", "boom"]
+        assert await flight.do("k", Work()) == "result 1"
+
+    asyncio.run(main())
+
+
+def test_with_share_ttl_other_workers_reuse_the_result(shared_cache):
+    async def main():
+        work = Work()
+        # two instances stand in for two workers of the host
+        first, second = SingleFlight("test"), SingleFlight("test")
+        results = await asyncio.gather(first.do("k", work, share_ttl=60), second.do("k", work, share_ttl=60))
+        assert results == ["result 1", "result 1"]
+        assert await second.do("k", work, share_ttl=60) == "result 1"
+        assert work.calls == 1
+
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+import dataclasses
+import io
+import os
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from core.settings import get_settings
+from routes import syllabus
+
+BOUNDARY = "testboundary"
+
+
+@pytest.fixture
+def built():
+    """(subject_id, file content) of every syllabus built."""
+    return []
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, supabase, shared_cache, built):
+    settings = dataclasses.replace(get_settings(), upload_dir=str(tmp_path / "uploads"), max_upload_mb=1)
+    monkeypatch.setattr(syllabus, "get_settings", lambda: settings)
+    monkeypatch.setattr(syllabus, "_job_slots", None)
+    supabase.tables["subjects"] = [{"id": "s1", "name": "History", "syllabus": None}]
+
+    def build_syllabus(job_id, subject_id, path):
+        with open(path, encoding="utf-8") as f:
+            built.append((subject_id, f.read()))
+        syllabus.set_job(job_id, status="done")
+
+    monkeypatch.setattr(syllabus, "build_syllabus", build_syllabus)
+    app = FastAPI()
+    app.include_router(syllabus.router)
+    with TestClient(app) as client:
+        yield client
+
+
+def multipart(filename, content: bytes) -> bytes:
+    return (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode() + content + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def upload(client, filename, content, subject_id="s1", chunked=False):
+    body = multipart(filename, content)
+    # a generator body goes out chunked, without Content-Length
+    data = (body[i:i + 64 * 1024] for i in range(0, len(body), 64 * 1024)) if chunked else body
+    return client.post(f"/subjects/{subject_id}/syllabus", content=data,
+                       headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"})
+
+
+def wait_for(client, job_id):
+    for _ in range(100):
+        job = client.get(f"/syllabus-jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    pytest.fail("job did not finish")
+
+
+def test_an_upload_is_stored_processed_in_the_background_and_removed(client, built, tmp_path):
+    response = upload(client, "Syllabus.TXT", "Chapter 1: Rome".encode())
+    assert response.status_code == 202
+    job = response.json()
+    assert (job["status"], job["filename"], job["size"]) == ("queued", "Syllabus.TXT", 15)
+    assert wait_for(client, job["id"])["status"] == "done"
+    assert built == [("s1", "Chapter 1: Rome")]
+    assert list((tmp_path / "uploads").glob("*")) == []
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_an_oversized_upload_is_refused(client, built, tmp_path, chunked):
+    response = upload(client, "big.txt", b"x" * (1024 * 1024 + 1), chunked=chunked)
+    assert response.status_code == 413
+    assert built == []
+    assert list((tmp_path / "uploads").glob("*")) == []
+
+
+def test_unsupported_files_and_unknown_subjects_are_refused(client):
+    assert upload(client, "notes.exe", b"MZ").status_code == 415
+    assert upload(client, "notes.txt", b"text", subject_id="nope").status_code == 404
+
+
+def test_save_upload_leaves_no_file_past_the_limit(tmp_path):
+    path = str(tmp_path / "out.txt")
+    assert syllabus.save_upload(io.BytesIO(b"x" * 10), path, max_bytes=10) == 10
+    assert syllabus.save_upload(io.BytesIO(b"x" * 11), path, max_bytes=10) is None
+    assert not os.path.exists(path)